@@ -38,4 +38,10 @@ def verify_token(authorization: str = Header(None)):
         return payload
         
     except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+def verify_token_optional(authorization: str = Header(None)):
+    """Verify JWT token if present, returning None for anonymous requests"""
+    if not authorization:
+        return None
+    return verify_token(authorization)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Reconstrói as métricas de atendimento (metrics_rollups) a partir do histórico
+Uso: python backfill_metrics.py [--start 2024-01-01] [--end 2024-12-31] [--workers 4]
+
+O período é alinhado a dias inteiros (UTC). Por padrão vai da primeira
+conversa até hoje às 00:00 UTC; eventos de hoje são gravados em tempo real
+pelo backend e não devem ser reconstruídos. Cada dia é um bloco processado
+em paralelo com os demais.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from metrics import backfill_rollups, bucket_start
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+def report_progress(done: int, total: int, elapsed: float):
+    print(f"   {done}/{total} dias ({elapsed:.1f}s)", end='\r')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reconstrói metrics_rollups a partir das conversas")
+    parser.add_argument('--start', type=parse_date, help="primeiro dia (AAAA-MM-DD)")
+    parser.add_argument('--end', type=parse_date, help="dia final, exclusivo (AAAA-MM-DD)")
+    parser.add_argument('--workers', type=int, default=4, help="dias processados em paralelo")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[os.environ.get('DB_NAME', 'chat_db')]
+
+    try:
+        today = bucket_start(datetime.now(timezone.utc), "day")
+        end = args.end or today
+        if end > today:
+            print("❌ O período não pode incluir hoje; esses eventos são gravados em tempo real")
+            return 1
+
+        start = args.start
+        if start is None:
+            first = await db.conversations.find_one({}, {"_id": 0, "created_at": 1}, sort=[("created_at", 1)])
+            if first is None:
+                print("✓ Nenhuma conversa no histórico")
+                return 0
+            start = first['created_at'].replace(tzinfo=timezone.utc)
+        if start >= end:
+            print("❌ Período vazio")
+            return 1
+
+        print(f"⏳ Reconstruindo métricas de {start:%Y-%m-%d} a {end:%Y-%m-%d} com {args.workers} workers...")
+        started = time.perf_counter()
+        conversations = await backfill_rollups(db, start, end, workers=args.workers, progress=report_progress)
+        elapsed = time.perf_counter() - started
+        print(f"\n✓ {conversations} conversas processadas em {elapsed:.1f}s")
+        return 0
+
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Mede a entrega entre workers do barramento de eventos (backend mongo)
+Uso: python bench_bus.py [--count 20000] [--rate 0] [--topics 100]
+
+Cria dois barramentos, como se fossem dois workers, sobre um banco
+temporário em MONGO_URL: um publica, o outro recebe pelo cursor tailable.
+Com --rate 0 publica o mais rápido possível; caso contrário, eventos por
+segundo. Mostra vazão, documentos gravados e latência de entrega.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from bus import MessageBus, BUS_BATCH_SIZE, BUS_LINGER_MS
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark do barramento entre workers")
+    parser.add_argument('--count', type=int, default=20_000)
+    parser.add_argument('--rate', type=int, default=0, help="eventos por segundo (0 = sem limite)")
+    parser.add_argument('--topics', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=BUS_BATCH_SIZE)
+    parser.add_argument('--linger-ms', type=float, default=BUS_LINGER_MS)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db_name = f"bus_bench_{uuid.uuid4().hex[:8]}"
+    db = client[db_name]
+    publisher = MessageBus(backend="mongo", batch_size=args.batch_size, linger_ms=args.linger_ms,
+                           queue_size=args.count, db=db)
+    receiver = MessageBus(backend="mongo", batch_size=args.batch_size, linger_ms=args.linger_ms,
+                          queue_size=args.count, db=db)
+    topics = [f"conversation:{i}" for i in range(args.topics)]
+
+    try:
+        await publisher.start()
+        await receiver.start()
+        subscription = receiver.subscribe(topics)
+        await asyncio.sleep(0.5)  # let the receiver's tail reach the end
+
+        latencies = []
+
+        async def consume():
+            while len(latencies) < args.count:
+                event = await subscription.get(timeout=10)
+                if event is None:
+                    break
+                latencies.append(time.time() - event['published_at'])
+
+        consumer = asyncio.create_task(consume())
+        print(f"\n⏳ Publicando {args.count} eventos em {args.topics} tópicos "
+              f"(lote {args.batch_size}, espera {args.linger_ms} ms)...")
+        started = time.perf_counter()
+        for i in range(args.count):
+            publisher.publish(topics[i % len(topics)], "message", {"seq": i, "text": "x" * 64})
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+            elif i % args.batch_size == 0:
+                await asyncio.sleep(0)
+        published = time.perf_counter() - started
+        await consumer
+        elapsed = time.perf_counter() - started
+
+        print("\n📊 Barramento entre workers")
+        print(f"   Publicados:     {args.count} em {published * 1000:.0f} ms "
+              f"({args.count / published:,.0f}/s)")
+        print(f"   Recebidos:      {len(latencies)} em {elapsed * 1000:.0f} ms "
+              f"({len(latencies) / elapsed:,.0f}/s)")
+        print(f"   Documentos:     {publisher.batches} "
+              f"({args.count / max(publisher.batches, 1):.0f} eventos por documento)")
+        if latencies:
+            print(f"   Latência:       p50 {percentile(latencies, 0.5) * 1000:.1f} ms   "
+                  f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms   "
+                  f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+        return 0 if len(latencies) == args.count else 1
+
+    finally:
+        await publisher.stop()
+        await receiver.stop()
+        await client.drop_database(db_name)
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
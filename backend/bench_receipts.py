@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Mede digitando e confirmações de leitura pelos endpoints e pelo barramento
+Uso: python bench_receipts.py [--conversations 100] [--seconds 10]
+
+Sobe a API em processo sobre um banco temporário em MONGO_URL, com o
+barramento mongo, e cria um segundo barramento, como se fosse o worker
+que mantém os streams dos clientes. Cada conversa digita 5 vezes por
+segundo e, a cada 6 s, recebe uma mensagem que é confirmada como entregue
+e lida duas vezes. Mostra requisições por segundo, leituras do banco por
+requisição e a latência de entrega no outro worker.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+os.environ['BUS_BACKEND'] = 'mongo'
+
+import database
+from bus import MessageBus, message_bus, conversation_topic
+from ids import id_query, new_id, stored
+from receipts import receipts
+from server import app
+
+TICKS_PER_SECOND = 5
+MESSAGE_EVERY_TICKS = 30
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de digitando e confirmações pelos endpoints")
+    parser.add_argument('--conversations', type=int, default=100)
+    parser.add_argument('--seconds', type=int, default=10)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db_name = f"receipts_bench_{uuid.uuid4().hex[:8]}"
+    database.client = client
+    database.db = db = client[db_name]
+    other_worker = MessageBus(backend="mongo", queue_size=1_000_000, db=db)
+
+    now = datetime.now(timezone.utc)
+    conversations = [new_id() for _ in range(args.conversations)]
+    await db.conversations.insert_many([
+        stored({"id": conversation_id, "status": "active", "message_seq": 0, "created_at": now})
+        for conversation_id in conversations
+    ])
+
+    try:
+        await message_bus.start()
+        await other_worker.start()
+        subscription = other_worker.subscribe([conversation_topic(c) for c in conversations])
+        await asyncio.sleep(0.5)  # let the other worker's tail reach the end
+
+        latencies = []
+
+        async def consume():
+            while True:
+                event = await subscription.get(timeout=2)
+                if event is None:
+                    break
+                latencies.append(time.time() - event['published_at'])
+
+        consumer = asyncio.create_task(consume())
+        statuses = {}
+        requests = 0
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+
+            async def post(path: str, body: dict = None):
+                response = await http.post(f"/api/conversations/{path}", json=body)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            print(f"\n⏳ {args.conversations} conversas por {args.seconds} s...")
+            started = time.perf_counter()
+            for tick in range(args.seconds * TICKS_PER_SECOND):
+                tick_started = time.perf_counter()
+                calls = []
+                for index, conversation_id in enumerate(conversations):
+                    calls.append(post(f"{conversation_id}/typing"))
+                    if (tick + index) % MESSAGE_EVERY_TICKS == 0:
+                        seq = (tick + index) // MESSAGE_EVERY_TICKS + 1
+                        await db.conversations.update_one(id_query(conversation_id), {"$set": {"message_seq": seq}})
+                        calls.append(post(f"{conversation_id}/delivered", {"seq": seq}))
+                        calls.append(post(f"{conversation_id}/read", {"seq": seq}))
+                        calls.append(post(f"{conversation_id}/read", {"seq": seq}))
+                await asyncio.gather(*calls)
+                requests += len(calls)
+                await asyncio.sleep(max(0.0, 1 / TICKS_PER_SECOND - (time.perf_counter() - tick_started)))
+            elapsed = time.perf_counter() - started
+            await receipts.flush()
+        await consumer
+
+        stats = receipts.stats()
+        print("\n📊 Digitando e confirmações pelos endpoints")
+        print(f"   Requisições:    {requests} em {elapsed * 1000:.0f} ms ({requests / elapsed:,.0f}/s)   "
+              f"status: {dict(sorted(statuses.items()))}")
+        print(f"   Leituras:       {stats['lookups']} ({stats['lookups'] / max(requests, 1):.2f} por requisição)")
+        print(f"   Publicados:     {sum(stats['published'].values())}   "
+              f"recebidos no outro worker: {len(latencies)}   gravações: {stats['persisted']}")
+        if latencies:
+            print(f"   Latência:       p50 {percentile(latencies, 0.5) * 1000:.1f} ms   "
+                  f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms   "
+                  f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+        return 0 if len(latencies) == sum(stats['published'].values()) else 1
+
+    finally:
+        await message_bus.stop()
+        await other_worker.stop()
+        await client.drop_database(db_name)
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+"""
+Benchmarks dos componentes em memória do backend
+Uso: python benchmarks.py [nome ...]
+"""
+
+import sys
+import time
+import random
+
+
+def _report(label: str, count: int, elapsed: float):
+    """Print throughput and per-operation latency"""
+    per_op_us = (elapsed / count) * 1_000_000 if count else 0
+    print(f"   {label:<40} {count:>8} ops  {elapsed * 1000:>9.1f} ms  {per_op_us:>8.2f} µs/op")
+
+
+def bench_routing():
+    """Routing engine with 10k queued conversations and 1k agents"""
+    from routing import RoutingEngine, LEAST_LOADED, ROUND_ROBIN
+
+    teams = [f"team-{i}" for i in range(20)]
+    for policy in (LEAST_LOADED, ROUND_ROBIN):
+        print(f"\n📊 Roteamento ({policy})")
+        engine = RoutingEngine(policy=policy, default_capacity=10)
+
+        start = time.perf_counter()
+        for i in range(1_000):
+            engine.add_agent(f"agent-{i}", team_id=teams[i % len(teams)])
+        _report("add_agent", 1_000, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(10_000):
+            engine.enqueue(f"conv-{i}", team_id=random.choice(teams), priority=random.randint(0, 3))
+        _report("enqueue", 10_000, time.perf_counter() - start)
+
+        assigned = []
+        start = time.perf_counter()
+        for team_id in teams:
+            while True:
+                pair = engine.assign_next(team_id)
+                if pair is None:
+                    break
+                assigned.append(pair)
+        _report("assign_next", len(assigned), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _, agent_id in assigned:
+            engine.release(agent_id)
+        _report("release", len(assigned), time.perf_counter() - start)
+
+
+def bench_timers():
+    """Timer wheel with 100k session deadlines"""
+    from timers import TimerWheel
+
+    print("\n📊 Timer wheel")
+    now = 1_700_000_000.0
+    wheel = TimerWheel(now=now)
+
+    start = time.perf_counter()
+    for i in range(100_000):
+        wheel.schedule(f"conv-{i}", now + random.randint(60, 86_400))
+    _report("schedule", 100_000, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(100_000):
+        wheel.schedule(f"conv-{i}", now + random.randint(60, 86_400))
+    _report("reset (reschedule)", 100_000, time.perf_counter() - start)
+
+    fired = 0
+    start = time.perf_counter()
+    for second in range(1, 86_401):
+        fired += len(wheel.advance(now + second))
+    _report("advance 24h (1s ticks), timers fired", fired, time.perf_counter() - start)
+
+
+def bench_presence():
+    """5k agents heartbeating every 10 seconds on one worker"""
+    from presence import PresenceService
+
+    print("\n📊 Presença")
+    service = PresenceService()
+    service._on_change = lambda entry: None  # isolate from the routing engine
+    teams = [f"team-{i}" for i in range(50)]
+    now = 1_700_000_000.0
+
+    start = time.perf_counter()
+    for i in range(5_000):
+        service.heartbeat(f"agent-{i}", team_id=teams[i % len(teams)], now=now)
+    _report("first heartbeat (status change)", 5_000, time.perf_counter() - start)
+
+    # One minute of traffic: 6 rounds of 5k heartbeats
+    start = time.perf_counter()
+    for round_ in range(1, 7):
+        for i in range(5_000):
+            service.heartbeat(f"agent-{i}", team_id=teams[i % len(teams)], now=now + round_ * 10)
+        service.expire(now + round_ * 10)
+    elapsed = time.perf_counter() - start
+    _report("steady heartbeat", 30_000, elapsed)
+    print(f"   CPU para 500 heartbeats/s: {elapsed / 60 * 100:.2f}% de um núcleo")
+
+    start = time.perf_counter()
+    for _ in range(10_000):
+        service.team_counts(random.choice(teams))
+    _report("team_counts", 10_000, time.perf_counter() - start)
+
+    print(f"   Alterações pendentes de persistência após 1 min: {len(service.drain_dirty(now + 60))}")
+
+
+def bench_ratelimit():
+    """Login throttling checks for 100k distinct IPs"""
+    from ratelimit import LoginGuard
+
+    print("\n📊 Limite de tentativas de login")
+    guard = LoginGuard(shared=False)
+    ips = [f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}" for i in range(100_000)]
+
+    start = time.perf_counter()
+    for ip in ips:
+        guard.check_local(ip, "admin@example.com")
+    _report("check (new keys)", len(ips), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(5):
+        for ip in ips:
+            guard.check_local(ip, ip)
+    _report("check (existing keys)", 5 * len(ips), time.perf_counter() - start)
+
+    rejected = 0
+    start = time.perf_counter()
+    for _ in range(100_000):
+        rejected += bool(guard.check_local("203.0.113.7", "admin"))
+    _report("check (burst from one IP)", 100_000, time.perf_counter() - start)
+    print(f"   Tentativas rejeitadas sem verificar senha: {rejected}")
+
+
+def bench_login():
+    """Login checks per second on one core, known vs unknown users"""
+    from passlib.context import CryptContext
+    from login_shield import BloomFilter
+
+    print("\n📊 Login (por núcleo, sem o piso de latência)")
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    password_hash = context.hash("senha-correta")
+
+    known = BloomFilter(400_000)
+    for i in range(100_000):
+        known.add(f"agente{i}")
+        known.add(f"agente{i}@exemplo.com.br")
+
+    start = time.perf_counter()
+    for i in range(100_000):
+        f"agente{i}" in known
+    _report("filter lookup (known)", 100_000, time.perf_counter() - start)
+
+    unknown = [f"intruso{i}@exemplo.com" for i in range(100_000)]
+    passed = 0
+    start = time.perf_counter()
+    for login in unknown:
+        passed += login in known
+    filter_elapsed = time.perf_counter() - start
+    _report("filter lookup (unknown)", len(unknown), filter_elapsed)
+    print(f"   Falsos positivos: {passed / len(unknown):.2%}")
+
+    start = time.perf_counter()
+    for _ in range(10):
+        context.verify("senha-errada", password_hash)
+    per_hash = (time.perf_counter() - start) / 10
+    _report("bcrypt verify", 10, per_hash * 10)
+
+    # False positives still pay a user lookup and a dummy hash
+    unknown_cost = filter_elapsed + passed * per_hash
+    print(f"   Logins de usuários existentes/s: {1 / per_hash:,.1f}")
+    print(f"   Logins desconhecidos/s, hash fictício em todos: {1 / per_hash:,.1f}")
+    print(f"   Logins desconhecidos/s, com filtro: {len(unknown) / unknown_cost:,.0f}")
+
+
+def bench_ids():
+    """Document and index key size of string ids vs binary UUID _id"""
+    import uuid
+    import bson
+    from bson import ObjectId
+    from ids import binary_document, doc_id
+
+    print("\n📊 Ids (documento de mensagem típico)")
+    messages = [
+        {
+            "_id": ObjectId(),
+            "id": str(uuid.uuid4()),
+            "conversation_id": str(uuid.uuid4()),
+            "seq": i,
+            "sender_type": "client",
+            "sender_id": None,
+            "text": "Olá, preciso de ajuda com meu pedido",
+        }
+        for i in range(100_000)
+    ]
+    string_size = sum(len(bson.encode(message)) for message in messages)
+
+    start = time.perf_counter()
+    converted = [binary_document(message) for message in messages]
+    _report("binary_document", len(messages), time.perf_counter() - start)
+    binary_size = sum(len(bson.encode(message)) for message in converted)
+
+    start = time.perf_counter()
+    for message in converted:
+        doc_id(message)
+    _report("doc_id (binary)", len(converted), time.perf_counter() - start)
+
+    print(f"   Documento médio: {string_size / len(messages):.0f} B -> {binary_size / len(messages):.0f} B")
+    # Index keys: ObjectId _id + string id vs a single binary _id
+    string_keys = len(bson.encode({"": ObjectId()})) + len(bson.encode({"": messages[0]["id"]}))
+    binary_keys = len(bson.encode({"": converted[0]["_id"]}))
+    print(f"   Chaves de índice por documento: {string_keys} B em 2 índices -> {binary_keys} B em 1 índice")
+    print(f"   Economia para 1M documentos: {(string_size - binary_size) * 10 / 1024 / 1024:.1f} MB de dados, "
+          f"{(string_keys - binary_keys) * 1_000_000 / 1024 / 1024:.1f} MB de chaves de índice")
+
+
+def bench_metrics():
+    """Rollup accumulation for 100k conversations and a one-year report"""
+    from datetime import datetime, timedelta, timezone
+    from metrics import RollupAccumulator, rollup_updates, summarize
+
+    print("\n📊 Métricas de atendimento")
+    channels = [f"channel-{i}" for i in range(50)]
+    agents = [f"agent-{i}" for i in range(200)]
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    conversations = []
+    for i in range(100_000):
+        created = start + timedelta(seconds=random.randint(0, 30 * 86_400))
+        assigned = created + timedelta(seconds=random.randint(5, 600))
+        conversations.append({
+            "channel_id": random.choice(channels),
+            "team_id": None,
+            "assignee_id": random.choice(agents),
+            "created_at": created,
+            "assigned_at": assigned,
+            "closed_at": assigned + timedelta(seconds=random.randint(60, 3_600))
+        })
+
+    accumulator = RollupAccumulator()
+    start_time = time.perf_counter()
+    for conversation in conversations:
+        accumulator.add(conversation)
+    _report("record (3 events)", len(conversations), time.perf_counter() - start_time)
+    pending = len(accumulator)
+    # As recorded live, so no bucket is past its retention yet
+    updates = rollup_updates(accumulator.drain(), now=start)
+    print(f"   Upserts após coalescer 30 dias: {len(updates)} (vs {len(conversations) * 3 * 3 * 4} sem coalescer)")
+
+    # A year of daily buckets for every channel, as grouped by get_metric_rollups
+    def series(channel):
+        points = [
+            {"bucket": (start + timedelta(days=day)).replace(tzinfo=None), "created": 40, "assigned": 38,
+             "closed": 40, "handled": 38, "abandoned": 2, "avg_wait_seconds": 45.0, "avg_handle_seconds": 600.0}
+            for day in range(365)
+        ]
+        return {"_id": channel, "points": points, "created": 40 * 365, "assigned": 38 * 365,
+                "wait_ms": 38 * 365 * 45_000, "closed": 40 * 365, "handled": 38 * 365,
+                "handle_ms": 38 * 365 * 600_000, "abandoned": 2 * 365}
+
+    elapsed = 0.0
+    for _ in range(100):
+        groups = [series(channels[0])]
+        start_time = time.perf_counter()
+        summarize(groups)
+        elapsed += time.perf_counter() - start_time
+    _report("summarize 1 ano, 1 série (365 pontos)", 100, elapsed)
+
+    elapsed = 0.0
+    for _ in range(10):
+        groups = [series(channel) for channel in channels]
+        start_time = time.perf_counter()
+        summarize(groups)
+        elapsed += time.perf_counter() - start_time
+    _report(f"summarize 1 ano x {len(channels)} canais ({len(channels) * 365} pontos)", 10, elapsed)
+    assert pending == len(updates)
+
+
+def bench_exports():
+    """Conversation export of 200k rows in batches, vectorized vs per row"""
+    import csv
+    import io
+    import uuid
+    from datetime import datetime, timedelta, timezone
+    from exports import (
+        AgentPerformance, CsvEncoder, conversation_frame, parquet_available, ParquetEncoder,
+        AGENT_COLUMNS, CONVERSATION_COLUMNS, EXPORT_BATCH_SIZE
+    )
+
+    print("\n📊 Exportação")
+    agents = [str(uuid.uuid4()) for _ in range(200)]
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for _ in range(200_000):
+        created = start + timedelta(seconds=random.randint(0, 30 * 86_400))
+        assigned = created + timedelta(seconds=random.randint(5, 600))
+        docs.append({
+            "id": str(uuid.uuid4()),
+            "channel_id": "channel",
+            "team_id": None,
+            "assignee_id": random.choice(agents),
+            "client_name": "Visitante",
+            "status": "closed",
+            "priority": 0,
+            "created_at": created,
+            "assigned_at": assigned,
+            "closed_at": assigned + timedelta(seconds=random.randint(60, 3_600))
+        })
+    batches = [docs[i:i + EXPORT_BATCH_SIZE] for i in range(0, len(docs), EXPORT_BATCH_SIZE)]
+
+    start_time = time.perf_counter()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CONVERSATION_COLUMNS)
+    for doc in docs:
+        wait = (doc["assigned_at"] - doc["created_at"]).total_seconds()
+        handle = (doc["closed_at"] - doc["assigned_at"]).total_seconds()
+        writer.writerow([doc[field] for field in list(CONVERSATION_COLUMNS)[:10]] + [wait, handle])
+    _report("csv por linha", len(docs), time.perf_counter() - start_time)
+
+    encoders = [("csv", CsvEncoder)] + ([("parquet", ParquetEncoder)] if parquet_available() else [])
+    for name, encoder_class in encoders:
+        encoder = encoder_class(CONVERSATION_COLUMNS)
+        size = 0
+        start_time = time.perf_counter()
+        for batch in batches:
+            size += len(encoder.encode(conversation_frame(batch)))
+        size += len(encoder.close())
+        _report(f"{name} em lotes de {EXPORT_BATCH_SIZE}", len(docs), time.perf_counter() - start_time)
+        print(f"   Tamanho {name}: {size / 1024 / 1024:.1f} MB")
+
+    frames = [conversation_frame(batch) for batch in batches]
+    performance = AgentPerformance()
+    start_time = time.perf_counter()
+    for frame in frames:
+        performance.add(frame)
+    result = performance.result()
+    _report(f"desempenho por agente ({len(result)} agentes)", len(docs), time.perf_counter() - start_time)
+    assert list(result.columns) == list(AGENT_COLUMNS) and result["assigned"].sum() == len(docs)
+
+
+def bench_bus():
+    """In-process bus fan-out: 1k subscriptions over 100 topics"""
+    import asyncio
+    from bus import MessageBus
+
+    async def run():
+        print("\n📊 Barramento (memória)")
+        bus = MessageBus(backend="memory", queue_size=1_000_000)
+        topics = [f"conversation:{i}" for i in range(100)]
+        subscriptions = [bus.subscribe([topics[i % len(topics)]]) for i in range(1_000)]
+
+        start_time = time.perf_counter()
+        for i in range(100_000):
+            bus.publish(topics[i % len(topics)], "message", {"seq": i})
+        elapsed = time.perf_counter() - start_time
+        _report("publish (10 assinantes por tópico)", 100_000, elapsed)
+
+        start_time = time.perf_counter()
+        received = 0
+        for subscription in subscriptions:
+            while await subscription.get(timeout=0) is not None:
+                received += 1
+        _report("get", received, time.perf_counter() - start_time)
+        print(f"   Entregas por segundo: {received / elapsed:,.0f}")
+        print("   Entre workers (MongoDB): python bench_bus.py")
+
+    asyncio.run(run())
+
+
+def bench_writes():
+    """Write-behind batching of concurrent message inserts (simulated 1 ms round trip)"""
+    import asyncio
+    from write_buffer import WriteBehindBuffer
+
+    class SimulatedCollection:
+        """Each call costs a round trip plus a little per document"""
+
+        async def insert_one(self, document):
+            await asyncio.sleep(0.001)
+
+        async def insert_many(self, documents, ordered=True):
+            await asyncio.sleep(0.001 + 0.000002 * len(documents))
+
+    async def send(write, count: int, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                await write({"seq": i})
+
+        await asyncio.gather(*(one(i) for i in range(count)))
+
+    async def run():
+        print("\n📊 Gravação de mensagens (ida e volta simulada de 1 ms)")
+        collection = SimulatedCollection()
+        start_time = time.perf_counter()
+        await send(collection.insert_one, 1_000, 1)
+        _report("insert_one sequencial", 1_000, time.perf_counter() - start_time)
+
+        for concurrency in (10, 100, 1_000):
+            buffer = WriteBehindBuffer("messages")
+            buffer._collection = lambda: collection
+            await buffer.start()
+            start_time = time.perf_counter()
+            await send(buffer.write, 10_000, concurrency)
+            _report(f"buffer, {concurrency} remetentes", 10_000, time.perf_counter() - start_time)
+            await buffer.stop()
+            stats = buffer.stats()
+            print(f"   {'':<40} {stats['batches']} lotes, média {stats['avg_batch']}, "
+                  f"flush p50 {stats['flush_ms_p50']} ms")
+
+    asyncio.run(run())
+
+
+def bench_receipts():
+    """Typing and read receipts of 1k conversations over a simulated minute"""
+    import asyncio
+    from bus import message_bus, conversation_topic
+    from receipts import ReceiptTracker
+
+    async def run():
+        print("\n📊 Digitando e confirmações de leitura")
+        tracker = ReceiptTracker()
+        conversations = [f"conv-{i}" for i in range(1_000)]
+        subscriptions = [message_bus.subscribe([conversation_topic(c)]) for c in conversations for _ in range(2)]
+
+        # 5 keystrokes/s from each side, a message every 6 s read by the other side
+        # twice (open tab + scroll), flushes every RECEIPTS_FLUSH_INTERVAL
+        calls = 0
+        writes = 0
+        start_time = time.perf_counter()
+        for tick in range(60 * 5):
+            now = 1_700_000_000 + tick / 5
+            for index, conversation_id in enumerate(conversations):
+                tracker.typing(conversation_id, "client", now=now)
+                tracker.typing(conversation_id, "agent", now=now)
+                calls += 2
+                if (tick + index) % 30 == 0:
+                    seq = (tick + index) // 30 + 1
+                    for participant in ("client", "agent"):
+                        tracker.delivered(conversation_id, participant, seq)
+                        tracker.read(conversation_id, participant, seq)
+                        tracker.read(conversation_id, participant, seq)
+                        calls += 3
+            if tick % int(tracker.flush_interval * 5) == 0:
+                writes += len(tracker._dirty)
+                tracker._dirty.clear()
+        elapsed = time.perf_counter() - start_time
+        writes += len(tracker._dirty)
+        _report("typing/delivered/read", calls, elapsed)
+
+        delivered = sum(s._queue.qsize() for s in subscriptions)
+        stats = tracker.stats()
+        print(f"   Recebidos: {sum(stats['received'].values())}   publicados: {sum(stats['published'].values())}   "
+              f"entregas: {delivered}")
+        print(f"   Gravações: {writes} (vs {stats['received']['read']} gravando cada leitura, "
+              f"{sum(stats['received'].values())} gravando tudo)")
+        print("   Pelos endpoints e entre workers (MongoDB): python bench_receipts.py")
+
+    asyncio.run(run())
+
+
+
+def bench_canned_replies():
+    """Canned replies: 20 teams of 5k replies plus 2k global ones"""
+    import asyncio
+    from canned_replies import CannedReplyCache, ReplyIndex
+
+    words = ["plano", "fatura", "segunda", "via", "boleto", "internet", "lenta", "visita", "tecnico",
+             "cancelamento", "mudanca", "endereco", "saudacao", "agradecimento", "aguarde", "protocolo"]
+
+    def replies(scope: str, count: int):
+        return [
+            {"id": f"{scope}-{i}", "team_id": scope, "shortcut": f"{words[i % len(words)]}{i}",
+             "title": " ".join(random.sample(words, 3)).capitalize(), "content": "x" * 200}
+            for i in range(count)
+        ]
+
+    async def run():
+        print("\n📊 Mensagens predefinidas")
+        cache = CannedReplyCache(ttl=3600)
+        teams = [f"team-{i}" for i in range(20)]
+
+        scopes = {team_id: replies(team_id, 5_000) for team_id in teams}
+        scopes[None] = replies("global", 2_000)
+        start = time.perf_counter()
+        now = time.monotonic()
+        for team_id, scope_replies in scopes.items():
+            cache._indexes[team_id] = ReplyIndex(scope_replies, now)
+        _report("build index per scope (102k replies)", len(scopes), time.perf_counter() - start)
+
+        shortcuts = [reply for team_id in teams for reply in cache._indexes[team_id].by_shortcut]
+        random.shuffle(shortcuts)
+        start = time.perf_counter()
+        for i, shortcut in enumerate(shortcuts[:100_000]):
+            await cache.expand(teams[i % len(teams)], "/" + shortcut)
+        _report("expand /shortcut", min(len(shortcuts), 100_000), time.perf_counter() - start)
+
+        # What an agent types one keystroke at a time
+        typed = [word[:length] for word in words for length in range(1, len(word) + 1)]
+        for label, prefix in (("search /prefix (shortcuts)", "/"), ("search prefix (shortcuts + titles)", "")):
+            start = time.perf_counter()
+            found = 0
+            for i in range(10_000):
+                found += len(await cache.search(teams[i % len(teams)], prefix + typed[i % len(typed)]))
+            _report(label, 10_000, time.perf_counter() - start)
+
+        scanned = [reply for team_id in (teams[0], None) for reply in cache._indexes[team_id].by_shortcut.values()]
+        start = time.perf_counter()
+        for i in range(100):
+            term = typed[i % len(typed)]
+            [reply for reply in scanned if term in reply['shortcut'] or term in reply['title'].lower()][:20]
+        _report("linear scan for comparison (7k replies)", 100, time.perf_counter() - start)
+
+    asyncio.run(run())
+
+
+
+def bench_media():
+    """Streaming a 256 MB multipart upload to local storage, then range reads"""
+    import asyncio
+    import hashlib
+    import os
+    import tempfile
+    import tracemalloc
+    from starlette.requests import Request
+    from media import LocalStorage, RangeFileResponse, receive_upload
+
+    size = 256 * 1024 * 1024
+    block = os.urandom(64 * 1024)
+    boundary = b"benchboundary"
+
+    def upload_request() -> Request:
+        """A request whose body arrives in 64 KB pieces, like from a socket"""
+        pieces = iter([
+            b"--" + boundary + b'\r\nContent-Disposition: form-data; name="file"; filename="video.mp4"\r\n'
+            b"Content-Type: video/mp4\r\n\r\n",
+            *(block for _ in range(size // len(block))),
+            b"\r\n--" + boundary + b"--\r\n"
+        ])
+
+        async def receive():
+            piece = next(pieces, None)
+            return {"type": "http.request", "body": piece or b"", "more_body": piece is not None}
+
+        headers = [(b"content-type", b"multipart/form-data; boundary=" + boundary)]
+        return Request({"type": "http", "method": "POST", "headers": headers}, receive)
+
+    async def run():
+        print("\n📊 Upload e download de mídia (armazenamento local)")
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root)
+
+            start = time.perf_counter()
+            upload = await receive_upload(upload_request(), storage, max_bytes=size)
+            elapsed = time.perf_counter() - start
+            _report("upload 256 MB (multipart + sha256 + disco)", 1, elapsed)
+
+            # Again with allocation tracing, which slows it down too much to time
+            tracemalloc.start()
+            await receive_upload(upload_request(), storage, max_bytes=size)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"   {'':<40} {size / elapsed / 1e6:.0f} MB/s, pico de memória {peak / 1e6:.1f} MB")
+
+            path = storage.path(upload['sha256'])
+            sent = []
+
+            async def send(message):
+                sent.append(len(message.get("body", b"")))
+
+            scope = {"type": "http", "method": "GET", "headers": []}
+            start = time.perf_counter()
+            for i in range(1_000):
+                offset = random.randrange(0, size - 1024 * 1024)
+                response = RangeFileResponse(path, size, "video/mp4", {}, (offset, offset + 1024 * 1024 - 1))
+                await response(scope, None, send)
+            _report("range 1 MB (sem zero-copy)", 1_000, time.perf_counter() - start)
+
+            digest = hashlib.sha256()
+            for _ in range(size // len(block)):
+                digest.update(block)
+            assert upload['sha256'] == digest.hexdigest()
+
+    asyncio.run(run())
+
+
+BENCHMARKS = {
+    'routing': bench_routing,
+    'timers': bench_timers,
+    'presence': bench_presence,
+    'ratelimit': bench_ratelimit,
+    'login': bench_login,
+    'ids': bench_ids,
+    'metrics': bench_metrics,
+    'exports': bench_exports,
+    'bus': bench_bus,
+    'writes': bench_writes,
+    'receipts': bench_receipts,
+    'canned_replies': bench_canned_replies,
+    'media': bench_media,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ Benchmark desconhecido: {name}")
+            print(f"   Disponíveis: {', '.join(BENCHMARKS)}")
+            return 1
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
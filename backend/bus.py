@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+# memory - events reach subscribers of this worker only (single worker)
+# mongo  - events are also written to a capped collection that every
+#          worker tails, so subscribers on any worker receive them
+BUS_BACKEND = os.environ.get('BUS_BACKEND', 'memory').strip().lower()
+BUS_BACKENDS = ("memory", "mongo")
+if BUS_BACKEND not in BUS_BACKENDS:
+    raise ValueError(f"BUS_BACKEND must be one of {', '.join(BUS_BACKENDS)}, got '{BUS_BACKEND}'")
+
+BUS_COLLECTION = "bus_events"
+BUS_CAPPED_SIZE = int(os.environ.get('BUS_CAPPED_SIZE', 64 * 1024 * 1024))
+# Events published within BUS_LINGER_MS are written as one document
+BUS_BATCH_SIZE = int(os.environ.get('BUS_BATCH_SIZE', 256))
+BUS_LINGER_MS = float(os.environ.get('BUS_LINGER_MS', 5))
+# Recent events kept per worker so a reconnecting subscriber can resume
+BUS_REPLAY_SIZE = int(os.environ.get('BUS_REPLAY_SIZE', 1_000))
+BUS_QUEUE_SIZE = int(os.environ.get('BUS_QUEUE_SIZE', 1_000))
+# Unsent events kept while the database is unreachable
+BUS_MAX_PENDING = 10_000
+# Tolerated clock difference between workers when a tail is restarted
+BUS_CLOCK_SKEW = timedelta(seconds=2)
+
+SSE_KEEPALIVE = 15
+
+
+def conversation_topic(conversation_id: str) -> str:
+    return f"conversation:{conversation_id}"
+
+
+class Subscription:
+    """Events of a set of topics, queued in offset order.
+
+    If the subscriber falls more than `max_queue` events behind, or asks to
+    resume from an offset this worker no longer has, `lagged` is set and
+    it should reload its state from the database.
+    """
+
+    def __init__(self, bus: "MessageBus", topics: Iterable[str], max_queue: int):
+        self.bus = bus
+        self.topics = set(topics)
+        self.max_queue = max_queue
+        self.offset = 0
+        self.lagged = False
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def _put(self, event: dict):
+        if self._queue.qsize() >= self.max_queue:
+            self.lagged = True
+            self.bus.dropped += 1
+            return
+        self._queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Next event, or None if none arrived within `timeout` seconds"""
+        try:
+            event = self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            try:
+                event = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self.offset = event['offset']
+        return event
+
+    def close(self):
+        self.bus._unsubscribe(self)
+
+
+class MessageBus:
+    """Topic pub/sub shared by the workers of a deployment.
+
+    Every event gets an offset from this worker's counter when it is
+    delivered here; subscriptions remember the last offset they read and
+    can resume from it within the last BUS_REPLAY_SIZE events. With the
+    mongo backend, publishes are buffered for BUS_LINGER_MS and written as
+    one document per batch to a capped collection, which the other workers
+    read through a tailable cursor.
+    """
+
+    def __init__(self, backend: str = BUS_BACKEND, batch_size: int = BUS_BATCH_SIZE,
+                 linger_ms: float = BUS_LINGER_MS, replay_size: int = BUS_REPLAY_SIZE,
+                 queue_size: int = BUS_QUEUE_SIZE, db=None):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000
+        self.queue_size = queue_size
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.db = db
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._log: Deque[dict] = deque(maxlen=replay_size)
+        self._offset = 0
+        self._pending: List[dict] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.published = 0
+        self.batches = 0
+        self.received = 0
+        self.dropped = 0
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    def _database(self):
+        if self.db is not None:
+            return self.db
+        from database import db
+        return db
+
+    def publish(self, topic: str, event_type: str, data: dict):
+        """Deliver an event locally now and to other workers with the next batch"""
+        event = {"topic": topic, "type": event_type, "data": data, "published_at": time.time()}
+        self.published += 1
+        self._deliver(event)
+        if self.backend != "mongo" or self._wake is None:
+            return
+        self._pending.append(event)
+        if len(self._pending) == 1:
+            self._wake.set()
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    def _deliver(self, event: dict):
+        self._offset += 1
+        event = {**event, "offset": self._offset}
+        self._log.append(event)
+        for subscription in self._topics.get(event['topic'], ()):
+            subscription._put(event)
+
+    def subscribe(self, topics: Iterable[str], after: Optional[int] = None) -> Subscription:
+        """Subscribe to topics; with `after`, first replay newer retained events"""
+        subscription = Subscription(self, topics, self.queue_size)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        if after is not None:
+            oldest = self._log[0]['offset'] if self._log else self._offset + 1
+            if after < oldest - 1 or after > self._offset:
+                subscription.lagged = True
+                return subscription
+            for event in self._log:
+                if event['offset'] > after and event['topic'] in subscription.topics:
+                    subscription._put(event)
+            subscription.offset = after
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+
+    async def start(self):
+        if self.backend != "mongo":
+            return
+        await self._ensure_collection()
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._run_flush()),
+            asyncio.create_task(self._run_tail())
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._wake is not None:
+            await self.flush()
+            self._wake = None
+
+    async def _ensure_collection(self):
+        db = self._database()
+        try:
+            await db.create_collection(BUS_COLLECTION, capped=True, size=BUS_CAPPED_SIZE)
+        except CollectionInvalid:
+            pass  # created by another worker
+        # A tailable cursor on an empty capped collection dies right away
+        if await db[BUS_COLLECTION].find_one({}, {"_id": 1}) is None:
+            await db[BUS_COLLECTION].insert_one({"origin": None, "events": [], "created_at": datetime.now(timezone.utc)})
+
+    async def flush(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        now = datetime.now(timezone.utc)
+        documents = [
+            {"origin": self.worker_id, "events": pending[i:i + self.batch_size], "created_at": now}
+            for i in range(0, len(pending), self.batch_size)
+        ]
+        try:
+            await self._database()[BUS_COLLECTION].insert_many(documents, ordered=True)
+            self.batches += len(documents)
+        except Exception as e:
+            logger.error(f"Error publishing {len(pending)} bus events, will retry: {e}")
+            self._pending = (pending + self._pending)[-BUS_MAX_PENDING:]
+
+    async def _run_flush(self):
+        while True:
+            await self._wake.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.linger)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            self._full.clear()
+            await self.flush()
+            if self._pending:
+                # Failed batch: back off instead of spinning
+                await asyncio.sleep(1)
+                self._wake.set()
+
+    async def _run_tail(self):
+        """Deliver events published by other workers"""
+        collection = self._database()[BUS_COLLECTION]
+        since = datetime.now(timezone.utc)
+        seen: Deque = deque(maxlen=1_000)
+        while True:
+            try:
+                # Natural order is insertion order, so the live cursor needs no
+                # sort; `since` only bounds where a restarted tail picks up
+                cursor = collection.find(
+                    {"origin": {"$nin": [self.worker_id, None]}, "created_at": {"$gte": since - BUS_CLOCK_SKEW}},
+                    cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while cursor.alive:
+                    # Ends on an empty batch; the server holds each getMore open
+                    # until new documents arrive or the await time passes
+                    async for document in cursor:
+                        if document['_id'] in seen:
+                            continue
+                        seen.append(document['_id'])
+                        since = max(since, document['created_at'].replace(tzinfo=timezone.utc))
+                        for event in document['events']:
+                            self.received += 1
+                            self._deliver(event)
+                # The cursor died (e.g. fell behind the capped collection): restart
+                await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error tailing bus events, retrying: {e}")
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend,
+            'worker_id': self.worker_id,
+            'offset': self._offset,
+            'topics': len(self._topics),
+            'subscribers': sum(len(subscribers) for subscribers in self._topics.values()),
+            'published': self.published,
+            'batches': self.batches,
+            'pending': len(self._pending),
+            'received': self.received,
+            'dropped': self.dropped
+        }
+
+    def event_id(self, offset: int) -> str:
+        return f"{self.worker_id}:{offset}"
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """Offset to resume from, -1 if it belongs to another worker's stream"""
+        if not event_id:
+            return None
+        worker_id, _, offset = event_id.partition(":")
+        if worker_id != self.worker_id or not offset.isdigit():
+            return -1
+        return int(offset)
+
+
+async def sse_stream(bus: MessageBus, topics: Iterable[str], after: Optional[int],
+                     is_disconnected: Callable, keepalive: float = SSE_KEEPALIVE) -> AsyncIterator[bytes]:
+    """Format the events of some topics as server-sent events.
+
+    The subscription is made when streaming starts, so a client that goes
+    away before then leaves nothing registered; events published in
+    between are replayed from `after`. A `reset` event tells the client it
+    missed events and must reload from the REST endpoints before relying
+    on the stream again.
+    """
+    subscription = bus.subscribe(topics, after=after)
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            if subscription.lagged:
+                subscription.lagged = False
+                yield f"id: {bus.event_id(bus.offset)}\nevent: reset\ndata: {{}}\n\n".encode()
+            event = await subscription.get(timeout=keepalive)
+            if await is_disconnected():
+                break
+            if event is None:
+                yield b": keepalive\n\n"
+                continue
+            data = json.dumps(event['data'], ensure_ascii=False, separators=(',', ':'), default=str)
+            yield f"id: {bus.event_id(event['offset'])}\nevent: {event['type']}\ndata: {data}\n\n".encode()
+    finally:
+        subscription.close()
+
+
+message_bus = MessageBus()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Calibra o custo do hash de senhas para o hardware atual
+Uso: python calibrate_passwords.py [--target-ms 250] [--scheme bcrypt|argon2|all]
+     [--memory-kib 65536] [--parallelism 4]
+
+Mede a verificação de senha em cada esquema, escolhe o maior custo que fica
+dentro da latência alvo e imprime as variáveis de ambiente correspondentes.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+from passwords import argon2_available, build_context
+
+SAMPLES = 5
+PASSWORD = "calibracao-Senha-123"
+
+
+def measure(context) -> float:
+    """Median verification time in seconds"""
+    password_hash = context.hash(PASSWORD)
+    samples = []
+    for _ in range(SAMPLES):
+        start = time.perf_counter()
+        context.verify(PASSWORD, password_hash)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def calibrate_bcrypt(target: float):
+    print("\n🔐 bcrypt")
+    chosen = None
+    for rounds in range(8, 18):
+        latency = measure(build_context(["bcrypt"], bcrypt_rounds=rounds))
+        print(f"   rounds={rounds:<3} {latency * 1000:>8.1f} ms  {1 / latency:>8.1f} logins/s por núcleo")
+        if latency > target:
+            break
+        chosen = (rounds, latency)
+    if chosen is None:
+        print("   ⚠️  Nem o custo mínimo cabe na latência alvo")
+        return None
+    rounds, latency = chosen
+    return {
+        'scheme': 'bcrypt',
+        'latency': latency,
+        'env': {'PASSWORD_SCHEMES': 'bcrypt', 'BCRYPT_ROUNDS': rounds}
+    }
+
+
+def calibrate_argon2(target: float, memory_kib: int, parallelism: int):
+    print(f"\n🔐 argon2id (memória {memory_kib} KiB, paralelismo {parallelism})")
+    if not argon2_available():
+        print("   ⚠️  argon2-cffi não instalado (pip install argon2-cffi)")
+        return None
+    chosen = None
+    for time_cost in range(1, 21):
+        context = build_context(
+            ["argon2"], argon2_time_cost=time_cost, argon2_memory_cost=memory_kib, argon2_parallelism=parallelism
+        )
+        latency = measure(context)
+        print(f"   time_cost={time_cost:<3} {latency * 1000:>8.1f} ms  {1 / latency:>8.1f} logins/s por núcleo")
+        if latency > target:
+            break
+        chosen = (time_cost, latency)
+    if chosen is None:
+        print("   ⚠️  Nem o custo mínimo cabe na latência alvo; reduza --memory-kib")
+        return None
+    time_cost, latency = chosen
+    return {
+        'scheme': 'argon2',
+        'latency': latency,
+        'env': {
+            # bcrypt stays listed so existing hashes verify and get upgraded
+            'PASSWORD_SCHEMES': 'argon2,bcrypt',
+            'ARGON2_TIME_COST': time_cost,
+            'ARGON2_MEMORY_COST': memory_kib,
+            'ARGON2_PARALLELISM': parallelism
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibra o custo do hash de senhas")
+    parser.add_argument('--target-ms', type=float, default=250, help="latência alvo por verificação")
+    parser.add_argument('--scheme', choices=['bcrypt', 'argon2', 'all'], default='all')
+    parser.add_argument('--memory-kib', type=int, default=65536, help="memória do argon2id")
+    parser.add_argument('--parallelism', type=int, default=4, help="paralelismo do argon2id")
+    args = parser.parse_args()
+
+    target = args.target_ms / 1000
+    print(f"🎯 Latência alvo: {args.target_ms:.0f} ms por verificação")
+
+    results = []
+    if args.scheme in ('bcrypt', 'all'):
+        results.append(calibrate_bcrypt(target))
+    if args.scheme in ('argon2', 'all'):
+        results.append(calibrate_argon2(target, args.memory_kib, args.parallelism))
+    results = [result for result in results if result]
+
+    if not results:
+        print("\n❌ Nenhum esquema atende à latência alvo")
+        return 1
+
+    print("\n📋 Resultado")
+    for result in results:
+        print(f"\n   {result['scheme']}: {result['latency'] * 1000:.1f} ms por login")
+        for key, value in result['env'].items():
+            print(f"   {key}={value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
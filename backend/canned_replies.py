@@ -0,0 +1,179 @@
+import heapq
+import os
+import re
+import time
+import unicodedata
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Bounds how long a change made on another worker can go unnoticed
+CANNED_REPLY_CACHE_TTL = float(os.environ.get('CANNED_REPLY_CACHE_TTL', 30))
+CANNED_REPLY_SEARCH_LIMIT = 20
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize_shortcut(shortcut: str) -> str:
+    """`/Saudacao ` and `saudacao` name the same reply"""
+    return shortcut.strip().lstrip("/").lower()
+
+
+def _fold(text: str) -> str:
+    """Lowercase without accents, so `sauda` finds `Saudação`"""
+    text = text.lower()
+    if text.isascii():
+        return text
+    # Words are ASCII letters and digits only, so whatever doesn't
+    # decompose to ASCII can go
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+
+
+def title_words(title: str) -> List[str]:
+    return _WORD.findall(_fold(title))
+
+
+class ReplyIndex:
+    """Canned replies of one scope (a team, or global) in sorted arrays.
+
+    Prefix lookups are a bisect into the sorted shortcuts or title words
+    followed by a scan of the matches, so they don't depend on how many
+    replies the scope has.
+    """
+    __slots__ = ("by_shortcut", "_shortcuts", "_words", "_word_replies", "loaded_at")
+
+    def __init__(self, replies: Iterable[dict], loaded_at: float):
+        self.by_shortcut: Dict[str, dict] = {reply['shortcut']: reply for reply in replies}
+        self._shortcuts = sorted(self.by_shortcut)
+        # Stable sort: replies sharing a word stay in shortcut order
+        words = sorted(
+            ((word, self.by_shortcut[shortcut])
+             for shortcut in self._shortcuts
+             for word in set(title_words(self.by_shortcut[shortcut]['title']))),
+            key=itemgetter(0)
+        )
+        self._words = [word for word, _ in words]
+        self._word_replies = [reply for _, reply in words]
+        self.loaded_at = loaded_at
+
+    def __len__(self) -> int:
+        return len(self.by_shortcut)
+
+    def shortcut_matches(self, prefix: str) -> Iterable[Tuple[str, dict]]:
+        """(shortcut, reply) for shortcuts starting with prefix, in order"""
+        shortcuts = self._shortcuts
+        for i in range(bisect_left(shortcuts, prefix), len(shortcuts)):
+            if not shortcuts[i].startswith(prefix):
+                break
+            yield shortcuts[i], self.by_shortcut[shortcuts[i]]
+
+    def word_matches(self, prefix: str) -> Iterable[Tuple[str, dict]]:
+        """(word, reply) for title words starting with prefix, in order"""
+        words = self._words
+        for i in range(bisect_left(words, prefix), len(words)):
+            if not words[i].startswith(prefix):
+                break
+            yield words[i], self._word_replies[i]
+
+
+class CannedReplyCache:
+    """Per-worker prefix indexes of canned replies, one per scope.
+
+    An agent sees its team's replies plus the global ones; a team reply
+    shadows a global reply with the same shortcut. Writes on this worker
+    drop the scope's index, which is rebuilt on the next lookup; the TTL
+    covers writes made by other workers.
+    """
+
+    def __init__(self, ttl: float = CANNED_REPLY_CACHE_TTL):
+        self.ttl = ttl
+        # Scope (team id, None for global) -> index
+        self._indexes: Dict[Optional[str], ReplyIndex] = {}
+        # Bumped per scope on invalidation so in-flight loads don't store stale data
+        self._generations: Dict[Optional[str], int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def index(self, team_id: Optional[str]) -> ReplyIndex:
+        """Index of one scope, loading it on a miss"""
+        now = time.monotonic()
+        index = self._indexes.get(team_id)
+        if index is not None and now - index.loaded_at <= self.ttl:
+            self.hits += 1
+            return index
+
+        from database import get_scope_canned_replies
+
+        self.misses += 1
+        generation = self._generations.get(team_id, 0)
+        index = ReplyIndex(await get_scope_canned_replies(team_id), now)
+        if generation == self._generations.get(team_id, 0):
+            self._indexes[team_id] = index
+        return index
+
+    async def _scopes(self, team_id: Optional[str]) -> List[ReplyIndex]:
+        if not team_id:
+            return [await self.index(None)]
+        return [await self.index(team_id), await self.index(None)]
+
+    async def expand(self, team_id: Optional[str], shortcut: str) -> Optional[dict]:
+        """Reply a `/shortcut` stands for in the team, or None"""
+        shortcut = normalize_shortcut(shortcut)
+        for index in await self._scopes(team_id):
+            reply = index.by_shortcut.get(shortcut)
+            if reply is not None:
+                return reply
+        return None
+
+    async def search(self, team_id: Optional[str], query: str = "",
+                     limit: int = CANNED_REPLY_SEARCH_LIMIT) -> List[dict]:
+        """Replies visible to a team matching what the agent typed so far.
+
+        `/prefix` matches shortcuts only; anything else matches shortcuts
+        first, then the words of the titles, each in alphabetical order.
+        """
+        scopes = await self._scopes(team_id)
+        shortcut_only = query.lstrip().startswith("/")
+        prefix = normalize_shortcut(query)
+
+        sources = [heapq.merge(*(index.shortcut_matches(prefix) for index in scopes), key=lambda match: match[0])]
+        if not shortcut_only and prefix:
+            folded = _fold(prefix)
+            sources.append(heapq.merge(*(index.word_matches(folded) for index in scopes),
+                                       key=lambda match: match[0]))
+
+        # Skipped while merging rather than filtered per scope, so a scope
+        # full of shadowed replies costs no more than the matches returned
+        team = scopes[0].by_shortcut if len(scopes) > 1 else {}
+        results = []
+        seen = set()
+        for matches in sources:
+            for _, reply in matches:
+                if id(reply) in seen or team.get(reply['shortcut'], reply) is not reply:
+                    continue
+                seen.add(id(reply))
+                results.append(reply)
+                if len(results) >= limit:
+                    return results
+        return results
+
+    def invalidate(self, team_id: Optional[str]):
+        self._generations[team_id] = self._generations.get(team_id, 0) + 1
+        self._indexes.pop(team_id, None)
+
+    def clear(self):
+        for team_id in list(self._indexes):
+            self.invalidate(team_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'scopes': len(self._indexes),
+            'replies': sum(len(index) for index in self._indexes.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+canned_replies = CannedReplyCache()
@@ -0,0 +1,124 @@
+import os
+import time
+from typing import Dict, Optional, Set
+
+# Bounds how long a change made on another worker can go unnoticed
+CHANNEL_CACHE_TTL = float(os.environ.get('CHANNEL_CACHE_TTL', 30))
+
+
+class ChannelFlow:
+    """What a chat start needs to know about a channel"""
+    __slots__ = ("channel_id", "is_active", "flow_id", "flow_name", "compiled", "loaded_at")
+
+    def __init__(self, channel_id: str, is_active: bool, flow_id: Optional[str],
+                 flow_name: str, compiled: Optional[dict], loaded_at: float):
+        self.channel_id = channel_id
+        self.is_active = is_active
+        self.flow_id = flow_id
+        self.flow_name = flow_name
+        self.compiled = compiled
+        self.loaded_at = loaded_at
+
+
+class ChannelFlowCache:
+    """Per-worker channel → compiled flow mapping.
+
+    Writes on this worker update or drop entries through the hooks below;
+    the TTL covers writes made by other workers. A warm lookup costs no
+    database round trip.
+    """
+
+    def __init__(self, ttl: float = CHANNEL_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, ChannelFlow] = {}
+        self._by_flow: Dict[str, Set[str]] = {}
+        # Bumped on every invalidation so in-flight loads don't store stale data
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, channel_id: str, now: Optional[float] = None) -> Optional[ChannelFlow]:
+        entry = self._entries.get(channel_id)
+        if entry is None:
+            return None
+        if (now or time.monotonic()) - entry.loaded_at > self.ttl:
+            self._drop(channel_id)
+            return None
+        return entry
+
+    def put(self, entry: ChannelFlow):
+        self._drop(entry.channel_id)
+        self._entries[entry.channel_id] = entry
+        if entry.flow_id:
+            self._by_flow.setdefault(entry.flow_id, set()).add(entry.channel_id)
+
+    def _drop(self, channel_id: str):
+        entry = self._entries.pop(channel_id, None)
+        if entry and entry.flow_id:
+            channels = self._by_flow.get(entry.flow_id)
+            if channels:
+                channels.discard(channel_id)
+                if not channels:
+                    del self._by_flow[entry.flow_id]
+
+    def invalidate_channel(self, channel_id: str):
+        self._generation += 1
+        self._drop(channel_id)
+
+    def flow_changed(self, flow_id: str, name: Optional[str] = None, compiled: Optional[dict] = None):
+        """Refresh every cached channel using a flow that was saved"""
+        self._generation += 1
+        for channel_id in self._by_flow.get(flow_id, ()):
+            entry = self._entries[channel_id]
+            if name is not None:
+                entry.flow_name = name
+            if compiled is not None:
+                entry.compiled = compiled
+
+    def flow_removed(self, flow_id: str):
+        self._generation += 1
+        for channel_id in list(self._by_flow.get(flow_id, ())):
+            self._drop(channel_id)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._by_flow.clear()
+
+    async def resolve(self, channel_id: str) -> Optional[ChannelFlow]:
+        """Channel and compiled flow, loading them on a miss"""
+        entry = self.get(channel_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        from database import get_channel_flow
+
+        self.misses += 1
+        generation = self._generation
+        loaded = await get_channel_flow(channel_id)
+        if loaded is None:
+            return None
+        entry = ChannelFlow(
+            channel_id,
+            loaded['is_active'],
+            loaded['flow_id'],
+            loaded['flow_name'],
+            loaded['compiled'],
+            time.monotonic()
+        )
+        if generation == self._generation:
+            self.put(entry)
+        return entry
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'channels': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+channel_flows = ChannelFlowCache()
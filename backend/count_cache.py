@@ -0,0 +1,89 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+# Bounds how long a write made on another worker can go unnoticed
+COUNT_CACHE_TTL = float(os.environ.get('COUNT_CACHE_TTL', 10))
+COUNT_CACHE_MAX = int(os.environ.get('COUNT_CACHE_MAX', 1_000))
+# Counting stops here; larger totals are reported as estimates
+COUNT_LIMIT = int(os.environ.get('COUNT_LIMIT', 10_000))
+
+
+def query_key(collection: str, query: dict) -> str:
+    """Normalized cache key; field order in the filter doesn't matter"""
+    return collection + ":" + json.dumps(query, sort_keys=True, default=str)
+
+
+class CountCache:
+    """Per-worker cache of list totals keyed by collection and filter.
+
+    Filtered totals come from a count capped at COUNT_LIMIT, unfiltered
+    ones from collection metadata once that reaches COUNT_LIMIT and from
+    the same capped count below it. Writes on this worker invalidate the
+    collection's entries; the TTL covers writes made by other workers.
+    """
+
+    def __init__(self, ttl: float = COUNT_CACHE_TTL, max_entries: int = COUNT_CACHE_MAX,
+                 limit: int = COUNT_LIMIT):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.limit = limit
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Bumped per collection on invalidation so in-flight counts aren't stored
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def count(self, collection, query: dict) -> Tuple[int, bool]:
+        """Total documents matching `query` and whether it is an estimate"""
+        name = collection.name
+        key = query_key(name, query)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            total, is_estimate, loaded_at = entry
+            if now - loaded_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return total, is_estimate
+            del self._entries[key]
+
+        self.misses += 1
+        generation = self._generations.get(name, 0)
+        if query:
+            total = await collection.count_documents(query, limit=self.limit)
+            is_estimate = total >= self.limit
+        else:
+            total = await collection.estimated_document_count()
+            # Metadata can be off after an unclean shutdown; small collections
+            # are cheap to count exactly
+            is_estimate = total >= self.limit
+            if not is_estimate:
+                total = await collection.count_documents({}, limit=self.limit)
+                is_estimate = total >= self.limit
+        if generation == self._generations.get(name, 0):
+            self._entries[key] = (total, is_estimate, now)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return total, is_estimate
+
+    def invalidate(self, *collections: str):
+        for name in collections:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            prefix = name + ":"
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+list_counts = CountCache()
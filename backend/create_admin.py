@@ -6,19 +6,18 @@ Uso: python create_admin.py
 
 import asyncio
 import os
-from passlib.context import CryptContext
 from dotenv import load_dotenv
 from pathlib import Path
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
-import uuid
 
 # Carregar variáveis de ambiente
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Configuração de hash de senha
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Configuração de hash de senha (mesma política do servidor)
+from passwords import pwd_context
+from ids import new_id, stored, doc_id
 
 # Dados do usuário admin padrão
 ADMIN_DATA = {
@@ -79,7 +78,7 @@ async def create_admin_user(db):
         
         # Dados do admin
         admin_doc = {
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "name": ADMIN_DATA['name'],
             "username": ADMIN_DATA['username'],
             "email": ADMIN_DATA['email'],
@@ -89,7 +88,7 @@ async def create_admin_user(db):
         }
         
         # Inserir usuário
-        result = await db.users.insert_one(admin_doc)
+        result = await db.users.insert_one(stored(admin_doc))
         
         return admin_doc['id']
     except Exception as e:
@@ -129,7 +128,7 @@ async def main():
         
         if existing_admin:
             print(f"⚠️  Usuário admin já existe!")
-            print(f"   ID: {existing_admin.get('id')}")
+            print(f"   ID: {doc_id(existing_admin)}")
             print(f"   Username: {existing_admin.get('username')}")
             print(f"   Email: {existing_admin.get('email')}")
             print("\n💡 Se deseja recriar, delete o usuário existente primeiro.")
@@ -1,13 +1,43 @@
+import asyncio
 import os
-from datetime import datetime, timezone
-from passlib.context import CryptContext
+import time
+from datetime import datetime, timedelta, timezone
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Optional, List
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from typing import Dict, Optional, List
 import uuid
 
+from flow_compiler import compile_flow
+from indexes import reconcile_indexes
+from flow_revisions import build_manifest, root_hash, diff_manifests
+from channel_cache import channel_flows
+from login_shield import login_shield
+from passwords import pwd_context
+from user_cache import user_profiles
+from count_cache import list_counts
+from metrics import conversation_metrics, rollup_updates, rollup_series_pipeline
+from exports import CONVERSATION_FIELDS, EXPORT_BATCH_SIZE
+from write_buffer import contiguous, message_writes
+from canned_replies import canned_replies, normalize_shortcut
+from inbox import (
+    INBOX_FIELDS, INBOX_SORT, INBOX_CHANGES_LIMIT,
+    after_cursor, current_revision, encode_cursor, from_revision, inbox_projection, inbox_section
+)
+from ids import new_id, binary_ids, id_query, id_projection, stored, doc_id, public
+
 logger = logging.getLogger(__name__)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Flows read or written per round trip by archive export/import
+FLOW_ARCHIVE_BATCH_SIZE = int(os.environ.get('FLOW_ARCHIVE_BATCH_SIZE', 100))
+MAX_IMPORT_ERRORS = 100
+# Unreferenced flow blobs stored more recently than this are kept: a
+# revision being saved writes its blobs just before the revision itself
+FLOW_BLOB_GRACE = timedelta(minutes=10)
+# Dashboard counts may lag writes by this much
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 5))
+_dashboard = {'summary': None, 'loaded_at': 0.0, 'loading': None}
 
 # MongoDB connection
 client: Optional[AsyncIOMotorClient] = None
@@ -27,9 +57,6 @@ async def connect_to_mongodb():
         await client.admin.command('ping')
         logger.info(f"Connected to MongoDB: {db_name}")
         
-        # Initialize database (create indexes and admin user)
-        await init_database()
-        
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
         raise
@@ -50,29 +77,43 @@ def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 async def init_database():
-    """Initialize database indexes and create admin user"""
+    """Reconcile indexes with the manifest and create the admin user.
+    
+    Runs as a background startup step; see startup.py.
+    """
     try:
-        # Create indexes for users collection
-        await db.users.create_index("username", unique=True)
-        await db.users.create_index("email", unique=True)
+        await reconcile_indexes(db)
         
         # Check if admin exists
-        admin = await db.users.find_one({"username": "admin"})
+        admin = await db.users.find_one({"username": "admin"}, {"_id": 1})
         if admin is None:
-            # Create admin user
-            password_hash = pwd_context.hash('admin123')
+            # Hash off the event loop; bcrypt takes hundreds of milliseconds
+            loop = asyncio.get_running_loop()
+            password_hash = await loop.run_in_executor(None, pwd_context.hash, 'admin123')
+            now = datetime.now(timezone.utc)
             admin_user = {
-                "id": str(uuid.uuid4()),
+                "id": new_id(),
                 "name": "Administrador",
-                "username": "admin",
                 "email": "admin@exemplo.com.br",
                 "password_hash": password_hash,
                 "role": "admin",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc)
+                "created_at": now,
+                "updated_at": now
             }
-            await db.users.insert_one(admin_user)
-            logger.info("Admin user created successfully")
+            try:
+                # Upsert so workers seeding at the same time create one admin
+                result = await db.users.update_one(
+                    {"username": "admin"},
+                    {"$setOnInsert": stored(admin_user)},
+                    upsert=True
+                )
+                if result.upserted_id is not None:
+                    login_shield.known.add("admin", admin_user['email'])
+                    list_counts.invalidate("users")
+                    logger.info("Admin user created successfully")
+            except DuplicateKeyError:
+                pass
         
         logger.info("Database initialized successfully")
         
@@ -92,7 +133,7 @@ async def get_user_by_login(login: str):
         
         if user:
             return {
-                'id': user.get('id'),
+                'id': doc_id(user),
                 'name': user.get('name'),
                 'username': user.get('username'),
                 'email': user.get('email'),
@@ -111,6 +152,87 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password against hash"""
     return pwd_context.verify(plain_password, hashed_password)
 
+async def update_password_hash(user_id: str, old_hash: str, new_hash: str) -> bool:
+    """Replace a hash after a scheme or cost upgrade, unless the password
+    changed in the meantime"""
+    result = await db.users.update_one(
+        {**id_query(user_id), "password_hash": old_hash},
+        {"$set": {"password_hash": new_hash}}
+    )
+    return result.modified_count > 0
+
+async def get_user_profile(user_id: str) -> Optional[dict]:
+    """Get the fields used for authorization, without the password hash"""
+    user = await db.users.find_one(
+        id_query(user_id),
+        id_projection({"_id": 0, "id": 1, "name": 1, "username": 1, "email": 1, "role": 1, "is_active": 1, "team_id": 1})
+    )
+    if user:
+        return {
+            'id': doc_id(user),
+            'name': user.get('name'),
+            'username': user.get('username'),
+            'email': user.get('email'),
+            'role': user.get('role'),
+            'is_active': user.get('is_active', True),
+            'team_id': user.get('team_id')
+        }
+    return None
+
+async def count_users() -> int:
+    return await db.users.estimated_document_count()
+
+async def get_login_identities(since: Optional[datetime] = None) -> tuple:
+    """Usernames and emails of users changed after `since` (all when None),
+    with the latest updated_at seen"""
+    query = {"updated_at": {"$gte": since}} if since else {}
+    values = []
+    watermark = None
+    cursor = db.users.find(query, {"_id": 0, "username": 1, "email": 1, "updated_at": 1})
+    async for user in cursor:
+        values.append(user.get('username'))
+        values.append(user.get('email'))
+        updated_at = user.get('updated_at')
+        if updated_at and (watermark is None or updated_at > watermark):
+            watermark = updated_at
+    return values, watermark
+
+async def record_login_failure(key: str, window: float) -> int:
+    """Count a failed login for a key; returns failures within the window"""
+    now = datetime.now(timezone.utc)
+    attempt = await db.login_attempts.find_one_and_update(
+        {"key": key},
+        [{"$set": {
+            "failures": {"$cond": [
+                {"$gt": ["$expires_at", now]},
+                {"$add": [{"$ifNull": ["$failures", 0]}, 1]},
+                1
+            ]},
+            "expires_at": {"$max": ["$expires_at", now + timedelta(seconds=window)]}
+        }}],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return attempt['failures']
+
+async def set_login_lockout(key: str, blocked_until: datetime):
+    """Block logins for a key until the given time"""
+    await db.login_attempts.update_one(
+        {"key": key},
+        {"$max": {"blocked_until": blocked_until, "expires_at": blocked_until}}
+    )
+
+async def get_login_lockouts(keys: List[str]) -> Dict[str, datetime]:
+    """Active lockouts among the given keys"""
+    cursor = db.login_attempts.find(
+        {"key": {"$in": keys}, "blocked_until": {"$gt": datetime.now(timezone.utc)}},
+        {"_id": 0, "key": 1, "blocked_until": 1}
+    )
+    return {attempt['key']: attempt['blocked_until'] async for attempt in cursor}
+
+async def clear_login_failures(key: str):
+    await db.login_attempts.delete_one({"key": key})
+
 # Agent CRUD operations
 async def get_agents(page: int = 1, per_page: int = 10, search: str = None) -> dict:
     """Get all agents with pagination"""
@@ -124,7 +246,7 @@ async def get_agents(page: int = 1, per_page: int = 10, search: str = None) -> d
                 {"email": {"$regex": search, "$options": "i"}}
             ]
         
-        total = await db.users.count_documents(query)
+        total, total_is_estimate = await list_counts.count(db.users, query)
         skip = (page - 1) * per_page
         
         cursor = db.users.find(query).skip(skip).limit(per_page).sort("created_at", -1)
@@ -132,17 +254,20 @@ async def get_agents(page: int = 1, per_page: int = 10, search: str = None) -> d
         
         async for user in cursor:
             agents.append({
-                'id': user.get('id'),
+                'id': doc_id(user),
                 'name': user.get('name'),
                 'username': user.get('username'),
                 'email': user.get('email'),
                 'is_active': user.get('is_active', True),
+                'team_id': user.get('team_id'),
+                'max_conversations': user.get('max_conversations'),
                 'created_at': user.get('created_at')
             })
         
         return {
             'agents': agents,
             'total': total,
+            'total_is_estimate': total_is_estimate,
             'page': page,
             'per_page': per_page
         }
@@ -168,18 +293,28 @@ async def create_agent(agent_data: dict) -> dict:
             if existing.get('email') == agent_data['email']:
                 raise ValueError("E-mail já existe")
         
+        if agent_data.get('team_id'):
+            team = await db.teams.find_one(id_query(agent_data['team_id']))
+            if not team:
+                raise ValueError("Equipe não encontrada")
+        
         new_agent = {
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "name": agent_data['name'],
             "username": agent_data['username'],
             "email": agent_data['email'],
             "password_hash": pwd_context.hash(agent_data['password']),
             "role": "agent",
             "is_active": agent_data.get('is_active', True),
-            "created_at": datetime.now(timezone.utc)
+            "team_id": agent_data.get('team_id'),
+            "max_conversations": agent_data.get('max_conversations'),
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         
-        await db.users.insert_one(new_agent)
+        await db.users.insert_one(stored(new_agent))
+        list_counts.invalidate("users")
+        login_shield.known.add(new_agent['username'], new_agent['email'])
         
         return {
             'id': new_agent['id'],
@@ -187,6 +322,8 @@ async def create_agent(agent_data: dict) -> dict:
             'username': new_agent['username'],
             'email': new_agent['email'],
             'is_active': new_agent['is_active'],
+            'team_id': new_agent['team_id'],
+            'max_conversations': new_agent['max_conversations'],
             'created_at': new_agent['created_at']
         }
         
@@ -200,7 +337,7 @@ async def update_agent(agent_id: str, agent_data: dict) -> dict:
     """Update an agent"""
     try:
         # Check if agent exists
-        agent = await db.users.find_one({"id": agent_id, "role": "agent"})
+        agent = await db.users.find_one({**id_query(agent_id), "role": "agent"})
         if not agent:
             raise ValueError("Agente não encontrado")
         
@@ -213,7 +350,7 @@ async def update_agent(agent_id: str, agent_data: dict) -> dict:
             # Check if new username is taken
             existing = await db.users.find_one({
                 "username": agent_data['username'],
-                "id": {"$ne": agent_id}
+                **id_query({"$ne": agent_id})
             })
             if existing:
                 raise ValueError("Nome de usuário já existe")
@@ -223,7 +360,7 @@ async def update_agent(agent_id: str, agent_data: dict) -> dict:
             # Check if new email is taken
             existing = await db.users.find_one({
                 "email": agent_data['email'],
-                "id": {"$ne": agent_id}
+                **id_query({"$ne": agent_id})
             })
             if existing:
                 raise ValueError("E-mail já existe")
@@ -235,21 +372,37 @@ async def update_agent(agent_id: str, agent_data: dict) -> dict:
         if 'is_active' in agent_data and agent_data['is_active'] is not None:
             update_data['is_active'] = agent_data['is_active']
         
+        if 'team_id' in agent_data:
+            if agent_data['team_id']:
+                team = await db.teams.find_one(id_query(agent_data['team_id']))
+                if not team:
+                    raise ValueError("Equipe não encontrada")
+            update_data['team_id'] = agent_data['team_id']
+        
+        if 'max_conversations' in agent_data:
+            update_data['max_conversations'] = agent_data['max_conversations']
+        
         if update_data:
+            update_data['updated_at'] = datetime.now(timezone.utc)
             await db.users.update_one(
-                {"id": agent_id},
+                id_query(agent_id),
                 {"$set": update_data}
             )
+            login_shield.known.add(update_data.get('username'), update_data.get('email'))
+            user_profiles.invalidate(agent_id)
+            list_counts.invalidate("users")
         
         # Get updated agent
-        updated = await db.users.find_one({"id": agent_id})
+        updated = await db.users.find_one(id_query(agent_id))
         
         return {
-            'id': updated.get('id'),
+            'id': doc_id(updated),
             'name': updated.get('name'),
             'username': updated.get('username'),
             'email': updated.get('email'),
             'is_active': updated.get('is_active', True),
+            'team_id': updated.get('team_id'),
+            'max_conversations': updated.get('max_conversations'),
             'created_at': updated.get('created_at')
         }
         
@@ -262,7 +415,9 @@ async def update_agent(agent_id: str, agent_data: dict) -> dict:
 async def delete_agent(agent_id: str) -> bool:
     """Delete an agent"""
     try:
-        result = await db.users.delete_one({"id": agent_id, "role": "agent"})
+        result = await db.users.delete_one({**id_query(agent_id), "role": "agent"})
+        user_profiles.invalidate(agent_id)
+        list_counts.invalidate("users")
         return result.deleted_count > 0
         
     except Exception as e:
@@ -273,9 +428,11 @@ async def delete_agents_bulk(agent_ids: List[str]) -> int:
     """Delete multiple agents"""
     try:
         result = await db.users.delete_many({
-            "id": {"$in": agent_ids},
+            **id_query({"$in": agent_ids}),
             "role": "agent"
         })
+        user_profiles.invalidate_many(agent_ids)
+        list_counts.invalidate("users")
         return result.deleted_count
         
     except Exception as e:
@@ -296,7 +453,7 @@ async def get_admins(page: int = 1, per_page: int = 10, search: str = None) -> d
                 {"email": {"$regex": search, "$options": "i"}}
             ]
         
-        total = await db.users.count_documents(query)
+        total, total_is_estimate = await list_counts.count(db.users, query)
         skip = (page - 1) * per_page
         
         cursor = db.users.find(query).skip(skip).limit(per_page).sort("created_at", -1)
@@ -304,7 +461,7 @@ async def get_admins(page: int = 1, per_page: int = 10, search: str = None) -> d
         
         async for user in cursor:
             admins.append({
-                'id': user.get('id'),
+                'id': doc_id(user),
                 'name': user.get('name'),
                 'username': user.get('username'),
                 'email': user.get('email'),
@@ -315,6 +472,7 @@ async def get_admins(page: int = 1, per_page: int = 10, search: str = None) -> d
         return {
             'admins': admins,
             'total': total,
+            'total_is_estimate': total_is_estimate,
             'page': page,
             'per_page': per_page
         }
@@ -341,17 +499,20 @@ async def create_admin(admin_data: dict) -> dict:
                 raise ValueError("E-mail já existe")
         
         new_admin = {
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "name": admin_data['name'],
             "username": admin_data['username'],
             "email": admin_data['email'],
             "password_hash": pwd_context.hash(admin_data['password']),
             "role": "admin",
             "is_active": admin_data.get('is_active', True),
-            "created_at": datetime.now(timezone.utc)
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         
-        await db.users.insert_one(new_admin)
+        await db.users.insert_one(stored(new_admin))
+        list_counts.invalidate("users")
+        login_shield.known.add(new_admin['username'], new_admin['email'])
         
         return {
             'id': new_admin['id'],
@@ -372,7 +533,7 @@ async def update_admin(admin_id: str, admin_data: dict, current_user_id: str = N
     """Update an admin"""
     try:
         # Check if admin exists
-        admin = await db.users.find_one({"id": admin_id, "role": "admin"})
+        admin = await db.users.find_one({**id_query(admin_id), "role": "admin"})
         if not admin:
             raise ValueError("Administrador não encontrado")
         
@@ -390,7 +551,7 @@ async def update_admin(admin_id: str, admin_data: dict, current_user_id: str = N
             # Check if new username is taken
             existing = await db.users.find_one({
                 "username": admin_data['username'],
-                "id": {"$ne": admin_id}
+                **id_query({"$ne": admin_id})
             })
             if existing:
                 raise ValueError("Nome de usuário já existe")
@@ -400,7 +561,7 @@ async def update_admin(admin_id: str, admin_data: dict, current_user_id: str = N
             # Check if new email is taken
             existing = await db.users.find_one({
                 "email": admin_data['email'],
-                "id": {"$ne": admin_id}
+                **id_query({"$ne": admin_id})
             })
             if existing:
                 raise ValueError("E-mail já existe")
@@ -413,16 +574,20 @@ async def update_admin(admin_id: str, admin_data: dict, current_user_id: str = N
             update_data['is_active'] = admin_data['is_active']
         
         if update_data:
+            update_data['updated_at'] = datetime.now(timezone.utc)
             await db.users.update_one(
-                {"id": admin_id},
+                id_query(admin_id),
                 {"$set": update_data}
             )
+            login_shield.known.add(update_data.get('username'), update_data.get('email'))
+            user_profiles.invalidate(admin_id)
+            list_counts.invalidate("users")
         
         # Get updated admin
-        updated = await db.users.find_one({"id": admin_id})
+        updated = await db.users.find_one(id_query(admin_id))
         
         return {
-            'id': updated.get('id'),
+            'id': doc_id(updated),
             'name': updated.get('name'),
             'username': updated.get('username'),
             'email': updated.get('email'),
@@ -443,7 +608,9 @@ async def delete_admin(admin_id: str, current_user_id: str = None) -> bool:
         if current_user_id and admin_id == current_user_id:
             raise ValueError("Você não pode excluir seu próprio usuário")
         
-        result = await db.users.delete_one({"id": admin_id, "role": "admin"})
+        result = await db.users.delete_one({**id_query(admin_id), "role": "admin"})
+        user_profiles.invalidate(admin_id)
+        list_counts.invalidate("users")
         return result.deleted_count > 0
         
     except ValueError as e:
@@ -463,9 +630,11 @@ async def delete_admins_bulk(admin_ids: List[str], current_user_id: str = None)
             return 0
         
         result = await db.users.delete_many({
-            "id": {"$in": admin_ids},
+            **id_query({"$in": admin_ids}),
             "role": "admin"
         })
+        user_profiles.invalidate_many(admin_ids)
+        list_counts.invalidate("users")
         return result.deleted_count
         
     except Exception as e:
@@ -485,7 +654,7 @@ async def get_channels(page: int = 1, per_page: int = 10, search: str = None) ->
                 {"type": {"$regex": search, "$options": "i"}}
             ]
         
-        total = await db.channels.count_documents(query)
+        total, total_is_estimate = await list_counts.count(db.channels, query)
         skip = (page - 1) * per_page
         
         cursor = db.channels.find(query).skip(skip).limit(per_page).sort("created_at", -1)
@@ -493,7 +662,7 @@ async def get_channels(page: int = 1, per_page: int = 10, search: str = None) ->
         
         async for channel in cursor:
             channels.append({
-                'id': channel.get('id'),
+                'id': doc_id(channel),
                 'name': channel.get('name'),
                 'type': channel.get('type'),
                 'status': channel.get('status', 'connected'),
@@ -507,6 +676,7 @@ async def get_channels(page: int = 1, per_page: int = 10, search: str = None) ->
         return {
             'channels': channels,
             'total': total,
+            'total_is_estimate': total_is_estimate,
             'page': page,
             'per_page': per_page
         }
@@ -518,10 +688,10 @@ async def get_channels(page: int = 1, per_page: int = 10, search: str = None) ->
 async def get_channel_by_id(channel_id: str) -> dict:
     """Get a single channel by ID"""
     try:
-        channel = await db.channels.find_one({"id": channel_id})
+        channel = await db.channels.find_one(id_query(channel_id))
         if channel:
             return {
-                'id': channel.get('id'),
+                'id': doc_id(channel),
                 'name': channel.get('name'),
                 'type': channel.get('type'),
                 'status': channel.get('status', 'connected'),
@@ -539,7 +709,7 @@ async def get_channel_by_id(channel_id: str) -> dict:
 async def create_channel(channel_data: dict, base_url: str = "") -> dict:
     """Create a new channel"""
     try:
-        channel_id = str(uuid.uuid4())
+        channel_id = new_id()
         
         # Generate chat link for site type channels
         chat_link = None
@@ -558,7 +728,8 @@ async def create_channel(channel_data: dict, base_url: str = "") -> dict:
             "created_at": datetime.now(timezone.utc)
         }
         
-        await db.channels.insert_one(new_channel)
+        await db.channels.insert_one(stored(new_channel))
+        list_counts.invalidate("channels")
         
         return {
             'id': new_channel['id'],
@@ -580,7 +751,7 @@ async def update_channel(channel_id: str, channel_data: dict) -> dict:
     """Update a channel"""
     try:
         # Check if channel exists
-        channel = await db.channels.find_one({"id": channel_id})
+        channel = await db.channels.find_one(id_query(channel_id))
         if not channel:
             raise ValueError("Canal não encontrado")
         
@@ -594,20 +765,26 @@ async def update_channel(channel_id: str, channel_data: dict) -> dict:
         
         if 'flow_id' in channel_data:
             update_data['flow_id'] = channel_data['flow_id']
-            # TODO: Get flow name from flows collection when implemented
-            update_data['flow_name'] = 'Padrão' if not channel_data['flow_id'] else 'Personalizado'
+            update_data['flow_name'] = 'Padrão'
+            if channel_data['flow_id']:
+                flow = await db.flows.find_one(id_query(channel_data['flow_id']), {"_id": 0, "name": 1})
+                if not flow:
+                    raise ValueError("Fluxo não encontrado")
+                update_data['flow_name'] = flow['name']
         
         if update_data:
             await db.channels.update_one(
-                {"id": channel_id},
+                id_query(channel_id),
                 {"$set": update_data}
             )
+            channel_flows.invalidate_channel(channel_id)
+            list_counts.invalidate("channels")
         
         # Get updated channel
-        updated = await db.channels.find_one({"id": channel_id})
+        updated = await db.channels.find_one(id_query(channel_id))
         
         return {
-            'id': updated.get('id'),
+            'id': doc_id(updated),
             'name': updated.get('name'),
             'type': updated.get('type'),
             'status': updated.get('status', 'connected'),
@@ -627,7 +804,9 @@ async def update_channel(channel_id: str, channel_data: dict) -> dict:
 async def delete_channel(channel_id: str) -> bool:
     """Delete a channel"""
     try:
-        result = await db.channels.delete_one({"id": channel_id})
+        result = await db.channels.delete_one(id_query(channel_id))
+        channel_flows.invalidate_channel(channel_id)
+        list_counts.invalidate("channels")
         return result.deleted_count > 0
         
     except Exception as e:
@@ -638,8 +817,11 @@ async def delete_channels_bulk(channel_ids: List[str]) -> int:
     """Delete multiple channels"""
     try:
         result = await db.channels.delete_many({
-            "id": {"$in": channel_ids}
+            **id_query({"$in": channel_ids})
         })
+        for channel_id in channel_ids:
+            channel_flows.invalidate_channel(channel_id)
+        list_counts.invalidate("channels")
         return result.deleted_count
         
     except Exception as e:
@@ -656,32 +838,34 @@ async def get_flows(page: int = 1, per_page: int = 10, search: str = None) -> di
         if search:
             query["name"] = {"$regex": search, "$options": "i"}
         
-        total = await db.flows.count_documents(query)
+        total, total_is_estimate = await list_counts.count(db.flows, query)
         skip = (page - 1) * per_page
         
-        cursor = db.flows.find(query).skip(skip).limit(per_page).sort("created_at", -1)
+        cursor = db.flows.find(query, {"compiled": 0}).skip(skip).limit(per_page).sort("created_at", -1)
         flows = []
         
         async for flow in cursor:
             # Check if flow is in use by any channel
-            channel = await db.channels.find_one({"flow_id": flow.get('id')})
+            channel = await db.channels.find_one({"flow_id": doc_id(flow)})
             is_in_use = channel is not None
             
             flows.append({
-                'id': flow.get('id'),
+                'id': doc_id(flow),
                 'name': flow.get('name'),
                 'is_in_use': is_in_use,
-                'channel_id': channel.get('id') if channel else None,
+                'channel_id': doc_id(channel) if channel else None,
                 'channel_name': channel.get('name') if channel else None,
                 'nodes': flow.get('nodes', []),
                 'edges': flow.get('edges', []),
                 'created_at': flow.get('created_at'),
-                'updated_at': flow.get('updated_at', flow.get('created_at'))
+                'updated_at': flow.get('updated_at', flow.get('created_at')),
+                'revision': flow.get('revision', 0)
             })
         
         return {
             'flows': flows,
             'total': total,
+            'total_is_estimate': total_is_estimate,
             'page': page,
             'per_page': per_page
         }
@@ -693,22 +877,23 @@ async def get_flows(page: int = 1, per_page: int = 10, search: str = None) -> di
 async def get_flow_by_id(flow_id: str) -> dict:
     """Get a single flow by ID"""
     try:
-        flow = await db.flows.find_one({"id": flow_id})
+        flow = await db.flows.find_one(id_query(flow_id), {"compiled": 0})
         if flow:
             # Check if flow is in use by any channel
             channel = await db.channels.find_one({"flow_id": flow_id})
             is_in_use = channel is not None
             
             return {
-                'id': flow.get('id'),
+                'id': doc_id(flow),
                 'name': flow.get('name'),
                 'is_in_use': is_in_use,
-                'channel_id': channel.get('id') if channel else None,
+                'channel_id': doc_id(channel) if channel else None,
                 'channel_name': channel.get('name') if channel else None,
                 'nodes': flow.get('nodes', []),
                 'edges': flow.get('edges', []),
                 'created_at': flow.get('created_at'),
-                'updated_at': flow.get('updated_at', flow.get('created_at'))
+                'updated_at': flow.get('updated_at', flow.get('created_at')),
+                'revision': flow.get('revision', 0)
             }
         return None
     except Exception as e:
@@ -721,15 +906,19 @@ async def create_flow(flow_data: dict) -> dict:
         now = datetime.now(timezone.utc)
         
         new_flow = {
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "name": flow_data['name'],
             "nodes": flow_data.get('nodes', []),
             "edges": flow_data.get('edges', []),
             "created_at": now,
-            "updated_at": now
+            "updated_at": now,
+            "revision": 0
         }
+        new_flow['compiled'] = compile_flow(new_flow['nodes'], new_flow['edges'])
         
-        await db.flows.insert_one(new_flow)
+        await db.flows.insert_one(stored(new_flow))
+        list_counts.invalidate("flows")
+        await _record_flow_revision(new_flow['id'], 0, new_flow['name'], new_flow['nodes'], new_flow['edges'])
         
         return {
             'id': new_flow['id'],
@@ -740,7 +929,8 @@ async def create_flow(flow_data: dict) -> dict:
             'nodes': new_flow['nodes'],
             'edges': new_flow['edges'],
             'created_at': new_flow['created_at'],
-            'updated_at': new_flow['updated_at']
+            'updated_at': new_flow['updated_at'],
+            'revision': new_flow['revision']
         }
         
     except Exception as e:
@@ -748,40 +938,317 @@ async def create_flow(flow_data: dict) -> dict:
         raise
 
 async def update_flow(flow_id: str, flow_data: dict) -> dict:
-    """Update a flow"""
+    """Update a flow.
+    
+    The write is guarded by the revision that was read, so the graph that
+    gets compiled and recorded as the new revision is the one stored; if
+    the flow changed in between, RevisionConflictError is raised.
+    """
     try:
         # Check if flow exists
-        flow = await db.flows.find_one({"id": flow_id})
+        flow = await db.flows.find_one(
+            id_query(flow_id),
+            {"_id": 0, "name": 1, "nodes": 1, "edges": 1, "revision": 1}
+        )
         if not flow:
             raise ValueError("Fluxo não encontrado")
+        revision = flow.get('revision', 0)
         
         update_data = {
-            "updated_at": datetime.now(timezone.utc)
+            "updated_at": datetime.now(timezone.utc),
+            "revision": revision + 1
         }
         
         if flow_data.get('name'):
             update_data['name'] = flow_data['name']
         
         if 'nodes' in flow_data:
-            update_data['nodes'] = flow_data['nodes']
+            update_data['nodes'] = flow_data['nodes'] or []
         
         if 'edges' in flow_data:
-            update_data['edges'] = flow_data['edges']
+            update_data['edges'] = flow_data['edges'] or []
+        
+        if 'nodes' in update_data or 'edges' in update_data:
+            # Validate the resulting graph and keep its compiled form alongside it
+            update_data['compiled'] = compile_flow(
+                update_data.get('nodes', flow.get('nodes', [])),
+                update_data.get('edges', flow.get('edges', []))
+            )
         
-        await db.flows.update_one(
-            {"id": flow_id},
+        result = await db.flows.update_one(
+            {**id_query(flow_id), "revision": flow.get('revision')},
             {"$set": update_data}
         )
+        if result.matched_count == 0:
+            if not await db.flows.find_one(id_query(flow_id), {"_id": 1}):
+                raise ValueError("Fluxo não encontrado")
+            raise RevisionConflictError("O fluxo foi alterado por outra sessão. Recarregue antes de salvar.")
+        
+        # The guard means the stored flow is the one read plus this update
+        name = update_data.get('name', flow.get('name'))
+        await _record_flow_revision(
+            flow_id, revision + 1, name,
+            update_data.get('nodes', flow.get('nodes', [])),
+            update_data.get('edges', flow.get('edges', []))
+        )
+        
+        if name != flow.get('name'):
+            # Channels keep a copy of the name of their flow
+            await db.channels.update_many({"flow_id": flow_id}, {"$set": {"flow_name": name}})
+            list_counts.invalidate("flows")
+        channel_flows.flow_changed(flow_id, name=name, compiled=update_data.get('compiled'))
         
         # Get updated flow
         return await get_flow_by_id(flow_id)
         
-    except ValueError as e:
+    except (ValueError, RevisionConflictError) as e:
         raise e
     except Exception as e:
         logger.error(f"Error updating flow: {e}")
         raise
 
+class RevisionConflictError(Exception):
+    """Raised when a flow changed since the revision the client edited"""
+    pass
+
+def _edge_key(edge: dict):
+    """Identity of an edge: its id, or its endpoints for edges saved without one"""
+    return edge.get('id') or (edge.get('source'), edge.get('target'), edge.get('sourceHandle'))
+
+async def patch_flow(flow_id: str, revision: int, operations: List[dict]) -> dict:
+    """Apply incremental editor operations to a flow.
+    
+    The operations are validated against the full graph (the result must
+    still compile), but only the touched array elements are written. Writes
+    are guarded by the revision the client edited; a stale revision raises
+    RevisionConflictError.
+    """
+    try:
+        flow = await db.flows.find_one(
+            id_query(flow_id),
+            {"_id": 0, "name": 1, "nodes": 1, "edges": 1, "revision": 1}
+        )
+        if not flow:
+            raise ValueError("Fluxo não encontrado")
+        current_revision = flow.get('revision', 0)
+        if current_revision != revision:
+            raise RevisionConflictError(
+                f"O fluxo foi alterado (revisão {current_revision}). Recarregue antes de salvar."
+            )
+        
+        original_nodes = {node.get('id'): node for node in flow.get('nodes', [])}
+        original_edges = {_edge_key(edge): edge for edge in flow.get('edges', [])}
+        nodes = dict(original_nodes)
+        edges = dict(original_edges)
+        moved = {}
+        # Elements removed and added back in the same patch are rewritten
+        recreated_nodes, recreated_edges = set(), set()
+        
+        for operation in operations:
+            op = operation['op']
+            if op == 'add_node':
+                node = operation.get('node') or {}
+                if not node.get('id'):
+                    raise ValueError("Bloco sem id")
+                if node['id'] in nodes:
+                    raise ValueError(f"Bloco '{node['id']}' já existe")
+                if node['id'] in original_nodes:
+                    recreated_nodes.add(node['id'])
+                nodes[node['id']] = node
+            elif op == 'remove_node':
+                if operation.get('id') not in nodes:
+                    raise ValueError(f"Bloco '{operation.get('id')}' não encontrado")
+                del nodes[operation['id']]
+                moved.pop(operation['id'], None)
+                for key in [k for k, e in edges.items() if operation['id'] in (e.get('source'), e.get('target'))]:
+                    del edges[key]
+            elif op == 'move_node':
+                node_id = operation.get('id')
+                if node_id not in nodes:
+                    raise ValueError(f"Bloco '{node_id}' não encontrado")
+                nodes[node_id] = {**nodes[node_id], 'position': operation.get('position')}
+                if node_id in original_nodes and node_id not in recreated_nodes:
+                    moved[node_id] = operation.get('position')
+            elif op == 'connect':
+                edge = dict(operation.get('edge') or {})
+                edge.setdefault('id', str(uuid.uuid4()))
+                if edge['id'] in edges:
+                    raise ValueError(f"Conexão '{edge['id']}' já existe")
+                if edge['id'] in original_edges:
+                    recreated_edges.add(edge['id'])
+                edges[edge['id']] = edge
+            elif op == 'disconnect':
+                key = operation.get('id')
+                if key not in edges and operation.get('edge'):
+                    key = _edge_key(operation['edge'])
+                if key not in edges:
+                    raise ValueError("Conexão não encontrada")
+                del edges[key]
+        
+        # Stored order is preserved; new blocks go to the end like the editor appends them
+        compiled = compile_flow(list(nodes.values()), list(edges.values()))
+        
+        nodes_removed = [
+            node_id for node_id in original_nodes if node_id not in nodes or node_id in recreated_nodes
+        ]
+        nodes_added = [
+            node for node_id, node in nodes.items() if node_id not in original_nodes or node_id in recreated_nodes
+        ]
+        edges_removed = [
+            edge for key, edge in original_edges.items() if key not in edges or key in recreated_edges
+        ]
+        edges_added = [
+            edge for key, edge in edges.items() if key not in original_edges or key in recreated_edges
+        ]
+        now = datetime.now(timezone.utc)
+        
+        # A single pipeline update rewrites only the touched elements: removed
+        # ones are filtered out, moved ones get their new position merged in
+        # and new ones are appended, all atomically under the revision guard.
+        # Client data goes through $literal so strings starting with $ in
+        # message blocks aren't read as field paths.
+        node_list = {"$ifNull": ["$nodes", []]}
+        if nodes_removed:
+            node_list = {"$filter": {
+                "input": node_list, "as": "node",
+                "cond": {"$not": {"$in": ["$$node.id", {"$literal": nodes_removed}]}}
+            }}
+        if moved:
+            moved_ids = list(moved)
+            node_list = {"$map": {
+                "input": node_list, "as": "node",
+                "in": {"$cond": [
+                    {"$in": ["$$node.id", {"$literal": moved_ids}]},
+                    {"$mergeObjects": ["$$node", {"position": {"$arrayElemAt": [
+                        {"$literal": list(moved.values())},
+                        {"$indexOfArray": [{"$literal": moved_ids}, "$$node.id"]}
+                    ]}}]},
+                    "$$node"
+                ]}
+            }}
+        edge_list = {"$ifNull": ["$edges", []]}
+        if edges_removed:
+            edge_list = {"$filter": {
+                "input": edge_list, "as": "edge",
+                "cond": {"$not": {"$in": ["$$edge", {"$literal": edges_removed}]}}
+            }}
+        
+        result = await db.flows.update_one(
+            {**id_query(flow_id), "revision": revision},
+            [{"$set": {
+                "nodes": {"$concatArrays": [node_list, {"$literal": nodes_added}]},
+                "edges": {"$concatArrays": [edge_list, {"$literal": edges_added}]},
+                "compiled": {"$literal": compiled},
+                "revision": revision + 1,
+                "updated_at": now
+            }}]
+        )
+        if result.matched_count == 0:
+            raise RevisionConflictError("O fluxo foi alterado por outra sessão. Recarregue antes de salvar.")
+        
+        await _record_flow_revision(
+            flow_id, revision + 1, flow.get('name'), list(nodes.values()), list(edges.values())
+        )
+        channel_flows.flow_changed(flow_id, compiled=compiled)
+        
+        return {
+            'id': flow_id,
+            'revision': revision + 1,
+            'updated_at': now,
+            'nodes_added': nodes_added,
+            'nodes_removed': nodes_removed,
+            'nodes_moved': [{'id': node_id, 'position': position} for node_id, position in moved.items()],
+            'edges_added': edges_added,
+            'edges_removed': edges_removed
+        }
+        
+    except (ValueError, RevisionConflictError) as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error patching flow: {e}")
+        raise
+
+async def get_compiled_flow(flow_id: str) -> Optional[dict]:
+    """Get the compiled form of a flow for execution"""
+    try:
+        flow = await db.flows.find_one(id_query(flow_id), {"_id": 0, "compiled": 1})
+        if not flow:
+            return None
+        
+        compiled = flow.get('compiled')
+        if compiled is None:
+            # Flows saved before compilation existed are compiled once, lazily
+            raw = await db.flows.find_one(id_query(flow_id), {"_id": 0, "nodes": 1, "edges": 1})
+            compiled = compile_flow(raw.get('nodes', []), raw.get('edges', []))
+            await db.flows.update_one(id_query(flow_id), {"$set": {"compiled": compiled}})
+        return compiled
+        
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error getting compiled flow: {e}")
+        raise
+
+async def get_channel_flow(channel_id: str) -> Optional[dict]:
+    """Get a channel together with its compiled flow in one round trip"""
+    try:
+        if binary_ids():
+            # flow_id is a string and can't be joined against a binary _id
+            channel = await db.channels.find_one(
+                id_query(channel_id),
+                id_projection({"_id": 0, "id": 1, "is_active": 1, "flow_id": 1, "flow_name": 1})
+            )
+            if not channel:
+                return None
+            channel = public(channel)
+            flow = None
+            if channel.get('flow_id'):
+                flow = public(await db.flows.find_one(
+                    id_query(channel['flow_id']),
+                    id_projection({"_id": 0, "id": 1, "name": 1, "compiled": 1})
+                ))
+            channel['flow'] = [flow] if flow else []
+        else:
+            pipeline = [
+                {"$match": id_query(channel_id)},
+                {"$lookup": {
+                    "from": "flows",
+                    "localField": "flow_id",
+                    "foreignField": "id",
+                    "as": "flow"
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "id": 1,
+                    "is_active": 1,
+                    "flow_id": 1,
+                    "flow_name": 1,
+                    "flow.id": 1,
+                    "flow.name": 1,
+                    "flow.compiled": 1
+                }}
+            ]
+            channels = await db.channels.aggregate(pipeline).to_list(1)
+            if not channels:
+                return None
+            channel = channels[0]
+        
+        flow = channel['flow'][0] if channel.get('flow') else None
+        compiled = None
+        if flow:
+            compiled = flow.get('compiled') or await get_compiled_flow(flow['id'])
+        return {
+            'id': channel['id'],
+            'is_active': channel.get('is_active', True),
+            'flow_id': flow['id'] if flow else None,
+            'flow_name': flow['name'] if flow else channel.get('flow_name', 'Padrão'),
+            'compiled': compiled
+        }
+        
+    except Exception as e:
+        logger.error(f"Error getting channel flow: {e}")
+        raise
+
 async def delete_flow(flow_id: str) -> bool:
     """Delete a flow"""
     try:
@@ -790,7 +1257,13 @@ async def delete_flow(flow_id: str) -> bool:
         if channel:
             raise ValueError(f"Fluxo está em uso pelo canal '{channel.get('name')}'. Remova a associação primeiro.")
         
-        result = await db.flows.delete_one({"id": flow_id})
+        result = await db.flows.delete_one(id_query(flow_id))
+        if result.deleted_count > 0:
+            hashes = await _revision_blob_hashes([flow_id])
+            await db.flow_revisions.delete_many({"flow_id": flow_id})
+            await _collect_flow_blobs(hashes)
+            channel_flows.flow_removed(flow_id)
+            list_counts.invalidate("flows", "flow_revisions")
         return result.deleted_count > 0
         
     except ValueError as e:
@@ -804,6 +1277,7 @@ async def delete_flows_bulk(flow_ids: List[str]) -> dict:
     try:
         deleted_count = 0
         skipped = []
+        hashes = set()
         
         for flow_id in flow_ids:
             # Check if flow is in use
@@ -815,9 +1289,15 @@ async def delete_flows_bulk(flow_ids: List[str]) -> dict:
                 })
                 continue
             
-            result = await db.flows.delete_one({"id": flow_id})
+            result = await db.flows.delete_one(id_query(flow_id))
             if result.deleted_count > 0:
+                hashes.update(await _revision_blob_hashes([flow_id]))
+                await db.flow_revisions.delete_many({"flow_id": flow_id})
+                channel_flows.flow_removed(flow_id)
                 deleted_count += 1
+        # One pass for all the flows, since they often share blobs
+        await _collect_flow_blobs(hashes)
+        list_counts.invalidate("flows", "flow_revisions")
         
         return {
             'deleted_count': deleted_count,
@@ -832,7 +1312,7 @@ async def duplicate_flow(flow_id: str) -> dict:
     """Duplicate a flow"""
     try:
         # Get original flow
-        original = await db.flows.find_one({"id": flow_id})
+        original = await db.flows.find_one(id_query(flow_id))
         if not original:
             raise ValueError("Fluxo não encontrado")
         
@@ -840,15 +1320,23 @@ async def duplicate_flow(flow_id: str) -> dict:
         
         # Create copy with new name
         new_flow = {
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "name": f"{original['name']} (cópia)",
             "nodes": original.get('nodes', []),
             "edges": original.get('edges', []),
+            "compiled": original.get('compiled') or compile_flow(original.get('nodes', []), original.get('edges', [])),
             "created_at": now,
-            "updated_at": now
+            "updated_at": now,
+            "revision": 0
         }
         
-        await db.flows.insert_one(new_flow)
+        await db.flows.insert_one(stored(new_flow))
+        list_counts.invalidate("flows")
+        # Same content as the original, so only references are written
+        await _record_flow_revision(
+            new_flow['id'], 0, new_flow['name'], new_flow['nodes'], new_flow['edges'],
+            base_flow_id=flow_id
+        )
         
         return {
             'id': new_flow['id'],
@@ -859,7 +1347,8 @@ async def duplicate_flow(flow_id: str) -> dict:
             'nodes': new_flow['nodes'],
             'edges': new_flow['edges'],
             'created_at': new_flow['created_at'],
-            'updated_at': new_flow['updated_at']
+            'updated_at': new_flow['updated_at'],
+            'revision': new_flow['revision']
         }
         
     except ValueError as e:
@@ -868,10 +1357,224 @@ async def duplicate_flow(flow_id: str) -> dict:
         logger.error(f"Error duplicating flow: {e}")
         raise
 
+def _build_flow_revision(flow_id: str, number: int, name: str, nodes: List[dict],
+                         edges: List[dict]) -> tuple:
+    """Build a revision document and the blobs it references"""
+    node_refs, node_blobs = build_manifest(nodes)
+    edge_refs, edge_blobs = build_manifest(edges)
+    revision = {
+        "id": new_id(),
+        "flow_id": flow_id,
+        "number": number,
+        "name": name,
+        "nodes": node_refs,
+        "edges": edge_refs,
+        "root": root_hash(node_refs, edge_refs),
+        "created_at": datetime.now(timezone.utc)
+    }
+    return revision, {**node_blobs, **edge_blobs}
+
+async def _store_flow_blobs(blobs: dict) -> None:
+    """Insert blobs that are not stored yet"""
+    if blobs:
+        now = datetime.now(timezone.utc)
+        await db.flow_blobs.bulk_write([
+            UpdateOne({"_id": digest}, {"$setOnInsert": {"data": blob}, "$set": {"stored_at": now}}, upsert=True)
+            for digest, blob in blobs.items()
+        ], ordered=False)
+
+async def _revision_blob_hashes(flow_ids: List[str]) -> set:
+    """Hashes of every blob referenced by the revisions of some flows"""
+    pipeline = [
+        {"$match": {"flow_id": {"$in": flow_ids}}},
+        {"$project": {"_id": 0, "h": {"$concatArrays": ["$nodes.h", "$edges.h"]}}},
+        {"$unwind": "$h"},
+        {"$group": {"_id": "$h"}}
+    ]
+    return {row['_id'] async for row in db.flow_revisions.aggregate(pipeline)}
+
+async def _collect_flow_blobs(hashes) -> int:
+    """Delete blobs among `hashes` that no revision references any more.
+    
+    Blobs are shared between revisions and flows, so only the candidates
+    (blobs of deleted revisions) are checked, through the multikey
+    indexes on the revision references.
+    """
+    hashes = list(hashes)
+    cutoff = datetime.now(timezone.utc) - FLOW_BLOB_GRACE
+    deleted = 0
+    try:
+        for i in range(0, len(hashes), 1000):
+            chunk = hashes[i:i + 1000]
+            in_use = set()
+            for field in ("nodes.h", "edges.h"):
+                pipeline = [
+                    {"$match": {field: {"$in": chunk}}},
+                    {"$project": {"_id": 0, "h": {"$filter": {
+                        "input": f"${field}", "as": "h", "cond": {"$in": ["$$h", chunk]}
+                    }}}},
+                    {"$unwind": "$h"},
+                    {"$group": {"_id": "$h"}}
+                ]
+                in_use.update([row['_id'] async for row in db.flow_revisions.aggregate(pipeline)])
+            unused = [digest for digest in chunk if digest not in in_use]
+            if unused:
+                result = await db.flow_blobs.delete_many(
+                    {"_id": {"$in": unused}, "stored_at": {"$not": {"$gte": cutoff}}}
+                )
+                deleted += result.deleted_count
+    except Exception as e:
+        # Leftover blobs only take space; the flow itself is already gone
+        logger.error(f"Error collecting flow blobs: {e}")
+    return deleted
+
+async def _record_flow_revision(flow_id: str, number: int, name: str, nodes: List[dict],
+                                edges: List[dict], base_flow_id: str = None) -> None:
+    """Store a revision as references to content-addressed node/edge blobs.
+    
+    Blobs referenced by the latest revision (of this flow, or of
+    base_flow_id for copies) already exist and are not written again.
+    """
+    revision, blobs = _build_flow_revision(flow_id, number, name, nodes, edges)
+    
+    previous = await db.flow_revisions.find_one(
+        {"flow_id": base_flow_id or flow_id},
+        {"_id": 0, "nodes.h": 1, "edges.h": 1},
+        sort=[("number", -1)]
+    )
+    if previous:
+        for reference in previous.get('nodes', []) + previous.get('edges', []):
+            blobs.pop(reference['h'], None)
+    
+    await _store_flow_blobs(blobs)
+    await db.flow_revisions.insert_one(stored(revision))
+    list_counts.invalidate("flow_revisions")
+
+async def _load_blobs(hashes) -> dict:
+    """Fetch blob contents by hash"""
+    hashes = list(set(hashes))
+    blobs = {}
+    for i in range(0, len(hashes), 1000):
+        async for blob in db.flow_blobs.find({"_id": {"$in": hashes[i:i + 1000]}}):
+            blobs[blob['_id']] = blob['data']
+    return blobs
+
+async def get_flow_revisions(flow_id: str, page: int = 1, per_page: int = 10) -> dict:
+    """Get the revision history of a flow with pagination"""
+    try:
+        query = {"flow_id": flow_id}
+        
+        total, total_is_estimate = await list_counts.count(db.flow_revisions, query)
+        skip = (page - 1) * per_page
+        
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"number": -1}},
+            {"$skip": skip},
+            {"$limit": per_page},
+            {"$project": {
+                "_id": 0,
+                "number": 1,
+                "name": 1,
+                "root": 1,
+                "created_at": 1,
+                "node_count": {"$size": "$nodes"},
+                "edge_count": {"$size": "$edges"}
+            }}
+        ]
+        revisions = [revision async for revision in db.flow_revisions.aggregate(pipeline)]
+        
+        return {
+            'revisions': revisions,
+            'total': total,
+            'total_is_estimate': total_is_estimate,
+            'page': page,
+            'per_page': per_page
+        }
+        
+    except Exception as e:
+        logger.error(f"Error getting flow revisions: {e}")
+        raise
+
+async def restore_flow_revision(flow_id: str, number: int) -> dict:
+    """Restore a flow to a previous revision, recorded as a new revision"""
+    try:
+        revision = await db.flow_revisions.find_one({"flow_id": flow_id, "number": number})
+        if not revision:
+            raise ValueError("Revisão não encontrada")
+        
+        references = revision['nodes'] + revision['edges']
+        blobs = await _load_blobs(reference['h'] for reference in references)
+        if any(reference['h'] not in blobs for reference in references):
+            raise ValueError("Conteúdo da revisão incompleto")
+        
+        return await update_flow(flow_id, {
+            'name': revision['name'],
+            'nodes': [blobs[reference['h']] for reference in revision['nodes']],
+            'edges': [blobs[reference['h']] for reference in revision['edges']]
+        })
+        
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error restoring flow revision: {e}")
+        raise
+
+async def diff_flow_revisions(flow_id: str, from_number: int, to_number: int) -> dict:
+    """Diff two revisions of a flow.
+    
+    Manifests are compared by hash, so only blobs of added, removed or
+    modified elements are read.
+    """
+    try:
+        revisions = {}
+        cursor = db.flow_revisions.find({"flow_id": flow_id, "number": {"$in": [from_number, to_number]}})
+        async for revision in cursor:
+            revisions[revision['number']] = revision
+        if from_number not in revisions or to_number not in revisions:
+            raise ValueError("Revisão não encontrada")
+        
+        old, new = revisions[from_number], revisions[to_number]
+        result = {
+            'from_number': from_number,
+            'to_number': to_number,
+            'identical': old['root'] == new['root'],
+            'name_before': old['name'],
+            'name_after': new['name'],
+            'nodes': {'added': [], 'removed': [], 'modified': []},
+            'edges': {'added': [], 'removed': [], 'modified': []}
+        }
+        if result['identical']:
+            return result
+        
+        changes = {kind: diff_manifests(old[kind], new[kind]) for kind in ('nodes', 'edges')}
+        needed = []
+        for change in changes.values():
+            needed += [digest for _, digest in change['added'] + change['removed']]
+            needed += [digest for _, before, after in change['modified'] for digest in (before, after)]
+        blobs = await _load_blobs(needed)
+        
+        for kind, change in changes.items():
+            result[kind] = {
+                'added': [blobs.get(digest) for _, digest in change['added']],
+                'removed': [blobs.get(digest) for _, digest in change['removed']],
+                'modified': [
+                    {'id': key, 'before': blobs.get(before), 'after': blobs.get(after)}
+                    for key, before, after in change['modified']
+                ]
+            }
+        return result
+        
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error diffing flow revisions: {e}")
+        raise
+
 async def export_flow(flow_id: str) -> dict:
     """Export a flow as JSON"""
     try:
-        flow = await db.flows.find_one({"id": flow_id})
+        flow = await db.flows.find_one(id_query(flow_id))
         if not flow:
             raise ValueError("Fluxo não encontrado")
         
@@ -889,21 +1592,127 @@ async def export_flow(flow_id: str) -> dict:
         logger.error(f"Error exporting flow: {e}")
         raise
 
+async def iter_flow_exports(flow_ids: Optional[List[str]] = None):
+    """Yield flows in export format straight from a server-side cursor"""
+    query = id_query({"$in": flow_ids}) if flow_ids else {}
+    exported_at = datetime.now(timezone.utc).isoformat()
+    cursor = db.flows.find(
+        query,
+        {"_id": 0, "name": 1, "nodes": 1, "edges": 1},
+        batch_size=FLOW_ARCHIVE_BATCH_SIZE
+    )
+    async for flow in cursor:
+        yield {
+            'name': flow.get('name'),
+            'nodes': flow.get('nodes', []),
+            'edges': flow.get('edges', []),
+            'exported_at': exported_at
+        }
+
+async def import_flows_bulk(records, batch_size: int = FLOW_ARCHIVE_BATCH_SIZE) -> dict:
+    """Import flows from an async iterator of (line number, flow data).
+    
+    Items may also carry an exception for lines that failed to parse; those
+    are reported along with flows that fail to compile. Valid flows are
+    written with insert_many every batch_size flows.
+    
+    If the iterator itself raises a ValueError (the archive can't be read
+    past some point), the flows before it are still written and the result
+    says where the import stopped, since earlier batches are already
+    committed. Nothing imported at all is reported as the error itself.
+    """
+    imported = 0
+    failed = 0
+    errors = []
+    aborted = None
+    line_number = 0
+    flows, revisions, blobs = [], [], {}
+    
+    async def flush():
+        nonlocal flows, revisions, blobs
+        if not flows:
+            return
+        await db.flows.insert_many(flows, ordered=False)
+        await _store_flow_blobs(blobs)
+        await db.flow_revisions.insert_many(revisions, ordered=False)
+        list_counts.invalidate("flows", "flow_revisions")
+        flows, revisions, blobs = [], [], {}
+    
+    async def valid_flows():
+        nonlocal failed, line_number
+        async for line_number, flow_data in records:
+            try:
+                if isinstance(flow_data, Exception):
+                    raise flow_data
+                now = datetime.now(timezone.utc)
+                new_flow = {
+                    "id": new_id(),
+                    "name": flow_data['name'],
+                    "nodes": flow_data.get('nodes') or [],
+                    "edges": flow_data.get('edges') or [],
+                    "created_at": now,
+                    "updated_at": now,
+                    "revision": 0
+                }
+                new_flow['compiled'] = compile_flow(new_flow['nodes'], new_flow['edges'])
+            except ValueError as e:
+                failed += 1
+                if len(errors) < MAX_IMPORT_ERRORS:
+                    errors.append({'line': line_number, 'error': str(e)})
+                continue
+            yield new_flow
+    
+    try:
+        try:
+            async for new_flow in valid_flows():
+                revision, revision_blobs = _build_flow_revision(
+                    new_flow['id'], 0, new_flow['name'], new_flow['nodes'], new_flow['edges']
+                )
+                flows.append(stored(new_flow))
+                revisions.append(stored(revision))
+                blobs.update(revision_blobs)
+                imported += 1
+                if len(flows) >= batch_size:
+                    await flush()
+        except ValueError as e:
+            if not imported:
+                raise
+            aborted = {'line': line_number + 1, 'error': str(e)}
+        
+        await flush()
+        return {
+            'imported': imported,
+            'failed': failed,
+            'errors': errors,
+            'aborted': aborted
+        }
+        
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error importing flows in bulk: {e}")
+        raise
+
 async def import_flow(flow_data: dict) -> dict:
     """Import a flow from JSON"""
     try:
         now = datetime.now(timezone.utc)
         
         new_flow = {
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "name": flow_data['name'],
-            "nodes": flow_data.get('nodes', []),
-            "edges": flow_data.get('edges', []),
+            "nodes": flow_data.get('nodes') or [],
+            "edges": flow_data.get('edges') or [],
             "created_at": now,
-            "updated_at": now
+            "updated_at": now,
+            "revision": 0
         }
+        # Validate before storing; raises FlowCompileError (a ValueError)
+        new_flow['compiled'] = compile_flow(new_flow['nodes'], new_flow['edges'])
         
-        await db.flows.insert_one(new_flow)
+        await db.flows.insert_one(stored(new_flow))
+        list_counts.invalidate("flows")
+        await _record_flow_revision(new_flow['id'], 0, new_flow['name'], new_flow['nodes'], new_flow['edges'])
         
         return {
             'id': new_flow['id'],
@@ -914,9 +1723,12 @@ async def import_flow(flow_data: dict) -> dict:
             'nodes': new_flow['nodes'],
             'edges': new_flow['edges'],
             'created_at': new_flow['created_at'],
-            'updated_at': new_flow['updated_at']
+            'updated_at': new_flow['updated_at'],
+            'revision': new_flow['revision']
         }
         
+    except ValueError as e:
+        raise e
     except Exception as e:
         logger.error(f"Error importing flow: {e}")
         raise
@@ -931,7 +1743,7 @@ async def get_teams(page: int = 1, per_page: int = 10, search: str = None) -> di
         if search:
             query["name"] = {"$regex": search, "$options": "i"}
         
-        total = await db.teams.count_documents(query)
+        total, total_is_estimate = await list_counts.count(db.teams, query)
         skip = (page - 1) * per_page
         
         cursor = db.teams.find(query).skip(skip).limit(per_page).sort("created_at", -1)
@@ -939,13 +1751,10 @@ async def get_teams(page: int = 1, per_page: int = 10, search: str = None) -> di
         
         async for team in cursor:
             # Count agents in this team
-            agent_count = await db.users.count_documents({
-                "role": "agent",
-                "team_id": team.get('id')
-            })
+            agent_count, _ = await list_counts.count(db.users, {"role": "agent", "team_id": doc_id(team)})
             
             teams.append({
-                'id': team.get('id'),
+                'id': doc_id(team),
                 'name': team.get('name'),
                 'session_timeout': team.get('session_timeout', 300),
                 'finish_message': team.get('finish_message', 'Atendimento encerrado. Obrigado pelo contato!'),
@@ -958,6 +1767,7 @@ async def get_teams(page: int = 1, per_page: int = 10, search: str = None) -> di
         return {
             'teams': teams,
             'total': total,
+            'total_is_estimate': total_is_estimate,
             'page': page,
             'per_page': per_page
         }
@@ -969,16 +1779,13 @@ async def get_teams(page: int = 1, per_page: int = 10, search: str = None) -> di
 async def get_team_by_id(team_id: str) -> dict:
     """Get a single team by ID"""
     try:
-        team = await db.teams.find_one({"id": team_id})
+        team = await db.teams.find_one(id_query(team_id))
         if team:
             # Count agents in this team
-            agent_count = await db.users.count_documents({
-                "role": "agent",
-                "team_id": team_id
-            })
+            agent_count, _ = await list_counts.count(db.users, {"role": "agent", "team_id": team_id})
             
             return {
-                'id': team.get('id'),
+                'id': doc_id(team),
                 'name': team.get('name'),
                 'session_timeout': team.get('session_timeout', 300),
                 'finish_message': team.get('finish_message', 'Atendimento encerrado. Obrigado pelo contato!'),
@@ -1003,7 +1810,7 @@ async def create_team(team_data: dict) -> dict:
         now = datetime.now(timezone.utc)
         
         new_team = {
-            "id": str(uuid.uuid4()),
+            "id": new_id(),
             "name": team_data['name'],
             "session_timeout": team_data.get('session_timeout', 300),
             "finish_message": team_data.get('finish_message', 'Atendimento encerrado. Obrigado pelo contato!'),
@@ -1012,7 +1819,8 @@ async def create_team(team_data: dict) -> dict:
             "updated_at": now
         }
         
-        await db.teams.insert_one(new_team)
+        await db.teams.insert_one(stored(new_team))
+        list_counts.invalidate("teams")
         
         return {
             'id': new_team['id'],
@@ -1035,7 +1843,7 @@ async def update_team(team_id: str, team_data: dict) -> dict:
     """Update a team"""
     try:
         # Check if team exists
-        team = await db.teams.find_one({"id": team_id})
+        team = await db.teams.find_one(id_query(team_id))
         if not team:
             raise ValueError("Equipe não encontrada")
         
@@ -1047,7 +1855,7 @@ async def update_team(team_id: str, team_data: dict) -> dict:
             # Check if new name is taken
             existing = await db.teams.find_one({
                 "name": team_data['name'],
-                "id": {"$ne": team_id}
+                **id_query({"$ne": team_id})
             })
             if existing:
                 raise ValueError("Já existe uma equipe com este nome")
@@ -1063,9 +1871,10 @@ async def update_team(team_id: str, team_data: dict) -> dict:
             update_data['no_agent_message'] = team_data['no_agent_message']
         
         await db.teams.update_one(
-            {"id": team_id},
+            id_query(team_id),
             {"$set": update_data}
         )
+        list_counts.invalidate("teams")
         
         # Get updated team
         return await get_team_by_id(team_id)
@@ -1087,7 +1896,10 @@ async def delete_team(team_id: str) -> bool:
         if agent_count > 0:
             raise ValueError(f"Não é possível excluir esta equipe. Existem {agent_count} agente(s) vinculado(s).")
         
-        result = await db.teams.delete_one({"id": team_id})
+        result = await db.teams.delete_one(id_query(team_id))
+        list_counts.invalidate("teams")
+        if result.deleted_count > 0:
+            await _delete_team_canned_replies(team_id)
         return result.deleted_count > 0
         
     except ValueError as e:
@@ -1109,7 +1921,7 @@ async def delete_teams_bulk(team_ids: List[str]) -> dict:
                 "team_id": team_id
             })
             if agent_count > 0:
-                team = await db.teams.find_one({"id": team_id})
+                team = await db.teams.find_one(id_query(team_id))
                 skipped.append({
                     'id': team_id,
                     'name': team.get('name') if team else 'Desconhecido',
@@ -1117,9 +1929,11 @@ async def delete_teams_bulk(team_ids: List[str]) -> dict:
                 })
                 continue
             
-            result = await db.teams.delete_one({"id": team_id})
+            result = await db.teams.delete_one(id_query(team_id))
             if result.deleted_count > 0:
                 deleted_count += 1
+                await _delete_team_canned_replies(team_id)
+        list_counts.invalidate("teams")
         
         return {
             'deleted_count': deleted_count,
@@ -1129,3 +1943,874 @@ async def delete_teams_bulk(team_ids: List[str]) -> dict:
     except Exception as e:
         logger.error(f"Error deleting teams in bulk: {e}")
         raise
+
+
+# Canned reply CRUD operations
+def _canned_reply(reply: dict) -> dict:
+    return {
+        'id': doc_id(reply),
+        'team_id': reply.get('team_id'),
+        'shortcut': reply.get('shortcut'),
+        'title': reply.get('title'),
+        'content': reply.get('content'),
+        'created_at': reply.get('created_at'),
+        'updated_at': reply.get('updated_at', reply.get('created_at'))
+    }
+
+async def get_canned_replies(page: int = 1, per_page: int = 10, search: str = None,
+                             team_id: str = None, global_only: bool = False) -> dict:
+    """Get canned replies with pagination, optionally of one scope"""
+    try:
+        query = {}
+        
+        if global_only:
+            query["team_id"] = None
+        elif team_id:
+            query["team_id"] = team_id
+        
+        if search:
+            query["$or"] = [
+                {"shortcut": {"$regex": search, "$options": "i"}},
+                {"title": {"$regex": search, "$options": "i"}}
+            ]
+        
+        total, total_is_estimate = await list_counts.count(db.canned_replies, query)
+        skip = (page - 1) * per_page
+        
+        cursor = db.canned_replies.find(query).skip(skip).limit(per_page).sort("created_at", -1)
+        replies = [_canned_reply(reply) async for reply in cursor]
+        
+        return {
+            'canned_replies': replies,
+            'total': total,
+            'total_is_estimate': total_is_estimate,
+            'page': page,
+            'per_page': per_page
+        }
+        
+    except Exception as e:
+        logger.error(f"Error getting canned replies: {e}")
+        raise
+
+async def get_canned_reply_by_id(reply_id: str) -> dict:
+    """Get a single canned reply by ID"""
+    try:
+        reply = await db.canned_replies.find_one(id_query(reply_id))
+        return _canned_reply(reply) if reply else None
+    except Exception as e:
+        logger.error(f"Error getting canned reply: {e}")
+        raise
+
+async def get_scope_canned_replies(team_id: Optional[str]) -> List[dict]:
+    """Every canned reply of a team, or the global ones when team_id is None"""
+    try:
+        cursor = db.canned_replies.find(
+            {"team_id": team_id},
+            id_projection({"_id": 0, "id": 1, "team_id": 1, "shortcut": 1, "title": 1, "content": 1})
+        )
+        return [
+            {'id': doc_id(reply), 'team_id': reply.get('team_id'), 'shortcut': reply['shortcut'],
+             'title': reply.get('title', ''), 'content': reply.get('content', '')}
+            async for reply in cursor
+        ]
+    except Exception as e:
+        logger.error(f"Error loading canned replies: {e}")
+        raise
+
+async def _check_canned_reply_scope(team_id: Optional[str], shortcut: str, exclude_id: str = None):
+    if team_id and not await db.teams.find_one(id_query(team_id)):
+        raise ValueError("Equipe não encontrada")
+    query = {"team_id": team_id, "shortcut": shortcut}
+    if exclude_id:
+        query.update(id_query({"$ne": exclude_id}))
+    if await db.canned_replies.find_one(query):
+        raise ValueError(f"Já existe uma mensagem predefinida com o atalho /{shortcut}")
+
+async def create_canned_reply(reply_data: dict) -> dict:
+    """Create a new canned reply"""
+    try:
+        team_id = reply_data.get('team_id') or None
+        shortcut = normalize_shortcut(reply_data['shortcut'])
+        await _check_canned_reply_scope(team_id, shortcut)
+        
+        now = datetime.now(timezone.utc)
+        
+        new_reply = {
+            "id": new_id(),
+            "team_id": team_id,
+            "shortcut": shortcut,
+            "title": reply_data['title'],
+            "content": reply_data['content'],
+            "created_at": now,
+            "updated_at": now
+        }
+        
+        try:
+            await db.canned_replies.insert_one(stored(new_reply))
+        except DuplicateKeyError:
+            raise ValueError(f"Já existe uma mensagem predefinida com o atalho /{shortcut}")
+        list_counts.invalidate("canned_replies")
+        canned_replies.invalidate(team_id)
+        
+        return _canned_reply(new_reply)
+        
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error creating canned reply: {e}")
+        raise
+
+async def update_canned_reply(reply_id: str, reply_data: dict) -> dict:
+    """Update a canned reply; it may move to another team or become global"""
+    try:
+        reply = await db.canned_replies.find_one(id_query(reply_id))
+        if not reply:
+            raise ValueError("Mensagem predefinida não encontrada")
+        
+        update_data = {
+            "updated_at": datetime.now(timezone.utc)
+        }
+        
+        team_id = reply.get('team_id')
+        if 'team_id' in reply_data:
+            update_data['team_id'] = team_id = reply_data['team_id'] or None
+        
+        shortcut = reply['shortcut']
+        if reply_data.get('shortcut'):
+            update_data['shortcut'] = shortcut = normalize_shortcut(reply_data['shortcut'])
+        
+        if 'team_id' in update_data or 'shortcut' in update_data:
+            await _check_canned_reply_scope(team_id, shortcut, exclude_id=reply_id)
+        
+        if reply_data.get('title') is not None:
+            update_data['title'] = reply_data['title']
+        
+        if reply_data.get('content') is not None:
+            update_data['content'] = reply_data['content']
+        
+        try:
+            await db.canned_replies.update_one(
+                id_query(reply_id),
+                {"$set": update_data}
+            )
+        except DuplicateKeyError:
+            raise ValueError(f"Já existe uma mensagem predefinida com o atalho /{shortcut}")
+        list_counts.invalidate("canned_replies")
+        canned_replies.invalidate(reply.get('team_id'))
+        canned_replies.invalidate(team_id)
+        
+        return await get_canned_reply_by_id(reply_id)
+        
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error updating canned reply: {e}")
+        raise
+
+async def delete_canned_reply(reply_id: str) -> bool:
+    """Delete a canned reply"""
+    try:
+        reply = await db.canned_replies.find_one_and_delete(id_query(reply_id), {"team_id": 1})
+        if not reply:
+            return False
+        list_counts.invalidate("canned_replies")
+        canned_replies.invalidate(reply.get('team_id'))
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error deleting canned reply: {e}")
+        raise
+
+async def delete_canned_replies_bulk(reply_ids: List[str]) -> dict:
+    """Delete multiple canned replies"""
+    try:
+        query = id_query({"$in": reply_ids})
+        team_ids = await db.canned_replies.distinct("team_id", query)
+        result = await db.canned_replies.delete_many(query)
+        list_counts.invalidate("canned_replies")
+        for team_id in team_ids:
+            canned_replies.invalidate(team_id)
+        
+        return {
+            'deleted_count': result.deleted_count
+        }
+        
+    except Exception as e:
+        logger.error(f"Error deleting canned replies in bulk: {e}")
+        raise
+
+async def _delete_team_canned_replies(team_id: str):
+    """A deleted team's canned replies go with it"""
+    await db.canned_replies.delete_many({"team_id": team_id})
+    list_counts.invalidate("canned_replies")
+    canned_replies.invalidate(team_id)
+
+
+# Dashboard operations
+async def _facet_counts(collection, facets: dict) -> dict:
+    """Count several filters of one collection in a single $facet pass"""
+    pipeline = [{"$facet": {
+        name: stages + [{"$count": "count"}] for name, stages in facets.items()
+    }}]
+    result = await collection.aggregate(pipeline).to_list(1)
+    row = result[0] if result else {}
+    return {name: row[name][0]['count'] if row.get(name) else 0 for name in facets}
+
+async def _load_dashboard_summary() -> dict:
+    users, channels, flow_total, team_total = await asyncio.gather(
+        _facet_counts(db.users, {
+            'agents': [{"$match": {"role": "agent"}}],
+            'admins': [{"$match": {"role": "admin"}}]
+        }),
+        _facet_counts(db.channels, {
+            'active': [{"$match": {"is_active": {"$ne": False}}}],
+            'inactive': [{"$match": {"is_active": False}}],
+            # Flows can't be deleted while in use, so every referenced flow exists
+            'flows_in_use': [{"$match": {"flow_id": {"$ne": None}}}, {"$group": {"_id": "$flow_id"}}]
+        }),
+        db.flows.estimated_document_count(),
+        db.teams.estimated_document_count()
+    )
+    in_use = min(channels['flows_in_use'], flow_total)
+    return {
+        'agents': users['agents'],
+        'admins': users['admins'],
+        'channels': {'active': channels['active'], 'inactive': channels['inactive']},
+        'flows': {'in_use': in_use, 'unused': flow_total - in_use},
+        'teams': team_total,
+        'generated_at': datetime.now(timezone.utc)
+    }
+
+async def get_dashboard_summary() -> dict:
+    """Entity counts for the admin dashboard, cached for a few seconds.
+    
+    Concurrent requests during a refresh share the same load.
+    """
+    try:
+        now = time.monotonic()
+        if _dashboard['summary'] is not None and now - _dashboard['loaded_at'] <= DASHBOARD_CACHE_TTL:
+            return _dashboard['summary']
+        
+        if _dashboard['loading'] is None:
+            _dashboard['loading'] = asyncio.ensure_future(_load_dashboard_summary())
+        loading = _dashboard['loading']
+        try:
+            summary = await asyncio.shield(loading)
+        finally:
+            if _dashboard['loading'] is loading and loading.done():
+                _dashboard['loading'] = None
+        _dashboard['summary'] = summary
+        _dashboard['loaded_at'] = now
+        return summary
+        
+    except Exception as e:
+        logger.error(f"Error getting dashboard summary: {e}")
+        raise
+
+
+# Conversation operations
+def _conversation_response(conversation: dict) -> dict:
+    """Shape a conversation document for API responses"""
+    return {
+        'id': doc_id(conversation),
+        'channel_id': conversation.get('channel_id'),
+        'team_id': conversation.get('team_id'),
+        'client_name': conversation.get('client_name'),
+        'status': conversation.get('status', 'waiting'),
+        'priority': conversation.get('priority', 0),
+        'assignee_id': conversation.get('assignee_id'),
+        'created_at': conversation.get('created_at'),
+        'assigned_at': conversation.get('assigned_at'),
+        'closed_at': conversation.get('closed_at'),
+        'last_message_at': conversation.get('last_message_at', conversation.get('created_at')),
+        'expires_at': conversation.get('expires_at'),
+        'client_read_seq': conversation.get('client_read_seq', 0),
+        'agent_read_seq': conversation.get('agent_read_seq', 0)
+    }
+
+async def create_conversation(conversation_data: dict) -> dict:
+    """Create a waiting conversation for a visitor"""
+    try:
+        channel = await channel_flows.resolve(conversation_data['channel_id'])
+        if not channel:
+            raise ValueError("Canal não encontrado")
+        if not channel.is_active:
+            raise ValueError("Canal inativo")
+        
+        session_timeout = 300
+        if conversation_data.get('team_id'):
+            team = await db.teams.find_one(id_query(conversation_data['team_id']))
+            if not team:
+                raise ValueError("Equipe não encontrada")
+            session_timeout = team.get('session_timeout', 300)
+        
+        now = datetime.now(timezone.utc)
+        
+        new_conversation = {
+            "id": new_id(),
+            "channel_id": conversation_data['channel_id'],
+            "flow_id": channel.flow_id,
+            "team_id": conversation_data.get('team_id'),
+            "client_name": conversation_data.get('client_name') or 'Visitante',
+            "status": "waiting",
+            "priority": conversation_data.get('priority', 0),
+            "assignee_id": None,
+            "created_at": now,
+            "assigned_at": None,
+            "closed_at": None,
+            "last_message_at": now,
+            "updated_at": now,
+            "session_timeout": session_timeout,
+            "expires_at": now + timedelta(seconds=session_timeout),
+            "message_seq": 0
+        }
+        
+        await db.conversations.insert_one(stored(new_conversation))
+        conversation_metrics.record(new_conversation, "created")
+        
+        return _conversation_response(new_conversation)
+        
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error creating conversation: {e}")
+        raise
+
+async def get_conversation_by_id(conversation_id: str) -> dict:
+    """Get a single conversation by ID"""
+    try:
+        conversation = await db.conversations.find_one(id_query(conversation_id))
+        if conversation:
+            return _conversation_response(conversation)
+        return None
+    except Exception as e:
+        logger.error(f"Error getting conversation: {e}")
+        raise
+
+async def assign_conversation(conversation_id: str, agent_id: str) -> bool:
+    """Assign a waiting conversation to an agent.
+    
+    Only succeeds while the conversation is still waiting, so concurrent
+    workers cannot assign the same conversation twice.
+    """
+    try:
+        now = datetime.now(timezone.utc)
+        conversation = await db.conversations.find_one_and_update(
+            {**id_query(conversation_id), "status": "waiting"},
+            {"$set": {
+                "status": "active",
+                "assignee_id": agent_id,
+                "assigned_at": now,
+                "updated_at": now
+            }},
+            projection={"_id": 0, "channel_id": 1, "team_id": 1, "created_at": 1}
+        )
+        if conversation is None:
+            return False
+        conversation_metrics.record({**conversation, "assignee_id": agent_id, "assigned_at": now}, "assigned")
+        return True
+    except Exception as e:
+        logger.error(f"Error assigning conversation: {e}")
+        raise
+
+async def close_conversation(conversation_id: str) -> Optional[dict]:
+    """Close a conversation, returning it as it was before closing"""
+    try:
+        now = datetime.now(timezone.utc)
+        conversation = await db.conversations.find_one_and_update(
+            {**id_query(conversation_id), "status": {"$ne": "closed"}},
+            {"$set": {
+                "status": "closed",
+                "closed_at": now,
+                "updated_at": now
+            }}
+        )
+        if conversation:
+            conversation_metrics.record({**conversation, "closed_at": now}, "closed")
+            return _conversation_response(conversation)
+        return None
+    except Exception as e:
+        logger.error(f"Error closing conversation: {e}")
+        raise
+
+def _message_response(message: dict) -> dict:
+    """Shape a message document for API responses"""
+    return {
+        'id': doc_id(message),
+        'conversation_id': message.get('conversation_id'),
+        'seq': message.get('seq'),
+        'sender_type': message.get('sender_type'),
+        'sender_id': message.get('sender_id'),
+        'text': message.get('text'),
+        'created_at': message.get('created_at')
+    }
+
+async def add_message(conversation_id: str, message_data: dict) -> dict:
+    """Append a message and push the conversation's idle deadline forward"""
+    try:
+        now = datetime.now(timezone.utc)
+        
+        # Single round trip: bump the sequence and reset the session timeout
+        conversation = await db.conversations.find_one_and_update(
+            {**id_query(conversation_id), "status": {"$ne": "closed"}},
+            [{"$set": {
+                "message_seq": {"$add": [{"$ifNull": ["$message_seq", 0]}, 1]},
+                "last_message_at": now,
+                "updated_at": now,
+                "expires_at": {"$add": [now, {"$multiply": [{"$ifNull": ["$session_timeout", 300]}, 1000]}]}
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
+        if not conversation:
+            raise ValueError("Atendimento não encontrado ou já encerrado")
+        
+        new_message = {
+            "id": new_id(),
+            "conversation_id": conversation_id,
+            "seq": conversation['message_seq'],
+            "sender_type": message_data['sender_type'],
+            "sender_id": message_data.get('sender_id'),
+            "text": message_data['text'],
+            "created_at": now
+        }
+        
+        # Batched with concurrent messages; returns once the batch is durable
+        await message_writes.write(stored(new_message))
+        
+        return {
+            'message': _message_response(new_message),
+            'conversation': _conversation_response(conversation)
+        }
+        
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error adding message: {e}")
+        raise
+
+async def get_messages(conversation_id: str, after_seq: int = 0, limit: int = 50) -> List[dict]:
+    """Get messages of a conversation after a sequence number.
+    
+    Stops before a sequence that may still be in a write batch (see
+    write_buffer.contiguous); the client's next poll picks up from there.
+    """
+    try:
+        cursor = db.messages.find({
+            "conversation_id": conversation_id,
+            "seq": {"$gt": after_seq}
+        }).sort("seq", 1).limit(limit)
+        
+        messages = [message async for message in cursor]
+        return [
+            _message_response(message)
+            for message in contiguous(messages, after_seq, datetime.now(timezone.utc))
+        ]
+        
+    except Exception as e:
+        logger.error(f"Error getting messages: {e}")
+        raise
+
+async def get_expiring_conversations() -> List[dict]:
+    """Get open conversations with their idle deadline (reaper startup)"""
+    try:
+        cursor = db.conversations.find(
+            {"expires_at": {"$ne": None}, "status": {"$in": ["waiting", "active"]}},
+            id_projection({"_id": 0, "id": 1, "expires_at": 1})
+        ).sort("expires_at", 1)
+        
+        return [public(conversation) async for conversation in cursor]
+        
+    except Exception as e:
+        logger.error(f"Error getting expiring conversations: {e}")
+        raise
+
+async def _post_finish_messages(conversations: List[dict], now: datetime):
+    """Post the finish message of conversations closed by the reaper.
+    
+    Each message is upserted at the seq the close reserved, so running this
+    again for the same conversations posts nothing twice; `reaper_token` is
+    cleared afterwards and marks the conversations still pending.
+    """
+    team_ids = list({c.get('team_id') for c in conversations if c.get('team_id')})
+    finish_messages = {}
+    async for team in db.teams.find(id_query({"$in": team_ids}), id_projection({"_id": 0, "id": 1, "finish_message": 1})):
+        finish_messages[doc_id(team)] = team.get('finish_message')
+    
+    await db.messages.bulk_write([
+        UpdateOne(
+            {"conversation_id": conversation['id'], "seq": conversation['message_seq']},
+            {"$setOnInsert": stored({
+                "id": new_id(),
+                "sender_type": "system",
+                "sender_id": None,
+                "text": finish_messages.get(conversation.get('team_id')) or 'Atendimento encerrado. Obrigado pelo contato!',
+                "created_at": now
+            })},
+            upsert=True
+        )
+        for conversation in conversations
+    ], ordered=False)
+    
+    await db.conversations.update_many(
+        {
+            **id_query({"$in": [c['id'] for c in conversations]}),
+            "reaper_token": {"$in": list({c['reaper_token'] for c in conversations})}
+        },
+        {"$unset": {"reaper_token": ""}}
+    )
+
+def _previous_status(conversations: List[dict]) -> List[dict]:
+    """Report the status each conversation had before the reaper closed it"""
+    previous = []
+    for conversation in conversations:
+        response = _conversation_response(conversation)
+        response['status'] = 'active' if conversation.get('assignee_id') else 'waiting'
+        previous.append(response)
+    return previous
+
+async def expire_conversations(conversation_ids: List[str]) -> List[dict]:
+    """Close idle conversations in one batch and post their finish message.
+    
+    Conversations are claimed with a per-batch token and only those whose
+    deadline really passed are closed, so a timer that fires twice (restart,
+    another worker, a message that just reset the deadline) closes nothing.
+    If posting the finish messages fails, the token stays on the closed
+    conversations and finish_expired_conversations posts them later.
+    """
+    try:
+        now = datetime.now(timezone.utc)
+        token = str(uuid.uuid4())
+        
+        await db.conversations.update_many(
+            {
+                **id_query({"$in": conversation_ids}),
+                "status": {"$in": ["waiting", "active"]},
+                "expires_at": {"$lte": now}
+            },
+            {
+                "$set": {
+                    "status": "closed",
+                    "closed_at": now,
+                    "close_reason": "timeout",
+                    "reaper_token": token,
+                    "updated_at": now
+                },
+                "$inc": {"message_seq": 1}
+            }
+        )
+        
+        closed = []
+        cursor = db.conversations.find({**id_query({"$in": conversation_ids}), "reaper_token": token})
+        async for conversation in cursor:
+            closed.append(public(conversation))
+            conversation_metrics.record(conversation, "closed")
+        
+        if not closed:
+            return []
+        
+        await _post_finish_messages(closed, now)
+        return _previous_status(closed)
+        
+    except Exception as e:
+        logger.error(f"Error expiring conversations: {e}")
+        raise
+
+async def finish_expired_conversations(before: datetime) -> List[dict]:
+    """Post the finish messages a reaper batch closed but never posted.
+    
+    Picks up conversations closed before `before` that still carry their
+    `reaper_token` (the worker crashed or the insert failed after the
+    close), so batches in flight on other workers are left alone.
+    """
+    try:
+        pending = []
+        cursor = db.conversations.find({"reaper_token": {"$exists": True}, "closed_at": {"$lte": before}})
+        async for conversation in cursor:
+            pending.append(public(conversation))
+        
+        if not pending:
+            return []
+        
+        await _post_finish_messages(pending, datetime.now(timezone.utc))
+        return _previous_status(pending)
+        
+    except Exception as e:
+        logger.error(f"Error finishing expired conversations: {e}")
+        raise
+
+async def get_routing_snapshot() -> dict:
+    """Load agents, their open conversation counts and waiting conversations"""
+    try:
+        agents = []
+        cursor = db.users.find(
+            {"role": "agent", "is_active": True},
+            id_projection({"_id": 0, "id": 1, "team_id": 1, "max_conversations": 1})
+        )
+        async for agent in cursor:
+            agents.append(public(agent))
+        
+        loads = {}
+        pipeline = [
+            {"$match": {"status": "active"}},
+            {"$group": {"_id": "$assignee_id", "count": {"$sum": 1}}}
+        ]
+        async for row in db.conversations.aggregate(pipeline):
+            loads[row['_id']] = row['count']
+        
+        waiting = []
+        cursor = db.conversations.find(
+            {"status": "waiting"},
+            id_projection({"_id": 0, "id": 1, "team_id": 1, "priority": 1})
+        ).sort("created_at", 1)
+        async for conversation in cursor:
+            waiting.append(public(conversation))
+        
+        return {
+            'agents': agents,
+            'loads': loads,
+            'waiting': waiting
+        }
+        
+    except Exception as e:
+        logger.error(f"Error loading routing snapshot: {e}")
+        raise
+
+
+# Metrics operations
+async def save_metric_rollups(increments: dict) -> None:
+    """Apply coalesced rollup increments in a single bulk write"""
+    try:
+        await db.metrics_rollups.bulk_write(rollup_updates(increments), ordered=False)
+    except Exception as e:
+        logger.error(f"Error saving metric rollups: {e}")
+        raise
+
+async def get_metric_rollups(granularity: str, dimension: str, start: datetime, end: datetime,
+                             key: Optional[str] = None) -> List[dict]:
+    """Read rollup buckets of one dimension in [start, end) as one series per key"""
+    try:
+        query = {"granularity": granularity, "dimension": dimension}
+        if key is not None:
+            query["key"] = key
+        query["bucket"] = {"$gte": start, "$lt": end}
+        cursor = db.metrics_rollups.aggregate(rollup_series_pipeline(query))
+        return [group async for group in cursor]
+    except Exception as e:
+        logger.error(f"Error getting metric rollups: {e}")
+        raise
+
+# Receipt operations
+async def get_open_message_seq(conversation_id: str) -> Optional[int]:
+    """Last message sequence of a waiting or active conversation, None if it isn't open"""
+    try:
+        conversation = await db.conversations.find_one(
+            {**id_query(conversation_id), "status": {"$in": ["waiting", "active"]}},
+            {"_id": 0, "message_seq": 1}
+        )
+        if not conversation:
+            return None
+        return conversation.get('message_seq') or 0
+    except Exception as e:
+        logger.error(f"Error getting conversation sequence: {e}")
+        raise
+
+async def save_read_watermarks(watermarks: dict) -> None:
+    """Raise read watermarks, keyed by (conversation id, participant), in one bulk write"""
+    try:
+        now = datetime.now(timezone.utc)
+        await db.conversations.bulk_write([
+            UpdateOne(id_query(conversation_id), {
+                "$max": {f"{participant}_read_seq": seq},
+                "$set": {"updated_at": now}
+            })
+            for (conversation_id, participant), seq in watermarks.items()
+        ], ordered=False)
+    except Exception as e:
+        logger.error(f"Error saving read watermarks: {e}")
+        raise
+
+# Inbox operations
+def _inbox_item(conversation: dict) -> dict:
+    """Shape a conversation for an agent's inbox"""
+    return {
+        'id': doc_id(conversation),
+        'status': conversation.get('status'),
+        'client_name': conversation.get('client_name'),
+        'priority': conversation.get('priority') or 0,
+        'team_id': conversation.get('team_id'),
+        'assignee_id': conversation.get('assignee_id'),
+        'last_message_at': conversation.get('last_message_at'),
+        'unread': max(0, (conversation.get('message_seq') or 0) - (conversation.get('agent_read_seq') or 0))
+    }
+
+async def get_inbox(section: str, agent_id: Optional[str] = None, team_id: Optional[str] = None,
+                    cursor: Optional[str] = None, limit: int = 30) -> dict:
+    """One page of an agent's active or their team's waiting conversations.
+    
+    Ordered by last activity and paginated by keyset, so every page costs
+    the same regardless of depth.
+    """
+    try:
+        revision = current_revision()
+        if section == "active":
+            query = {"assignee_id": agent_id, "status": "active"}
+        else:
+            query = {"team_id": team_id, "status": "waiting"}
+        query.update(after_cursor(cursor))
+        rows = await db.conversations.find(query, inbox_projection()).sort(INBOX_SORT).limit(limit + 1).to_list(limit + 1)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['last_message_at'], rows[-1]['_id'])
+        return {
+            'items': [_inbox_item(row) for row in rows],
+            'next_cursor': next_cursor,
+            'revision': revision
+        }
+    except ValueError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error getting inbox: {e}")
+        raise
+
+async def get_inbox_changes(since: int, agent_id: Optional[str] = None, team_id: Optional[str] = None) -> dict:
+    """Inbox conversations changed since a revision, with the section each now belongs to"""
+    try:
+        revision = current_revision()
+        changed_since = {"$gte": from_revision(since)}
+        branches = [{"team_id": team_id, "updated_at": changed_since}]
+        if agent_id:
+            branches.append({"assignee_id": agent_id, "updated_at": changed_since})
+        rows = await db.conversations.find(
+            {"$or": branches},
+            id_projection({"_id": 0, "id": 1, "status": 1, "team_id": 1, "assignee_id": 1, "last_message_at": 1,
+                           **{field: 1 for field in INBOX_FIELDS}})
+        ).sort("updated_at", 1).limit(INBOX_CHANGES_LIMIT + 1).to_list(INBOX_CHANGES_LIMIT + 1)
+        if len(rows) > INBOX_CHANGES_LIMIT:
+            return {'items': [], 'revision': revision, 'reset': True}
+        items = []
+        for row in rows:
+            item = _inbox_item(row)
+            item['section'] = inbox_section(item, agent_id, team_id)
+            items.append(item)
+        return {'items': items, 'revision': revision, 'reset': False}
+    except Exception as e:
+        logger.error(f"Error getting inbox changes: {e}")
+        raise
+
+# Export operations
+async def iter_conversation_batches(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                    team_id: Optional[str] = None, channel_id: Optional[str] = None,
+                                    batch_size: int = EXPORT_BATCH_SIZE):
+    """Yield conversations created in [start, end) in lists of batch_size"""
+    query = {}
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    if team_id:
+        query["team_id"] = team_id
+    if channel_id:
+        query["channel_id"] = channel_id
+    cursor = db.conversations.find(
+        query,
+        id_projection({"_id": 0, "id": 1, **{field: 1 for field in CONVERSATION_FIELDS}}),
+        batch_size=batch_size
+    )
+    batch = []
+    async for conversation in cursor:
+        batch.append(conversation)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def get_user_names(user_ids: List[str]) -> dict:
+    """Map user ids to display names"""
+    names = {}
+    async for user in db.users.find(id_query({"$in": user_ids}), id_projection({"_id": 0, "id": 1, "name": 1})):
+        names[doc_id(user)] = user.get('name')
+    return names
+
+# Media operations
+def _media(media: dict) -> dict:
+    return {
+        'id': doc_id(media),
+        'sha256': media['sha256'],
+        'size': media['size'],
+        'content_type': media.get('content_type'),
+        'filename': media.get('filename'),
+        'backend': media['backend'],
+        'storage_key': media['storage_key'],
+        'created_at': media.get('created_at')
+    }
+
+async def get_media_by_id(media_id: str) -> Optional[dict]:
+    """Get a stored file's record by ID"""
+    try:
+        media = await db.media.find_one(id_query(media_id))
+        return _media(media) if media else None
+    except Exception as e:
+        logger.error(f"Error getting media: {e}")
+        raise
+
+async def save_media(upload: dict, backend: str, uploaded_by: Optional[str] = None) -> tuple:
+    """Record an upload with its own name and type.
+    
+    Files are shared by content: if one with the same SHA-256 is already
+    stored, the new record points at its bytes, and the flag (False)
+    tells the caller to discard this upload's copy.
+    """
+    try:
+        existing = await db.media.find_one(
+            {"sha256": upload['sha256']},
+            {"_id": 0, "backend": 1, "storage_key": 1}
+        )
+        new_media = {
+            "id": new_id(),
+            "sha256": upload['sha256'],
+            "size": upload['size'],
+            "content_type": upload['content_type'],
+            "filename": upload['filename'],
+            "backend": existing['backend'] if existing else backend,
+            "storage_key": existing['storage_key'] if existing else upload['storage_key'],
+            "uploaded_by": uploaded_by,
+            "created_at": datetime.now(timezone.utc)
+        }
+        await db.media.insert_one(stored(new_media))
+        return _media(new_media), existing is None
+    except Exception as e:
+        logger.error(f"Error saving media: {e}")
+        raise
+
+# Presence operations
+async def get_presence() -> List[dict]:
+    """Get the last persisted presence of every agent"""
+    try:
+        cursor = db.presence.find({}, {"_id": 0})
+        return [record async for record in cursor]
+    except Exception as e:
+        logger.error(f"Error getting presence: {e}")
+        raise
+
+async def save_presence(changes: List[dict]) -> None:
+    """Persist a batch of presence changes in a single bulk write"""
+    try:
+        await db.presence.bulk_write([
+            UpdateOne(
+                {"user_id": change['user_id']},
+                {"$set": {
+                    "team_id": change['team_id'],
+                    "status": change['status'],
+                    "last_seen": change['last_seen']
+                }},
+                upsert=True
+            )
+            for change in changes
+        ], ordered=False)
+    except Exception as e:
+        logger.error(f"Error saving presence: {e}")
+        raise
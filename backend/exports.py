@@ -0,0 +1,242 @@
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from ids import doc_id
+
+# Conversations read from the cursor and converted per step; bounds memory
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 10_000))
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Column name -> type, in output order
+CONVERSATION_COLUMNS = {
+    "id": "string",
+    "channel_id": "string",
+    "team_id": "string",
+    "assignee_id": "string",
+    "client_name": "string",
+    "status": "string",
+    "priority": "int",
+    "created_at": "timestamp",
+    "assigned_at": "timestamp",
+    "closed_at": "timestamp",
+    "wait_seconds": "float",
+    "handle_seconds": "float",
+}
+AGENT_COLUMNS = {
+    "agent_id": "string",
+    "agent_name": "string",
+    "assigned": "int",
+    "handled": "int",
+    "avg_wait_seconds": "float",
+    "avg_handle_seconds": "float",
+    "max_handle_seconds": "float",
+}
+EXPORT_COLUMNS = {"conversations": CONVERSATION_COLUMNS, "agents": AGENT_COLUMNS}
+
+# Fields read from each conversation document
+CONVERSATION_FIELDS = [
+    "channel_id", "team_id", "assignee_id", "client_name", "status", "priority",
+    "created_at", "assigned_at", "closed_at"
+]
+
+_TIMESTAMPS = ["created_at", "assigned_at", "closed_at"]
+
+
+def parquet_available() -> bool:
+    """Parquet output needs the optional pyarrow package"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def conversation_frame(docs: List[dict]) -> pd.DataFrame:
+    """Columnar frame for a batch of conversations with wait and handle times"""
+    columns = {field: [doc.get(field) for doc in docs] for field in CONVERSATION_FIELDS}
+    columns["id"] = [doc_id(doc) for doc in docs]
+    for field in _TIMESTAMPS:
+        # Converting the plain list is several times faster than a Series
+        columns[field] = pd.to_datetime(columns[field], utc=True)
+    frame = pd.DataFrame(columns)
+    frame["priority"] = pd.to_numeric(frame["priority"], errors="coerce").fillna(0).astype("int64")
+    frame["wait_seconds"] = (frame["assigned_at"] - frame["created_at"]).dt.total_seconds().clip(lower=0)
+    frame["handle_seconds"] = (frame["closed_at"] - frame["assigned_at"]).dt.total_seconds().clip(lower=0)
+    return frame[list(CONVERSATION_COLUMNS)]
+
+
+_AGENT_AGGREGATES = {
+    "assigned": "sum",
+    "handled": "sum",
+    "wait_seconds": "sum",
+    "handle_seconds": "sum",
+    "max_handle_seconds": "max",
+}
+
+
+class AgentPerformance:
+    """Per-agent totals folded in one conversation batch at a time.
+
+    Only sums and maxima are kept, so partial results combine exactly and
+    memory grows with the number of agents, not conversations.
+    """
+
+    def __init__(self):
+        self._totals = None
+
+    def add(self, frame: pd.DataFrame):
+        frame = frame[frame["assignee_id"].notna()]
+        if frame.empty:
+            return
+        handled = frame["handle_seconds"].notna()
+        part = pd.DataFrame({
+            "agent_id": frame["assignee_id"],
+            "assigned": np.ones(len(frame), dtype="int64"),
+            "handled": handled.astype("int64"),
+            "wait_seconds": frame["wait_seconds"].fillna(0),
+            "handle_seconds": frame["handle_seconds"].fillna(0),
+            "max_handle_seconds": frame["handle_seconds"],
+        }).groupby("agent_id").agg(_AGENT_AGGREGATES)
+        if self._totals is not None:
+            part = pd.concat([self._totals, part]).groupby(level=0).agg(_AGENT_AGGREGATES)
+        self._totals = part
+
+    def result(self, names: Dict[str, str] = None) -> pd.DataFrame:
+        if self._totals is None:
+            return pd.DataFrame({column: [] for column in AGENT_COLUMNS})
+        totals = self._totals.reset_index()
+        totals["agent_name"] = totals["agent_id"].map(names or {})
+        totals["avg_wait_seconds"] = totals["wait_seconds"] / totals["assigned"]
+        totals["avg_handle_seconds"] = totals["handle_seconds"] / totals["handled"].replace(0, np.nan)
+        return totals.sort_values("assigned", ascending=False)[list(AGENT_COLUMNS)]
+
+
+async def conversation_frames(batches: AsyncIterator[List[dict]]) -> AsyncIterator[pd.DataFrame]:
+    loop = asyncio.get_running_loop()
+    async for docs in batches:
+        yield await loop.run_in_executor(None, conversation_frame, docs)
+
+
+async def agent_frames(batches: AsyncIterator[List[dict]],
+                       agent_names: Callable[[List[str]], Awaitable[Dict[str, str]]]) -> AsyncIterator[pd.DataFrame]:
+    """Single frame of per-agent performance over all batches"""
+    loop = asyncio.get_running_loop()
+    performance = AgentPerformance()
+    async for frame in conversation_frames(batches):
+        await loop.run_in_executor(None, performance.add, frame)
+    result = performance.result()
+    if not result.empty:
+        result = performance.result(await agent_names(result["agent_id"].tolist()))
+    yield result
+
+
+def _iso_timestamps(values: pd.Series) -> np.ndarray:
+    """ISO 8601 strings with millisecond precision, '' for missing values.
+
+    numpy formats the whole column at once; to_csv's date_format calls
+    strftime per value and dominates the export time.
+    """
+    text = np.datetime_as_string(values.to_numpy(dtype="datetime64[ms]"), unit="ms")
+    return np.where(values.isna().to_numpy(), "", np.char.add(text, "Z"))
+
+
+class CsvEncoder:
+    def __init__(self, columns: Dict[str, str]):
+        self.columns = list(columns)
+        self._timestamps = [name for name, kind in columns.items() if kind == "timestamp"]
+        self._floats = [name for name, kind in columns.items() if kind == "float"]
+        self._header = True
+
+    def encode(self, frame: pd.DataFrame) -> bytes:
+        frame = frame[self.columns].copy()
+        for column in self._timestamps:
+            frame[column] = _iso_timestamps(frame[column])
+        frame[self._floats] = frame[self._floats].round(3)
+        data = frame.to_csv(index=False, header=self._header)
+        self._header = False
+        return data.encode("utf-8")
+
+    def close(self) -> bytes:
+        if self._header:
+            return self.encode(pd.DataFrame(columns=self.columns))
+        return b""
+
+
+class _Chunks:
+    """Write-only file that hands written bytes back in pieces"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ParquetEncoder:
+    """One Parquet row group per batch, sent as soon as it is written"""
+
+    def __init__(self, columns: Dict[str, str]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {
+            "string": pa.string(),
+            "int": pa.int64(),
+            "float": pa.float64(),
+            "timestamp": pa.timestamp("ms", tz="UTC"),
+        }
+        self._pa = pa
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns.items()])
+        self._sink = _Chunks()
+        self._writer = pq.ParquetWriter(self._sink, self.schema, compression="snappy")
+
+    def encode(self, frame: pd.DataFrame) -> bytes:
+        table = self._pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False)
+        self._writer.write_table(table)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+ENCODERS = {"csv": CsvEncoder, "parquet": ParquetEncoder}
+
+
+async def write_export(frames: AsyncIterator[pd.DataFrame], columns: Dict[str, str],
+                       export_format: str) -> AsyncIterator[bytes]:
+    """Encode frames incrementally; encoding runs off the event loop"""
+    loop = asyncio.get_running_loop()
+    encoder = ENCODERS[export_format](columns)
+    async for frame in frames:
+        chunk = await loop.run_in_executor(None, encoder.encode, frame)
+        if chunk:
+            yield chunk
+    yield await loop.run_in_executor(None, encoder.close)
@@ -0,0 +1,101 @@
+import json
+import os
+import zlib
+from typing import AsyncIterator, Tuple
+
+# Largest single flow accepted in an archive (decompressed line)
+ARCHIVE_MAX_LINE = int(os.environ.get('FLOW_ARCHIVE_MAX_LINE', 16 * 1024 * 1024))
+# Decompressed bytes produced per step, bounding memory against zip bombs
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+# Compressed output is flushed to the client once it reaches this size
+ARCHIVE_FLUSH_SIZE = 64 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class ArchiveError(ValueError):
+    """Raised when an archive cannot be read"""
+
+
+async def write_archive(records: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Encode records as gzip-compressed NDJSON, one flow per line"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    pending = []
+    size = 0
+    async for record in records:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+        chunk = compressor.compress(line.encode('utf-8'))
+        if chunk:
+            pending.append(chunk)
+            size += len(chunk)
+        if size >= ARCHIVE_FLUSH_SIZE:
+            yield b''.join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+async def read_archive(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, dict]]:
+    """Decode a gzip (or plain) NDJSON upload incrementally.
+
+    Yields (line number, record). Invalid lines are yielded as
+    (line number, ArchiveError) so the caller can report them and move on;
+    a line longer than ARCHIVE_MAX_LINE aborts the read.
+    """
+    decompressor = None
+    buffer = b''
+    line_number = 0
+    started = False
+
+    def lines(data: bytes):
+        nonlocal buffer, line_number
+        buffer += data
+        while True:
+            end = buffer.find(b'\n')
+            if end == -1:
+                break
+            raw, buffer = buffer[:end], buffer[end + 1:]
+            line_number += 1
+            if raw.strip():
+                yield line_number, _decode(raw)
+        if len(buffer) > ARCHIVE_MAX_LINE:
+            raise ArchiveError(f"Linha {line_number + 1} excede o tamanho máximo")
+
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if not started:
+            started = True
+            if chunk[:2] == GZIP_MAGIC:
+                decompressor = zlib.decompressobj(31)
+        if decompressor is None:
+            for item in lines(chunk):
+                yield item
+            continue
+        data = chunk
+        while data:
+            try:
+                output = decompressor.decompress(data, ARCHIVE_CHUNK_SIZE)
+            except zlib.error as e:
+                raise ArchiveError(f"Arquivo compactado inválido: {e}")
+            data = decompressor.unconsumed_tail
+            for item in lines(output):
+                yield item
+            if decompressor.eof:
+                break
+
+    if decompressor is not None and started and not decompressor.eof:
+        raise ArchiveError("Arquivo compactado incompleto")
+    if buffer.strip():
+        line_number += 1
+        yield line_number, _decode(buffer)
+
+
+def _decode(raw: bytes):
+    try:
+        record = json.loads(raw)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        return ArchiveError(f"JSON inválido: {e}")
+    if not isinstance(record, dict):
+        return ArchiveError("Cada linha deve conter um objeto")
+    return record
@@ -0,0 +1,211 @@
+from typing import Dict, List, Optional
+
+COMPILER_VERSION = 1
+
+# Blocks that end the automated part of a conversation
+EXIT_TYPES = {"finish", "team", "goto_flow"}
+ANCHOR_TYPE = "anchor"
+GOTO_TYPE = "goto"
+START_TYPE = "flow_start"
+
+MAX_REPORTED_ISSUES = 5
+
+
+class FlowCompileError(ValueError):
+    """Raised when a flow graph fails static analysis"""
+
+    def __init__(self, issues: List[str]):
+        self.issues = issues
+        shown = "; ".join(issues[:MAX_REPORTED_ISSUES])
+        if len(issues) > MAX_REPORTED_ISSUES:
+            shown += f" (+{len(issues) - MAX_REPORTED_ISSUES} problema(s))"
+        super().__init__(f"Fluxo inválido: {shown}")
+
+
+def _node_data(node: dict) -> dict:
+    data = node.get('data')
+    return data if isinstance(data, dict) else {}
+
+
+def _anchor_name(node: dict) -> Optional[str]:
+    data = _node_data(node)
+    return data.get('name') or node.get('label')
+
+
+def _goto_target(node: dict) -> Optional[str]:
+    data = _node_data(node)
+    return data.get('anchor') or data.get('target')
+
+
+def _strongly_connected(adjacency: List[List[int]]) -> List[int]:
+    """Iterative Tarjan; returns the component index of every node"""
+    count = len(adjacency)
+    index = [-1] * count
+    lowlink = [0] * count
+    on_stack = [False] * count
+    component = [-1] * count
+    stack: List[int] = []
+    counter = 0
+    components = 0
+
+    for root in range(count):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, child = work[-1]
+            if child == 0:
+                index[node] = lowlink[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            if child < len(adjacency[node]):
+                work[-1] = (node, child + 1)
+                target = adjacency[node][child]
+                if index[target] == -1:
+                    work.append((target, 0))
+                elif on_stack[target]:
+                    lowlink[node] = min(lowlink[node], index[target])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = components
+                    if member == node:
+                        break
+                components += 1
+    return component
+
+
+def compile_flow(nodes: Optional[List[dict]], edges: Optional[List[dict]]) -> dict:
+    """Validate a flow graph and build its normalized, index-based form.
+
+    Runs in O(nodes + edges). When no edges are given the blocks are chained
+    in list order, which is how the editor renders them.
+    """
+    nodes = nodes or []
+    edges = edges or []
+    issues: List[str] = []
+
+    positions: Dict[str, int] = {}
+    for position, node in enumerate(nodes):
+        node_id = node.get('id')
+        if not node_id:
+            issues.append(f"bloco na posição {position + 1} sem id")
+            continue
+        if node_id in positions:
+            issues.append(f"id de bloco duplicado '{node_id}'")
+            continue
+        positions[node_id] = position
+
+    if issues:
+        raise FlowCompileError(issues)
+
+    anchors: Dict[str, int] = {}
+    for position, node in enumerate(nodes):
+        if node.get('type') != ANCHOR_TYPE:
+            continue
+        name = _anchor_name(node)
+        if not name:
+            issues.append(f"âncora '{node['id']}' sem nome")
+        elif name in anchors:
+            issues.append(f"âncora duplicada '{name}'")
+        else:
+            anchors[name] = position
+
+    adjacency: List[List[int]] = [[] for _ in nodes]
+    if edges:
+        for edge in edges:
+            source = positions.get(edge.get('source'))
+            target = positions.get(edge.get('target'))
+            if source is None or target is None:
+                issues.append(
+                    f"conexão '{edge.get('id', '?')}' aponta para bloco inexistente "
+                    f"({edge.get('source')} → {edge.get('target')})"
+                )
+                continue
+            adjacency[source].append(target)
+    else:
+        for position in range(len(nodes) - 1):
+            if nodes[position].get('type') not in EXIT_TYPES:
+                adjacency[position].append(position + 1)
+
+    # "Ir Para" blocks jump to an anchor by name
+    for position, node in enumerate(nodes):
+        if node.get('type') != GOTO_TYPE:
+            continue
+        target_name = _goto_target(node)
+        if target_name not in anchors:
+            issues.append(f"bloco '{node['id']}' aponta para âncora inexistente '{target_name}'")
+            continue
+        adjacency[position] = [anchors[target_name]]
+
+    if issues:
+        raise FlowCompileError(issues)
+
+    if not nodes:
+        return {
+            'version': COMPILER_VERSION,
+            'entry': None,
+            'nodes': [],
+            'anchors': []
+        }
+
+    entry = next((i for i, node in enumerate(nodes) if node.get('type') == START_TYPE), 0)
+
+    # Reachability from the entry block
+    reachable = [False] * len(nodes)
+    reachable[entry] = True
+    pending = [entry]
+    while pending:
+        node = pending.pop()
+        for target in adjacency[node]:
+            if not reachable[target]:
+                reachable[target] = True
+                pending.append(target)
+    for position, node in enumerate(nodes):
+        if not reachable[position]:
+            issues.append(f"bloco '{node['id']}' inalcançável")
+
+    # A cycle is a trap when no block in it exits and no edge leaves it
+    component = _strongly_connected(adjacency)
+    size: Dict[int, int] = {}
+    escapes = set()
+    for position, targets in enumerate(adjacency):
+        size[component[position]] = size.get(component[position], 0) + 1
+        if nodes[position].get('type') in EXIT_TYPES:
+            escapes.add(component[position])
+        for target in targets:
+            if component[target] != component[position]:
+                escapes.add(component[position])
+    reported = set()
+    for position, targets in enumerate(adjacency):
+        group = component[position]
+        cyclic = size[group] > 1 or position in targets
+        if cyclic and group not in escapes and group not in reported and reachable[position]:
+            reported.add(group)
+            issues.append(f"ciclo sem saída passando pelo bloco '{nodes[position]['id']}'")
+
+    if issues:
+        raise FlowCompileError(issues)
+
+    return {
+        'version': COMPILER_VERSION,
+        'entry': entry,
+        'nodes': [
+            {
+                'id': node['id'],
+                'type': node.get('type'),
+                'label': node.get('label'),
+                'data': _node_data(node),
+                'next': adjacency[position]
+            }
+            for position, node in enumerate(nodes)
+        ],
+        'anchors': [{'name': name, 'node': position} for name, position in anchors.items()]
+    }
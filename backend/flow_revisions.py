@@ -0,0 +1,61 @@
+import hashlib
+import json
+from typing import Dict, List, Tuple
+
+
+def content_hash(element: dict) -> str:
+    """SHA-256 of the canonical JSON of a node or edge"""
+    canonical = json.dumps(element, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _element_key(element: dict, position: int) -> str:
+    if element.get('id'):
+        return str(element['id'])
+    if 'source' in element or 'target' in element:
+        return f"{element.get('source')}->{element.get('target')}"
+    return f"#{position}"
+
+
+def build_manifest(elements: List[dict]) -> Tuple[List[dict], Dict[str, dict]]:
+    """Turn nodes or edges into an ordered list of {id, h} references.
+
+    Returns the references and the blobs they point to, keyed by hash.
+    """
+    references = []
+    blobs: Dict[str, dict] = {}
+    for position, element in enumerate(elements):
+        digest = content_hash(element)
+        references.append({'id': _element_key(element, position), 'h': digest})
+        blobs[digest] = element
+    return references, blobs
+
+
+def root_hash(node_refs: List[dict], edge_refs: List[dict]) -> str:
+    """Single hash identifying a whole graph, order included"""
+    digest = hashlib.sha256()
+    for reference in node_refs:
+        digest.update(reference['h'].encode('ascii'))
+    digest.update(b'|')
+    for reference in edge_refs:
+        digest.update(reference['h'].encode('ascii'))
+    return digest.hexdigest()
+
+
+def diff_manifests(old: List[dict], new: List[dict]) -> Dict[str, list]:
+    """Compare two reference lists by id.
+
+    Added and removed entries are (id, hash) pairs, modified entries are
+    (id, old_hash, new_hash). Only hashes are compared, so no blob has to
+    be read for unchanged elements.
+    """
+    old_map = {reference['id']: reference['h'] for reference in old}
+    new_map = {reference['id']: reference['h'] for reference in new}
+    return {
+        'added': [(key, digest) for key, digest in new_map.items() if key not in old_map],
+        'removed': [(key, digest) for key, digest in old_map.items() if key not in new_map],
+        'modified': [
+            (key, old_map[key], digest) for key, digest in new_map.items()
+            if key in old_map and old_map[key] != digest
+        ]
+    }
@@ -0,0 +1,121 @@
+import os
+import uuid
+from typing import Iterable, List, Optional
+
+from bson.binary import Binary
+
+# Where documents keep their UUID:
+#   string    - 36-char string in `id`, next to Mongo's ObjectId `_id`
+#   binary    - the UUID is `_id` itself, stored as BSON binary subtype 4
+#   migrating - new documents are written as binary while lookups match
+#               both forms; run migrate_ids.py, then switch to binary
+ID_STORAGE = os.environ.get('ID_STORAGE', 'string').strip().lower()
+ID_STORAGE_MODES = ("string", "binary", "migrating")
+if ID_STORAGE not in ID_STORAGE_MODES:
+    raise ValueError(f"ID_STORAGE must be one of {', '.join(ID_STORAGE_MODES)}, got '{ID_STORAGE}'")
+
+# Collections whose documents are identified by a UUID
+ID_COLLECTIONS = ("users", "teams", "channels", "flows", "flow_revisions", "conversations", "messages",
+                  "canned_replies", "media")
+
+# Matches no document; used for ids that can't be valid UUIDs
+_NOTHING = {"_id": {"$in": []}}
+
+
+def new_id() -> str:
+    return str(uuid.uuid4())
+
+
+def string_ids() -> bool:
+    """Whether documents may still carry a string `id` (and need its index)"""
+    return ID_STORAGE != "binary"
+
+
+def binary_ids() -> bool:
+    """Whether documents may be keyed by a binary `_id`"""
+    return ID_STORAGE != "string"
+
+
+def to_binary(value: str) -> Optional[Binary]:
+    """UUID string as BSON binary subtype 4, or None if it isn't a UUID"""
+    try:
+        return Binary.from_uuid(uuid.UUID(value))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def _to_binaries(values: Iterable[str]) -> List[Binary]:
+    return [binary for binary in map(to_binary, values) if binary is not None]
+
+
+def _binary_query(value) -> dict:
+    if isinstance(value, dict):
+        if "$in" in value:
+            return {"_id": {"$in": _to_binaries(value["$in"])}}
+        if "$ne" in value:
+            binary = to_binary(value["$ne"])
+            return {"_id": {"$ne": binary}} if binary is not None else {}
+        raise ValueError(f"Unsupported id operator: {list(value)}")
+    binary = to_binary(value)
+    return {"_id": binary} if binary is not None else dict(_NOTHING)
+
+
+def id_query(value) -> dict:
+    """Filter matching documents by public id.
+
+    `value` is an id or one of {"$in": [...]}, {"$ne": ...}. Merge the
+    result into the rest of the filter; in migrating mode it may contain
+    an `$or`, so it can't be combined with another `$or`.
+    """
+    if ID_STORAGE == "string":
+        return {"id": value}
+    if ID_STORAGE == "binary":
+        return _binary_query(value)
+    binary = _binary_query(value)
+    if isinstance(value, dict) and "$ne" in value:
+        return {**binary, "id": value}
+    return {"$or": [binary, {"id": value}]}
+
+
+def id_projection(projection: dict) -> dict:
+    """Projection with `id` mapped to wherever the id is stored"""
+    if "id" not in projection or ID_STORAGE == "string":
+        return projection
+    projection = {**projection, "_id": 1}
+    if ID_STORAGE == "binary":
+        del projection["id"]
+    return projection
+
+
+def binary_document(doc: dict) -> dict:
+    """Copy of a document keyed by its UUID as binary `_id`"""
+    stored = {key: value for key, value in doc.items() if key not in ("_id", "id")}
+    return {"_id": Binary.from_uuid(uuid.UUID(doc["id"])), **stored}
+
+
+def stored(doc: dict) -> dict:
+    """Document as written to the database; `doc` keeps its string `id`"""
+    if ID_STORAGE == "string":
+        return doc
+    return binary_document(doc)
+
+
+def doc_id(doc: dict) -> Optional[str]:
+    """Public id of a stored document"""
+    if doc.get("id") is not None:
+        return doc["id"]
+    value = doc.get("_id")
+    if isinstance(value, Binary) and value.subtype == 4:
+        return str(value.as_uuid())
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return None
+
+
+def public(doc: Optional[dict]) -> Optional[dict]:
+    """Stored document with `_id` replaced by its public `id`, in place"""
+    if doc is None:
+        return None
+    doc["id"] = doc_id(doc)
+    doc.pop("_id", None)
+    return doc
@@ -0,0 +1,76 @@
+import base64
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+import bson
+from bson.errors import BSONError
+
+from ids import string_ids
+
+# Fields an inbox row needs besides the index prefix; kept in the inbox
+# indexes so list pages are served from the index alone
+INBOX_FIELDS = ("client_name", "priority", "message_seq", "agent_read_seq")
+INBOX_SORT = [("last_message_at", -1), ("_id", -1)]
+
+# Changes are re-sent for this long after a revision, covering clock
+# differences between workers and writes still in flight
+INBOX_REVISION_OVERLAP = timedelta(seconds=float(os.environ.get('INBOX_REVISION_OVERLAP', 5)))
+# A client further behind than this reloads its lists instead
+INBOX_CHANGES_LIMIT = int(os.environ.get('INBOX_CHANGES_LIMIT', 500))
+
+
+def inbox_projection() -> dict:
+    """Only indexed fields, so list pages are covered queries"""
+    projection = {"_id": 1, "status": 1, "team_id": 1, "assignee_id": 1, "last_message_at": 1}
+    projection.update({field: 1 for field in INBOX_FIELDS})
+    if string_ids():
+        projection["id"] = 1
+    return projection
+
+
+def to_revision(value: datetime) -> int:
+    return int(value.timestamp() * 1000)
+
+
+def from_revision(revision: int) -> datetime:
+    return datetime.fromtimestamp(revision / 1000, timezone.utc)
+
+
+def current_revision() -> int:
+    """Revision a client can sync from after reading the inbox now"""
+    return to_revision(datetime.now(timezone.utc) - INBOX_REVISION_OVERLAP)
+
+
+def encode_cursor(last_message_at: datetime, object_id) -> str:
+    """Opaque keyset position of the last row of a page"""
+    raw = bson.encode({"t": last_message_at, "i": object_id})
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, object]:
+    try:
+        position = bson.decode(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return position["t"], position["i"]
+    except (ValueError, KeyError, BSONError):
+        raise ValueError("Cursor inválido")
+
+
+def after_cursor(cursor: Optional[str]) -> dict:
+    """Filter for rows after a cursor in INBOX_SORT order"""
+    if not cursor:
+        return {}
+    last_message_at, object_id = decode_cursor(cursor)
+    return {"$or": [
+        {"last_message_at": {"$lt": last_message_at}},
+        {"last_message_at": last_message_at, "_id": {"$lt": object_id}}
+    ]}
+
+
+def inbox_section(conversation: dict, agent_id: Optional[str], team_id: Optional[str]) -> str:
+    """Where a changed conversation now belongs in an agent's inbox"""
+    if conversation.get('status') == "active" and agent_id and conversation.get('assignee_id') == agent_id:
+        return "active"
+    if conversation.get('status') == "waiting" and conversation.get('team_id') == team_id:
+        return "waiting"
+    return "removed"
@@ -0,0 +1,423 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import IndexModel
+from pymongo.errors import DuplicateKeyError
+
+from ids import binary_ids, id_query, string_ids
+from inbox import INBOX_FIELDS, inbox_projection
+from metrics import rollup_series_pipeline
+
+logger = logging.getLogger(__name__)
+
+# A lock holder that stops renewing (crashed worker) loses the lock after this
+INDEX_LOCK_TTL = int(os.environ.get('INDEX_LOCK_TTL', 60))
+INDEX_WAIT_INTERVAL = 2
+STATE_ID = "indexes"
+
+# Declarative index manifest: collection -> indexes. Names follow MongoDB's
+# defaults so indexes created before the manifest are recognized as-is.
+# Every query shape in database.py must be served by one of these; see
+# QUERY_SHAPES below and indexes_test.py at the repository root.
+# Documents keyed by a binary UUID _id need no extra index for it; see ids.py
+
+
+def id_indexes(with_string_ids: bool) -> List[dict]:
+    """Unique index on string ids. Sparse, because while migrating, new
+    documents are written with a binary _id and no `id` at all; a plain
+    unique index would treat them all as id null and reject the second."""
+    return [{"keys": [("id", 1)], "unique": True, "sparse": True}] if with_string_ids else []
+
+
+_ID_INDEX = id_indexes(string_ids())
+
+
+def _inbox_index(owner: str, other: str) -> dict:
+    """Keyset order after the owner's equality fields, then every field an
+    inbox row returns, so list pages never touch the documents"""
+    keys = [(owner, 1), ("status", 1), ("last_message_at", -1), ("_id", -1), (other, 1)]
+    keys += [(field, 1) for field in INBOX_FIELDS]
+    if string_ids():
+        keys.append(("id", 1))
+    return {"keys": keys}
+
+
+INDEX_MANIFEST: Dict[str, List[dict]] = {
+    "users": [
+        {"keys": [("username", 1)], "unique": True},
+        {"keys": [("email", 1)], "unique": True},
+        *_ID_INDEX,
+        {"keys": [("role", 1), ("created_at", -1)]},
+        {"keys": [("role", 1), ("team_id", 1)]},
+        {"keys": [("updated_at", 1)]},
+    ],
+    "channels": [
+        *_ID_INDEX,
+        {"keys": [("flow_id", 1)]},
+        {"keys": [("created_at", -1)]},
+    ],
+    "flows": [
+        *_ID_INDEX,
+        {"keys": [("created_at", -1)]},
+    ],
+    "teams": [
+        *_ID_INDEX,
+        {"keys": [("name", 1)]},
+        {"keys": [("created_at", -1)]},
+    ],
+    "canned_replies": [
+        *_ID_INDEX,
+        # One shortcut per scope; team_id is null for global replies
+        {"keys": [("team_id", 1), ("shortcut", 1)], "unique": True},
+        {"keys": [("created_at", -1)]},
+        {"keys": [("team_id", 1), ("created_at", -1)]},
+    ],
+    "conversations": [
+        *_ID_INDEX,
+        {"keys": [("status", 1), ("created_at", 1)]},
+        {"keys": [("status", 1), ("assignee_id", 1)]},
+        {"keys": [("expires_at", 1)], "sparse": True},
+        # Reaper closes whose finish message is still pending
+        {"keys": [("reaper_token", 1), ("closed_at", 1)], "sparse": True},
+        # Metrics backfill and exports read conversations by timestamp
+        {"keys": [("created_at", 1)]},
+        {"keys": [("assigned_at", 1)]},
+        {"keys": [("closed_at", 1)]},
+        # Agent inbox: active per agent, waiting per team, and their changes
+        _inbox_index("assignee_id", "team_id"),
+        _inbox_index("team_id", "assignee_id"),
+        {"keys": [("assignee_id", 1), ("updated_at", 1)]},
+        {"keys": [("team_id", 1), ("updated_at", 1)]},
+    ],
+    "messages": [
+        {"keys": [("conversation_id", 1), ("seq", 1)]},
+    ],
+    "media": [
+        *_ID_INDEX,
+        # One record per upload; uploads with the same content share the stored file
+        {"keys": [("sha256", 1)]},
+    ],
+    "presence": [
+        {"keys": [("user_id", 1)], "unique": True},
+    ],
+    "flow_revisions": [
+        {"keys": [("flow_id", 1), ("number", -1)], "unique": True},
+        # Blob references, so deleting a flow can tell which blobs are still used
+        {"keys": [("nodes.h", 1)]},
+        {"keys": [("edges.h", 1)]},
+    ],
+    "metrics_rollups": [
+        {"keys": [("granularity", 1), ("dimension", 1), ("key", 1), ("bucket", 1)], "unique": True},
+        {"keys": [("bucket", 1)]},
+        # Minute and hour buckets expire; day buckets have no expires_at
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "login_attempts": [
+        {"keys": [("key", 1)], "unique": True},
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+}
+
+# Query shapes issued by database.py, checked with explain() by
+# indexes_test.py. Values are placeholders; only the shape matters.
+_ID = "00000000-0000-4000-8000-000000000000"
+# Deliberate full reads are not listed: get_presence, the full rebuild in
+# get_login_identities, count_users (estimated count), the unfiltered
+# totals of the paginated listings and the dashboard's $facet counts.
+QUERY_SHAPES: List[dict] = [
+    # users
+    {"name": "get_user_by_login", "collection": "users", "op": "find",
+     "filter": {"$or": [{"email": "x"}, {"username": "x"}]}},
+    {"name": "get_user_profile", "collection": "users", "op": "find", "filter": id_query(_ID)},
+    {"name": "update_password_hash", "collection": "users", "op": "update",
+     "filter": {**id_query(_ID), "password_hash": "x"}},
+    {"name": "get_login_identities (incremental)", "collection": "users", "op": "find",
+     "filter": {"updated_at": {"$gte": "x"}}},
+    {"name": "get_agents", "collection": "users", "op": "find", "filter": {"role": "agent"},
+     "sort": {"created_at": -1}},
+    {"name": "get_agents (count)", "collection": "users", "op": "count", "filter": {"role": "agent"}},
+    {"name": "get_agents (search)", "collection": "users", "op": "find",
+     "filter": {"role": "agent", "$or": [{"name": {"$regex": "x", "$options": "i"}},
+                                         {"username": {"$regex": "x", "$options": "i"}},
+                                         {"email": {"$regex": "x", "$options": "i"}}]},
+     "sort": {"created_at": -1}},
+    {"name": "create_agent (existing)", "collection": "users", "op": "find",
+     "filter": {"$or": [{"username": "x"}, {"email": "x"}]}},
+    {"name": "update_agent", "collection": "users", "op": "find", "filter": {**id_query(_ID), "role": "agent"}},
+    {"name": "update_agent (username taken)", "collection": "users", "op": "find",
+     "filter": {"username": "x", **id_query({"$ne": _ID})}},
+    {"name": "update_agent (email taken)", "collection": "users", "op": "find",
+     "filter": {"email": "x", **id_query({"$ne": _ID})}},
+    {"name": "delete_agents_bulk", "collection": "users", "op": "delete",
+     "filter": {**id_query({"$in": [_ID]}), "role": "agent"}},
+    {"name": "get_admins", "collection": "users", "op": "find", "filter": {"role": "admin"},
+     "sort": {"created_at": -1}},
+    {"name": "get_teams (agent count)", "collection": "users", "op": "count",
+     "filter": {"role": "agent", "team_id": "x"}},
+    {"name": "get_routing_snapshot (agents)", "collection": "users", "op": "find",
+     "filter": {"role": "agent", "is_active": True}},
+    # channels
+    {"name": "get_channels", "collection": "channels", "op": "find", "filter": {},
+     "sort": {"created_at": -1}},
+    {"name": "get_channels (search)", "collection": "channels", "op": "find",
+     "filter": {"$or": [{"name": {"$regex": "x", "$options": "i"}}, {"type": {"$regex": "x", "$options": "i"}}]},
+     "sort": {"created_at": -1}},
+    {"name": "get_channel_by_id", "collection": "channels", "op": "find", "filter": id_query(_ID)},
+    # With binary ids get_channel_flow runs get_channel_by_id + get_flow_by_id shapes
+    *([] if binary_ids() else [
+        {"name": "get_channel_flow", "collection": "channels", "op": "aggregate",
+         "pipeline": [{"$match": id_query(_ID)},
+                      {"$lookup": {"from": "flows", "localField": "flow_id", "foreignField": "id", "as": "flow"}}]},
+    ]),
+    {"name": "delete_flow (in use)", "collection": "channels", "op": "find", "filter": {"flow_id": "x"}},
+    {"name": "update_flow (rename)", "collection": "channels", "op": "update", "filter": {"flow_id": "x"},
+     "multi": True},
+    {"name": "delete_channels_bulk", "collection": "channels", "op": "delete", "filter": id_query({"$in": [_ID]})},
+    # flows
+    {"name": "get_flows", "collection": "flows", "op": "find", "filter": {}, "sort": {"created_at": -1}},
+    {"name": "get_flows (search)", "collection": "flows", "op": "find",
+     "filter": {"name": {"$regex": "x", "$options": "i"}}, "sort": {"created_at": -1}},
+    {"name": "get_flow_by_id", "collection": "flows", "op": "find", "filter": id_query(_ID)},
+    {"name": "patch_flow", "collection": "flows", "op": "update", "filter": {**id_query(_ID), "revision": 1}},
+    {"name": "iter_flow_exports", "collection": "flows", "op": "find", "filter": id_query({"$in": [_ID]})},
+    # flow revisions
+    {"name": "get_flow_revisions", "collection": "flow_revisions", "op": "aggregate",
+     "pipeline": [{"$match": {"flow_id": "x"}}, {"$sort": {"number": -1}}, {"$limit": 10}]},
+    {"name": "_record_flow_revision (previous)", "collection": "flow_revisions", "op": "find",
+     "filter": {"flow_id": "x"}, "sort": {"number": -1}},
+    {"name": "restore_flow_revision", "collection": "flow_revisions", "op": "find",
+     "filter": {"flow_id": "x", "number": 1}},
+    {"name": "diff_flow_revisions", "collection": "flow_revisions", "op": "find",
+     "filter": {"flow_id": "x", "number": {"$in": [1, 2]}}},
+    {"name": "_revision_blob_hashes", "collection": "flow_revisions", "op": "aggregate",
+     "pipeline": [{"$match": {"flow_id": {"$in": ["x"]}}}]},
+    {"name": "_collect_flow_blobs (nodes)", "collection": "flow_revisions", "op": "aggregate",
+     "pipeline": [{"$match": {"nodes.h": {"$in": ["x"]}}}]},
+    {"name": "_collect_flow_blobs (edges)", "collection": "flow_revisions", "op": "aggregate",
+     "pipeline": [{"$match": {"edges.h": {"$in": ["x"]}}}]},
+    # teams
+    {"name": "get_teams", "collection": "teams", "op": "find", "filter": {}, "sort": {"created_at": -1}},
+    {"name": "get_team_by_id", "collection": "teams", "op": "find", "filter": id_query(_ID)},
+    {"name": "create_team (name taken)", "collection": "teams", "op": "find", "filter": {"name": "x"}},
+    {"name": "update_team (name taken)", "collection": "teams", "op": "find",
+     "filter": {"name": "x", **id_query({"$ne": _ID})}},
+    {"name": "_post_finish_messages (teams)", "collection": "teams", "op": "find",
+     "filter": id_query({"$in": [_ID]})},
+    # canned replies
+    {"name": "get_canned_replies", "collection": "canned_replies", "op": "find", "filter": {},
+     "sort": {"created_at": -1}},
+    {"name": "get_canned_replies (team)", "collection": "canned_replies", "op": "find",
+     "filter": {"team_id": "x"}, "sort": {"created_at": -1}},
+    {"name": "get_canned_reply_by_id", "collection": "canned_replies", "op": "find", "filter": id_query(_ID)},
+    {"name": "get_scope_canned_replies", "collection": "canned_replies", "op": "find", "filter": {"team_id": "x"}},
+    {"name": "create_canned_reply (shortcut taken)", "collection": "canned_replies", "op": "find",
+     "filter": {"team_id": None, "shortcut": "x"}},
+    {"name": "update_canned_reply (shortcut taken)", "collection": "canned_replies", "op": "find",
+     "filter": {"team_id": "x", "shortcut": "x", **id_query({"$ne": _ID})}},
+    {"name": "delete_canned_replies_bulk", "collection": "canned_replies", "op": "delete",
+     "filter": id_query({"$in": [_ID]})},
+    {"name": "delete_team (canned replies)", "collection": "canned_replies", "op": "delete",
+     "filter": {"team_id": "x"}},
+    # conversations and messages
+    {"name": "get_conversation_by_id", "collection": "conversations", "op": "find", "filter": id_query(_ID)},
+    {"name": "assign_conversation", "collection": "conversations", "op": "update",
+     "filter": {**id_query(_ID), "status": "waiting"}},
+    {"name": "get_open_message_seq", "collection": "conversations", "op": "find",
+     "filter": {**id_query(_ID), "status": {"$in": ["waiting", "active"]}}},
+    {"name": "save_read_watermarks", "collection": "conversations", "op": "update", "filter": id_query(_ID)},
+    {"name": "get_inbox (active)", "collection": "conversations", "op": "find",
+     "filter": {"assignee_id": "x", "status": "active"}, "sort": {"last_message_at": -1, "_id": -1},
+     "projection": inbox_projection(), "covered": True},
+    {"name": "get_inbox (waiting, next page)", "collection": "conversations", "op": "find",
+     "filter": {"team_id": "x", "status": "waiting", "$or": [
+         {"last_message_at": {"$lt": 0}}, {"last_message_at": 0, "_id": {"$lt": 0}}]},
+     "sort": {"last_message_at": -1, "_id": -1}, "projection": inbox_projection(), "covered": True},
+    {"name": "get_inbox_changes", "collection": "conversations", "op": "find",
+     "filter": {"$or": [{"team_id": "x", "updated_at": {"$gte": 0}}, {"assignee_id": "x", "updated_at": {"$gte": 0}}]},
+     "sort": {"updated_at": 1}},
+    {"name": "get_expiring_conversations", "collection": "conversations", "op": "find",
+     "filter": {"expires_at": {"$ne": None}, "status": {"$in": ["waiting", "active"]}},
+     "sort": {"expires_at": 1}},
+    {"name": "finish_expired_conversations", "collection": "conversations", "op": "find",
+     "filter": {"reaper_token": {"$exists": True}, "closed_at": {"$lte": 0}}},
+    {"name": "get_routing_snapshot (loads)", "collection": "conversations", "op": "aggregate",
+     "pipeline": [{"$match": {"status": "active"}}, {"$group": {"_id": "$assignee_id", "count": {"$sum": 1}}}]},
+    {"name": "get_routing_snapshot (waiting)", "collection": "conversations", "op": "find",
+     "filter": {"status": "waiting"}, "sort": {"created_at": 1}},
+    {"name": "_post_finish_messages", "collection": "messages", "op": "update",
+     "filter": {"conversation_id": "x", "seq": 1}},
+    {"name": "get_messages", "collection": "messages", "op": "find",
+     "filter": {"conversation_id": "x", "seq": {"$gt": 0}}, "sort": {"seq": 1}},
+    # metrics
+    {"name": "save_metric_rollups", "collection": "metrics_rollups", "op": "update",
+     "filter": {"granularity": "hour", "dimension": "channel", "key": "x", "bucket": 0}},
+    {"name": "get_metric_rollups", "collection": "metrics_rollups", "op": "aggregate",
+     "pipeline": rollup_series_pipeline(
+         {"granularity": "day", "dimension": "channel", "bucket": {"$gte": 0, "$lt": 1}})},
+    {"name": "get_metric_rollups (key)", "collection": "metrics_rollups", "op": "aggregate",
+     "pipeline": rollup_series_pipeline(
+         {"granularity": "day", "dimension": "channel", "key": "x", "bucket": {"$gte": 0, "$lt": 1}})},
+    {"name": "backfill_rollups (clear)", "collection": "metrics_rollups", "op": "delete",
+     "filter": {"bucket": {"$gte": 0, "$lt": 1}}},
+    {"name": "backfill_rollups (chunk)", "collection": "conversations", "op": "find",
+     "filter": {"$or": [{"created_at": {"$gte": 0, "$lt": 1}}, {"assigned_at": {"$gte": 0, "$lt": 1}},
+                        {"closed_at": {"$gte": 0, "$lt": 1}}]}},
+    {"name": "iter_conversation_batches", "collection": "conversations", "op": "find",
+     "filter": {"created_at": {"$gte": 0, "$lt": 1}}},
+    {"name": "iter_conversation_batches (team)", "collection": "conversations", "op": "find",
+     "filter": {"created_at": {"$gte": 0, "$lt": 1}, "team_id": "x"}},
+    {"name": "get_user_names", "collection": "users", "op": "find", "filter": id_query({"$in": ["x"]})},
+    # other collections
+    {"name": "record_login_failure", "collection": "login_attempts", "op": "find", "filter": {"key": "x"}},
+    {"name": "get_login_lockouts", "collection": "login_attempts", "op": "find",
+     "filter": {"key": {"$in": ["x"]}, "blocked_until": {"$gt": 0}}},
+    {"name": "get_media_by_id", "collection": "media", "op": "find", "filter": id_query(_ID)},
+    {"name": "save_media (existing)", "collection": "media", "op": "find", "filter": {"sha256": "x"}},
+    {"name": "save_presence", "collection": "presence", "op": "update", "filter": {"user_id": "x"}},
+]
+
+_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+def index_name(spec: dict) -> str:
+    return spec.get("name") or "_".join(f"{field}_{direction}" for field, direction in spec["keys"])
+
+
+def _normalize(spec: dict) -> dict:
+    """Comparable form of a manifest entry or a listIndexes document"""
+    keys = spec["keys"] if "keys" in spec else list(spec["key"].items())
+    normalized = {"keys": [[field, direction] for field, direction in keys]}
+    for option in _OPTIONS:
+        value = spec.get(option)
+        if value not in (None, False):
+            normalized[option] = value
+    return normalized
+
+
+def manifest_hash(manifest: Dict[str, List[dict]] = INDEX_MANIFEST) -> str:
+    canonical = {
+        collection: sorted(
+            [dict(_normalize(spec), name=index_name(spec)) for spec in specs],
+            key=lambda spec: spec["name"]
+        )
+        for collection, specs in manifest.items()
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def _apply(db, manifest: Dict[str, List[dict]], previously_managed: Dict[str, List[str]]) -> dict:
+    """Create missing indexes, rebuild changed ones and drop those removed
+    from the manifest; indexes the manifest never managed are left alone"""
+    changes = {"created": [], "rebuilt": [], "dropped": []}
+    collections = set(manifest) | set(previously_managed)
+    for collection in sorted(collections):
+        specs = {index_name(spec): spec for spec in manifest.get(collection, [])}
+        existing = {}
+        if collection in await db.list_collection_names(filter={"name": collection}):
+            async for index in db[collection].list_indexes():
+                existing[index["name"]] = index
+
+        to_create = []
+        for name, spec in specs.items():
+            current = existing.get(name)
+            if current is not None and _normalize(current) == _normalize(spec):
+                continue
+            if current is not None:
+                await db[collection].drop_index(name)
+                changes["rebuilt"].append(f"{collection}.{name}")
+            else:
+                changes["created"].append(f"{collection}.{name}")
+            options = {option: spec[option] for option in _OPTIONS if option in spec}
+            to_create.append(IndexModel(spec["keys"], name=name, **options))
+        if to_create:
+            await db[collection].create_indexes(to_create)
+
+        for name in previously_managed.get(collection, []):
+            if name not in specs and name in existing:
+                await db[collection].drop_index(name)
+                changes["dropped"].append(f"{collection}.{name}")
+    return changes
+
+
+async def _acquire(db, owner: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await db.schema_state.find_one_and_update(
+            {
+                "_id": STATE_ID,
+                "$or": [{"locked_until": {"$lt": now}}, {"locked_until": None}]
+            },
+            {"$set": {"locked_by": owner, "locked_until": now + timedelta(seconds=INDEX_LOCK_TTL)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The state document exists and another worker holds the lock
+        return False
+
+
+async def _renew(db, owner: str):
+    while True:
+        await asyncio.sleep(INDEX_LOCK_TTL / 3)
+        await db.schema_state.update_one(
+            {"_id": STATE_ID, "locked_by": owner},
+            {"$set": {"locked_until": datetime.now(timezone.utc) + timedelta(seconds=INDEX_LOCK_TTL)}}
+        )
+
+
+async def reconcile_indexes(db, manifest: Dict[str, List[dict]] = INDEX_MANIFEST) -> Optional[dict]:
+    """Bring indexes in line with the manifest, once per manifest version.
+
+    The first worker to take the lock in `schema_state` applies the changes
+    and records the manifest hash; the others wait for that hash and then
+    return without touching indexes. Returns the changes applied by this
+    worker, or None when there was nothing to do here.
+    """
+    target = manifest_hash(manifest)
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    while True:
+        state = await db.schema_state.find_one({"_id": STATE_ID})
+        if state and state.get("hash") == target:
+            return None
+        if await _acquire(db, owner):
+            break
+        logger.info(f"Waiting for index reconciliation by {state.get('locked_by') if state else 'another worker'}")
+        await asyncio.sleep(INDEX_WAIT_INTERVAL)
+
+    renewal = asyncio.create_task(_renew(db, owner))
+    try:
+        state = await db.schema_state.find_one({"_id": STATE_ID}) or {}
+        if state.get("hash") == target:
+            return None
+        changes = await _apply(db, manifest, state.get("managed", {}))
+        await db.schema_state.update_one(
+            {"_id": STATE_ID, "locked_by": owner},
+            {
+                "$set": {
+                    "hash": target,
+                    "managed": {collection: [index_name(spec) for spec in specs]
+                                for collection, specs in manifest.items()},
+                    "applied_at": datetime.now(timezone.utc),
+                    "applied_by": owner
+                }
+            }
+        )
+        logger.info(
+            f"Indexes reconciled: {len(changes['created'])} created, "
+            f"{len(changes['rebuilt'])} rebuilt, {len(changes['dropped'])} dropped"
+        )
+        return changes
+    finally:
+        renewal.cancel()
+        await db.schema_state.update_one(
+            {"_id": STATE_ID, "locked_by": owner},
+            {"$unset": {"locked_by": "", "locked_until": ""}}
+        )
@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import secrets
+import time
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Minimum duration of a login attempt; calibrated from bcrypt when unset
+LOGIN_LATENCY_FLOOR = os.environ.get('LOGIN_LATENCY_FLOOR')
+# Floor used until start() has calibrated one; above any sane bcrypt cost
+LOGIN_STARTUP_FLOOR = float(os.environ.get('LOGIN_STARTUP_FLOOR', 1.0))
+# Concurrent password verifications (real or dummy) per worker
+LOGIN_VERIFY_CONCURRENCY = int(os.environ.get('LOGIN_VERIFY_CONCURRENCY', os.cpu_count() or 1))
+# How stale the known-login filter may be before a miss triggers a refresh
+LOGIN_FILTER_REFRESH = float(os.environ.get('LOGIN_FILTER_REFRESH', 1))
+# Full rebuilds drop deleted or renamed logins
+LOGIN_FILTER_REBUILD = float(os.environ.get('LOGIN_FILTER_REBUILD', 1800))
+LOGIN_FILTER_ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b)"""
+
+    def __init__(self, capacity: int, error_rate: float = LOGIN_FILTER_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class KnownLogins:
+    """Usernames and emails that may exist, answered without a query.
+
+    A negative answer triggers an incremental refresh (users changed since
+    the last one, by `updated_at`) at most once per LOGIN_FILTER_REFRESH, so
+    users created on other workers are picked up within that delay.
+    """
+
+    def __init__(self):
+        self.filter = BloomFilter(1024)
+        self.watermark = None
+        self.refreshed_at = 0.0
+        self.rebuilt_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def add(self, *values: Optional[str]):
+        for value in values:
+            if value:
+                if self.filter.count >= self.filter.capacity:
+                    # Oversized filters lose precision; the next check rebuilds
+                    self.rebuilt_at = 0.0
+                self.filter.add(value)
+
+    def _load(self, values: Iterable[str], watermark):
+        for value in values:
+            self.add(value)
+        if watermark and (self.watermark is None or watermark > self.watermark):
+            self.watermark = watermark
+
+    async def rebuild(self):
+        from database import get_login_identities, count_users
+
+        started = time.monotonic()
+        total = await count_users()
+        previous = self.filter
+        self.filter = BloomFilter(max(1024, total * 4))
+        self.watermark = None
+        try:
+            values, watermark = await get_login_identities()
+        except Exception:
+            self.filter = previous
+            raise
+        self._load(values, watermark)
+        self.refreshed_at = self.rebuilt_at = started
+
+    async def refresh(self):
+        from database import get_login_identities
+
+        started = time.monotonic()
+        values, watermark = await get_login_identities(since=self.watermark)
+        self._load(values, watermark)
+        self.refreshed_at = started
+
+    async def might_exist(self, login: str) -> bool:
+        if time.monotonic() - self.rebuilt_at >= LOGIN_FILTER_REBUILD:
+            async with self._lock:
+                if time.monotonic() - self.rebuilt_at >= LOGIN_FILTER_REBUILD:
+                    await self.rebuild()
+        if login in self.filter:
+            return True
+        if time.monotonic() - self.refreshed_at >= LOGIN_FILTER_REFRESH:
+            async with self._lock:
+                if time.monotonic() - self.refreshed_at >= LOGIN_FILTER_REFRESH:
+                    await self.refresh()
+            return login in self.filter
+        return False
+
+
+class LoginShield:
+    """Password checks that take the same time whether or not the user exists.
+
+    Unknown logins are mostly rejected by the filter without a query or a
+    hash. Every attempt is padded to a latency floor with a sleep, so the
+    cheap path is not observable. Password hashing runs in the default
+    executor under a per-worker budget; dummy hashes (for logins that pass
+    the filter but have no user) only run when the budget has room.
+
+    Attempts that skip the hash still queue for their turn in the budget,
+    and the floor counts from that turn, so a full budget delays every
+    path alike. Until start() has calibrated the floor and loaded the
+    filter, attempts are padded to LOGIN_STARTUP_FLOOR instead.
+    """
+
+    def __init__(self, concurrency: int = LOGIN_VERIFY_CONCURRENCY):
+        self.known = KnownLogins()
+        self.floor = float(LOGIN_LATENCY_FLOOR) if LOGIN_LATENCY_FLOOR else LOGIN_STARTUP_FLOOR
+        self.dummy_hash = None
+        self._budget = asyncio.Semaphore(concurrency)
+
+    async def start(self):
+        from passwords import pwd_context
+
+        loop = asyncio.get_running_loop()
+        self.dummy_hash = await loop.run_in_executor(None, pwd_context.hash, secrets.token_urlsafe(16))
+        if not LOGIN_LATENCY_FLOOR:
+            samples = []
+            for _ in range(3):
+                started = time.perf_counter()
+                await loop.run_in_executor(None, pwd_context.verify, "calibration", self.dummy_hash)
+                samples.append(time.perf_counter() - started)
+            # Room for the user lookup and moderate queueing
+            floor = sorted(samples)[1] * 1.5 + 0.05
+        else:
+            floor = self.floor
+        await self.known.rebuild()
+        # Only lowered once the filter is loaded, so earlier attempts keep the startup floor
+        self.floor = floor
+        logger.info(f"Login latency floor {self.floor * 1000:.0f} ms, {self.known.filter.count} known logins")
+
+    async def _turn(self) -> float:
+        """Wait for a place in the budget without hashing; seconds waited"""
+        queued = time.monotonic()
+        async with self._budget:
+            return time.monotonic() - queued
+
+    async def _verify(self, password: str, password_hash: str) -> tuple:
+        """(matches, upgraded hash or None, seconds waited for the budget)"""
+        from passwords import verify_and_update
+
+        queued = time.monotonic()
+        async with self._budget:
+            waited = time.monotonic() - queued
+            loop = asyncio.get_running_loop()
+            matches, new_hash = await loop.run_in_executor(None, verify_and_update, password, password_hash)
+        return matches, new_hash, waited
+
+    async def _upgrade(self, user: dict, new_hash: str):
+        """Store a rehashed password; a failure only delays the upgrade"""
+        from database import update_password_hash
+
+        try:
+            await update_password_hash(user['id'], user['password_hash'], new_hash)
+        except Exception as e:
+            logger.error(f"Error upgrading password hash: {e}")
+
+    async def authenticate(self, login: str, password: str) -> Optional[dict]:
+        """The user when the password matches, else None, after the floor"""
+        from database import get_user_by_login
+
+        started = time.monotonic()
+        floor = self.floor
+        user = None
+        waited = 0.0
+        try:
+            if await self.known.might_exist(login):
+                user = await get_user_by_login(login)
+                if user and user.get('password_hash'):
+                    matches, new_hash, waited = await self._verify(password, user['password_hash'])
+                    if not matches:
+                        user = None
+                    elif new_hash:
+                        await self._upgrade(user, new_hash)
+                else:
+                    user = None
+                    if self.dummy_hash and not self._budget.locked():
+                        _, _, waited = await self._verify(password, self.dummy_hash)
+                    else:
+                        waited = await self._turn()
+            else:
+                waited = await self._turn()
+        finally:
+            remaining = floor + waited - (time.monotonic() - started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+        return user
+
+
+login_shield = LoginShield()
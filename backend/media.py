@@ -0,0 +1,390 @@
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+import anyio
+from gridfs.errors import NoFile
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# local  - files under MEDIA_ROOT, named by their SHA-256
+# gridfs - chunks in the `media` GridFS bucket of the application database
+MEDIA_BACKEND = os.environ.get('MEDIA_BACKEND', 'local').strip().lower()
+MEDIA_BACKENDS = ("local", "gridfs")
+if MEDIA_BACKEND not in MEDIA_BACKENDS:
+    raise ValueError(f"MEDIA_BACKEND must be one of {', '.join(MEDIA_BACKENDS)}, got '{MEDIA_BACKEND}'")
+
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', Path(__file__).parent / 'media'))
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', 25 * 1024 * 1024))
+MEDIA_BUCKET = "media"
+# Upload data is written once this much has arrived; download reads too
+MEDIA_CHUNK_SIZE = 256 * 1024
+
+# Served inline; anything else is a download, so uploaded HTML or SVG
+# never runs in the application's origin
+INLINE_TYPES = re.compile(r"^(image/(png|jpeg|gif|webp)|audio/[\w.+-]+|video/[\w.+-]+|application/pdf)$")
+# A single range; several ranges get the whole file
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class MediaTooLarge(Exception):
+    """Raised when an upload goes past MEDIA_MAX_BYTES"""
+    pass
+
+
+class LocalWriter:
+    """Upload in progress: a temporary file next to the final objects"""
+
+    def __init__(self, storage: "LocalStorage"):
+        self.storage = storage
+        self.path = storage.root / "tmp" / f"{uuid.uuid4().hex}.part"
+        self._file = None
+
+    async def write(self, data: bytes):
+        if self._file is None:
+            await anyio.to_thread.run_sync(lambda: self.path.parent.mkdir(parents=True, exist_ok=True))
+            self._file = await anyio.open_file(self.path, "wb")
+        await self._file.write(data)
+
+    async def commit(self, sha256: str) -> str:
+        """Move the file to its content address; an identical file already there wins"""
+        if self._file is None:
+            await self.write(b"")
+        await self._file.aclose()
+        final = self.storage.path(sha256)
+
+        def place():
+            final.parent.mkdir(parents=True, exist_ok=True)
+            if final.exists():
+                self.path.unlink()
+            else:
+                os.replace(self.path, final)
+
+        await anyio.to_thread.run_sync(place)
+        return sha256
+
+    async def abort(self):
+        if self._file is not None:
+            await self._file.aclose()
+            await anyio.to_thread.run_sync(lambda: self.path.unlink(missing_ok=True))
+
+
+class LocalStorage:
+    """Content-addressed files on the local (or a shared) filesystem.
+
+    Downloads are plain files, so full responses can use the server's
+    sendfile path and ranges are served straight from the file.
+    """
+    name = "local"
+
+    def __init__(self, root: Path = MEDIA_ROOT):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / "objects" / key[:2] / key
+
+    def writer(self, filename: str, content_type: str) -> LocalWriter:
+        return LocalWriter(self)
+
+    async def discard(self, key: str):
+        """Nothing to do: a duplicate upload landed on the existing file"""
+        pass
+
+
+class GridFSWriter:
+    def __init__(self, bucket, filename: str, content_type: str):
+        self._stream = bucket.open_upload_stream(
+            filename, chunk_size_bytes=MEDIA_CHUNK_SIZE, metadata={"content_type": content_type}
+        )
+
+    async def write(self, data: bytes):
+        await self._stream.write(data)
+
+    async def commit(self, sha256: str) -> str:
+        await self._stream.close()
+        return str(self._stream._id)
+
+    async def abort(self):
+        await self._stream.abort()
+
+
+class GridFSStorage:
+    """Files split into MEDIA_CHUNK_SIZE chunks in a GridFS bucket"""
+    name = "gridfs"
+
+    def __init__(self, db=None, bucket_name: str = MEDIA_BUCKET):
+        self.db = db
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    def bucket(self):
+        if self._bucket is None:
+            from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+            if self.db is None:
+                from database import db
+                self.db = db
+            self._bucket = AsyncIOMotorGridFSBucket(self.db, bucket_name=self.bucket_name)
+        return self._bucket
+
+    def writer(self, filename: str, content_type: str) -> GridFSWriter:
+        return GridFSWriter(self.bucket(), filename, content_type)
+
+    async def discard(self, key: str):
+        """Delete a duplicate upload's chunks"""
+        from bson import ObjectId
+        await self.bucket().delete(ObjectId(key))
+
+    async def open(self, key: str):
+        from bson import ObjectId
+        return await self.bucket().open_download_stream(ObjectId(key))
+
+
+# Files are read back from the backend that stored them, so switching
+# MEDIA_BACKEND only affects new uploads
+storages = {"local": LocalStorage(), "gridfs": GridFSStorage()}
+media_store = storages[MEDIA_BACKEND]
+
+
+async def receive_upload(request: Request, storage, field: str = "file",
+                         max_bytes: int = MEDIA_MAX_BYTES) -> Optional[dict]:
+    """Stream the `field` file of a multipart body into storage.
+
+    The body is parsed as it arrives and the file's bytes are hashed and
+    written in MEDIA_CHUNK_SIZE pieces, so a worker holds at most about
+    one chunk of an upload in memory whatever its size. Other fields are
+    skipped. Returns None if the body has no such file; the caller stores
+    the result and, if its hash was already known, discards the new copy.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise ValueError("Envie o arquivo como multipart/form-data")
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes + 64 * 1024:
+        raise MediaTooLarge(f"Arquivo maior que {max_bytes // (1024 * 1024)} MB")
+
+    # The parser calls back synchronously; events are collected per body
+    # chunk and handled (with awaits) after each parser.write()
+    events = []
+    header = {"field": b"", "value": b""}
+    part_headers = {}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        part_headers[header["field"].lower()] = header["value"]
+        header["field"] = header["value"] = b""
+
+    def on_headers_finished():
+        events.append(("headers", dict(part_headers)))
+        part_headers.clear()
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    writer = None
+    upload = None
+    receiving = False
+    done = False
+    digest = hashlib.sha256()
+    buffered = bytearray()
+    size = 0
+
+    async def drain():
+        await writer.write(bytes(buffered))
+        buffered.clear()
+
+    try:
+        async for chunk in request.stream():
+            if done:
+                continue  # read (and ignore) the rest of the body
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "headers" and upload is None:
+                    _, disposition = parse_options_header(value.get(b"content-disposition", b""))
+                    if disposition.get(b"name", b"").decode("utf-8", "replace") != field \
+                            or b"filename" not in disposition:
+                        continue
+                    filename = os.path.basename(disposition[b"filename"].decode("utf-8", "replace"))[:255]
+                    part_type = value.get(b"content-type", b"application/octet-stream").decode("latin-1").strip()
+                    upload = {"filename": filename or "arquivo", "content_type": part_type.lower()}
+                    writer = storage.writer(upload["filename"], upload["content_type"])
+                    receiving = True
+                elif kind == "data" and receiving:
+                    size += len(value)
+                    if size > max_bytes:
+                        raise MediaTooLarge(f"Arquivo maior que {max_bytes // (1024 * 1024)} MB")
+                    digest.update(value)
+                    buffered += value
+                    if len(buffered) >= MEDIA_CHUNK_SIZE:
+                        await drain()
+                elif kind == "end" and receiving:
+                    receiving = False
+                    done = True
+                    break
+            events.clear()
+        if upload is None or not done:
+            if writer is not None:
+                await writer.abort()
+            return None
+        if buffered:
+            await drain()
+        sha256 = digest.hexdigest()
+        upload.update(sha256=sha256, size=size, storage_key=await writer.commit(sha256))
+        return upload
+    except BaseException:
+        if writer is not None:
+            await writer.abort()
+        raise
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """First and last byte of a single `bytes=` range, or None for the whole file.
+
+    Malformed headers and multiple ranges are answered with the whole
+    file, which RFC 9110 allows. Raises ValueError if the range starts
+    past the end of the file.
+    """
+    match = _RANGE.match(header or "")
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError("Intervalo inválido")
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Intervalo inválido")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def media_headers(media: dict) -> dict:
+    """Headers shared by every response for a stored file"""
+    content_type = media.get("content_type") or "application/octet-stream"
+    disposition = "inline" if INLINE_TYPES.match(content_type) else "attachment"
+    filename = re.sub(r'[^\w.-]', '_', media.get("filename") or "arquivo")
+    return {
+        "accept-ranges": "bytes",
+        # Content-addressed: the bytes behind an id never change
+        "etag": f'"{media["sha256"]}"',
+        "cache-control": "public, max-age=31536000, immutable",
+        "content-disposition": f'{disposition}; filename="{filename}"',
+        "x-content-type-options": "nosniff",
+    }
+
+
+class RangeFileResponse(Response):
+    """A file, or one byte range of it, from the local storage.
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server
+    offers it, and the path send extension for whole files; otherwise the
+    range is read in MEDIA_CHUNK_SIZE pieces.
+    """
+
+    def __init__(self, path: Path, size: int, media_type: str, headers: dict,
+                 byte_range: Optional[Tuple[int, int]] = None):
+        self.path = path
+        self.start, self.end = byte_range or (0, size - 1)
+        super().__init__(
+            status_code=206 if byte_range else 200,
+            headers={**headers, "content-length": str(self.end - self.start + 1)},
+            media_type=media_type
+        )
+        if byte_range:
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        extensions = scope.get("extensions") or {}
+        if scope["method"].upper() == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif self.status_code == 200 and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file,
+                            "offset": self.start, "count": count, "more_body": False})
+        else:
+            async with await anyio.open_file(self.path, "rb") as file:
+                await file.seek(self.start)
+                while count > 0:
+                    chunk = await file.read(min(MEDIA_CHUNK_SIZE, count))
+                    if not chunk:
+                        break
+                    count -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+                if count > 0:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def gridfs_chunks(grid_out, start: int, end: int) -> AsyncIterator[bytes]:
+    """Bytes start..end of a GridFS file, one stored chunk at a time"""
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await grid_out.read(min(MEDIA_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def media_response(media: dict, request: Request) -> Optional[Response]:
+    """Response for a stored file honouring Range and If-None-Match; None if the bytes are gone"""
+    headers = media_headers(media)
+    size = media["size"]
+    if request.headers.get("if-none-match") == headers["etag"]:
+        return Response(status_code=304, headers=headers)
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+    content_type = media.get("content_type") or "application/octet-stream"
+
+    storage = storages[media["backend"]]
+    if storage.name == "local":
+        path = storage.path(media["storage_key"])
+        if not await anyio.to_thread.run_sync(path.is_file):
+            return None
+        return RangeFileResponse(path, size, content_type, headers, byte_range)
+
+    start, end = byte_range or (0, size - 1)
+    headers["content-length"] = str(end - start + 1 if size else 0)
+    if byte_range:
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+    status_code = 206 if byte_range else 200
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=content_type)
+    try:
+        grid_out = await storage.open(media["storage_key"])
+    except NoFile:
+        return None
+    return StreamingResponse(gridfs_chunks(grid_out, start, end), status_code=status_code,
+                             headers=headers, media_type=content_type)
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Bucket sizes kept in metrics_rollups, in seconds
+GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+DIMENSIONS = ("all", "channel", "team", "agent")
+COUNTERS = ("created", "assigned", "wait_ms", "closed", "handled", "handle_ms", "abandoned")
+EVENTS = ("created", "assigned", "closed")
+
+# Finer buckets are only needed for recent ranges; MongoDB deletes them
+# this long after the bucket starts (day buckets are kept)
+RETENTION = {
+    "minute": timedelta(days=int(os.environ.get('METRICS_MINUTE_RETENTION_DAYS', 7))),
+    "hour": timedelta(days=int(os.environ.get('METRICS_HOUR_RETENTION_DAYS', 90))),
+}
+
+# Increments are coalesced in memory and written this often
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+BACKFILL_CHUNK = timedelta(days=1)
+
+RollupKey = Tuple[str, str, str, datetime]
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    """MongoDB returns naive UTC datetimes"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+@lru_cache(maxsize=4096)
+def _bucket(epoch: int) -> datetime:
+    return datetime.fromtimestamp(epoch, timezone.utc)
+
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    seconds = GRANULARITIES[granularity]
+    return _bucket(int(_utc(value).timestamp()) // seconds * seconds)
+
+
+def choose_granularity(start: datetime, end: datetime, now: Optional[datetime] = None) -> str:
+    """Coarsest bucket that still gives a useful chart for the range and
+    is still retained for its start"""
+    now = now or datetime.now(timezone.utc)
+    span = end - start
+    if span <= timedelta(hours=6) and start >= now - RETENTION["minute"]:
+        return "minute"
+    if span <= timedelta(days=14) and start >= now - RETENTION["hour"]:
+        return "hour"
+    return "day"
+
+
+def _duration_ms(start: Optional[datetime], end: Optional[datetime]) -> int:
+    if start is None or end is None:
+        return 0
+    return max(0, int((_utc(end) - _utc(start)).total_seconds() * 1000))
+
+
+def conversation_events(conversation: dict, kinds: Iterable[str] = EVENTS):
+    """(timestamp, dimensions, counters) for the events a conversation went through"""
+    dimensions = [("all", ""), ("channel", conversation.get('channel_id') or "")]
+    if conversation.get('team_id'):
+        dimensions.append(("team", conversation['team_id']))
+    agent = [("agent", conversation['assignee_id'])] if conversation.get('assignee_id') else []
+
+    for kind in kinds:
+        if kind == "created" and conversation.get('created_at'):
+            yield conversation['created_at'], dimensions, {"created": 1}
+        elif kind == "assigned" and conversation.get('assigned_at'):
+            yield conversation['assigned_at'], dimensions + agent, {
+                "assigned": 1,
+                "wait_ms": _duration_ms(conversation.get('created_at'), conversation['assigned_at'])
+            }
+        elif kind == "closed" and conversation.get('closed_at'):
+            if conversation.get('assigned_at'):
+                counters = {
+                    "closed": 1,
+                    "handled": 1,
+                    "handle_ms": _duration_ms(conversation['assigned_at'], conversation['closed_at'])
+                }
+            else:
+                counters = {"closed": 1, "abandoned": 1}
+            yield conversation['closed_at'], dimensions + agent, counters
+
+
+class RollupAccumulator:
+    """Increments per (granularity, dimension, key, bucket), merged in memory"""
+
+    def __init__(self):
+        self._pending: Dict[RollupKey, Dict[str, int]] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, conversation: dict, *kinds: str, start: datetime = None, end: datetime = None):
+        """Count events of a conversation, optionally only those in [start, end)"""
+        for timestamp, dimensions, counters in conversation_events(conversation, kinds or EVENTS):
+            timestamp = _utc(timestamp)
+            if (start and timestamp < start) or (end and timestamp >= end):
+                continue
+            epoch = int(timestamp.timestamp())
+            for granularity, seconds in GRANULARITIES.items():
+                bucket = _bucket(epoch // seconds * seconds)
+                for dimension, key in dimensions:
+                    pending = self._pending.get((granularity, dimension, key, bucket))
+                    if pending is None:
+                        self._pending[(granularity, dimension, key, bucket)] = dict(counters)
+                        continue
+                    for counter, value in counters.items():
+                        pending[counter] = pending.get(counter, 0) + value
+
+    def merge(self, increments: Dict[RollupKey, Dict[str, int]]):
+        for rollup, counters in increments.items():
+            pending = self._pending.setdefault(rollup, {})
+            for counter, value in counters.items():
+                pending[counter] = pending.get(counter, 0) + value
+
+    def drain(self) -> Dict[RollupKey, Dict[str, int]]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+
+def rollup_updates(increments: Dict[RollupKey, Dict[str, int]],
+                   now: Optional[datetime] = None) -> List[UpdateOne]:
+    """Upserts for coalesced increments; buckets already past their
+    retention (a backfill of old data) are skipped"""
+    now = now or datetime.now(timezone.utc)
+    updates = []
+    for (granularity, dimension, key, bucket), counters in increments.items():
+        update = {"$inc": counters}
+        retention = RETENTION.get(granularity)
+        if retention is not None:
+            if bucket + retention <= now:
+                continue
+            update["$setOnInsert"] = {"expires_at": bucket + retention}
+        updates.append(UpdateOne(
+            {"granularity": granularity, "dimension": dimension, "key": key, "bucket": bucket},
+            update,
+            upsert=True
+        ))
+    return updates
+
+
+def _average_seconds(total_ms: str, count: str) -> dict:
+    return {"$cond": [
+        {"$gt": [f"${count}", 0]},
+        {"$divide": [f"${total_ms}", {"$multiply": [f"${count}", 1000]}]},
+        None
+    ]}
+
+
+def rollup_series_pipeline(match: dict) -> List[dict]:
+    """Aggregation grouping the rollups matched into one series per key.
+
+    Points come out in bucket order with their averages computed, and the
+    totals are summed by the server, so a long report doesn't loop over
+    every bucket in Python.
+    """
+    counters = {counter: {"$ifNull": [f"${counter}", 0]} for counter in COUNTERS}
+    return [
+        {"$match": match},
+        {"$sort": {"key": 1, "bucket": 1}},
+        {"$set": counters},
+        {"$group": {
+            "_id": "$key",
+            "points": {"$push": {
+                "bucket": "$bucket",
+                **{counter: f"${counter}" for counter in COUNTERS if not counter.endswith("_ms")},
+                "avg_wait_seconds": _average_seconds("wait_ms", "assigned"),
+                "avg_handle_seconds": _average_seconds("handle_ms", "handled")
+            }},
+            **{counter: {"$sum": f"${counter}"} for counter in COUNTERS}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+
+
+def summarize(groups: Iterable[dict]) -> List[dict]:
+    """Shape the series built by rollup_series_pipeline for the report"""
+    series = []
+    # Series of one report share their buckets; convert each once
+    buckets: Dict[datetime, datetime] = {}
+    for group in groups:
+        points = group['points']
+        for point in points:
+            bucket = buckets.get(point['bucket'])
+            if bucket is None:
+                bucket = buckets[point['bucket']] = _utc(point['bucket'])
+            point['bucket'] = bucket
+        series.append({
+            'key': group['_id'],
+            'points': points,
+            'totals': _with_averages({counter: group.get(counter, 0) for counter in COUNTERS})
+        })
+    return series
+
+
+def _with_averages(counters: dict) -> dict:
+    wait_ms = counters.pop('wait_ms', 0)
+    handle_ms = counters.pop('handle_ms', 0)
+    counters['avg_wait_seconds'] = wait_ms / counters['assigned'] / 1000 if counters.get('assigned') else None
+    counters['avg_handle_seconds'] = handle_ms / counters['handled'] / 1000 if counters.get('handled') else None
+    return counters
+
+
+class MetricsRecorder:
+    """Feeds metrics_rollups from conversation events as they happen.
+
+    Events are merged in memory and written as coalesced $inc upserts every
+    METRICS_FLUSH_INTERVAL, so a burst of conversations costs one bulk
+    write instead of a dozen upserts each.
+    """
+
+    def __init__(self, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending = RollupAccumulator()
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self.flushed = 0
+
+    def record(self, conversation: dict, *kinds: str):
+        self._pending.add(conversation, *kinds)
+
+    async def flush(self):
+        from database import save_metric_rollups
+
+        increments = self._pending.drain()
+        if not increments:
+            return
+        try:
+            await save_metric_rollups(increments)
+            self.flushed += len(increments)
+        except Exception as e:
+            logger.error(f"Error persisting metrics, will retry: {e}")
+            self._pending.merge(increments)
+
+    async def start(self):
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            # Not cancelled: a flush in progress has already taken the
+            # pending entries and would drop them
+            self._stop.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.flush_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {'pending': len(self._pending), 'flushed': self.flushed}
+
+
+async def _backfill_chunk(db, start: datetime, end: datetime) -> int:
+    accumulator = RollupAccumulator()
+    window = {"$gte": start, "$lt": end}
+    cursor = db.conversations.find(
+        {"$or": [{"created_at": window}, {"assigned_at": window}, {"closed_at": window}]},
+        {"_id": 0, "channel_id": 1, "team_id": 1, "assignee_id": 1,
+         "created_at": 1, "assigned_at": 1, "closed_at": 1}
+    )
+    conversations = 0
+    async for conversation in cursor:
+        accumulator.add(conversation, start=start, end=end)
+        conversations += 1
+    updates = rollup_updates(accumulator.drain())
+    if updates:
+        await db.metrics_rollups.bulk_write(updates, ordered=False)
+    return conversations
+
+
+async def backfill_rollups(db, start: datetime, end: datetime, workers: int = 4,
+                           chunk: timedelta = BACKFILL_CHUNK, progress=None) -> int:
+    """Rebuild rollups for events in [start, end) from the conversations.
+
+    start and end are aligned to whole days so every bucket in the range
+    is rebuilt entirely. Chunks of the range are processed concurrently.
+    Live events must not fall inside the range; the default end of the
+    backfill job (today, 00:00 UTC) guarantees that.
+    """
+    start = bucket_start(start, "day")
+    end = bucket_start(end, "day")
+    await db.metrics_rollups.delete_many({"bucket": {"$gte": start, "$lt": end}})
+
+    chunks = []
+    cursor = start
+    while cursor < end:
+        chunks.append((cursor, min(cursor + chunk, end)))
+        cursor += chunk
+
+    semaphore = asyncio.Semaphore(workers)
+    started = time.perf_counter()
+    done = 0
+
+    async def run(chunk_start, chunk_end):
+        nonlocal done
+        async with semaphore:
+            count = await _backfill_chunk(db, chunk_start, chunk_end)
+        done += 1
+        if progress:
+            progress(done, len(chunks), time.perf_counter() - started)
+        return count
+
+    counts = await asyncio.gather(*(run(chunk_start, chunk_end) for chunk_start, chunk_end in chunks))
+    return sum(counts)
+
+
+conversation_metrics = MetricsRecorder()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Migra os ids dos documentos para _id binário (UUID, subtipo 4)
+Uso: python migrate_ids.py [--stats] [--batch-size 500] [coleção ...]
+
+Migração online:
+  1. Reinicie o backend com ID_STORAGE=migrating; novos documentos já são
+     gravados com _id binário e as buscas encontram os dois formatos.
+  2. Rode este script (com ID_STORAGE=migrating); cada documento com `id`
+     em texto é regravado com o UUID como _id.
+  3. Reinicie o backend com ID_STORAGE=binary; os índices de `id` são
+     removidos na reconciliação do manifesto.
+
+Com --stats apenas mede tamanho de dados, índices e working set.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from ids import ID_COLLECTIONS, ID_STORAGE, binary_document
+
+MB = 1024 * 1024
+
+
+async def collection_stats(db, names) -> dict:
+    """Data and index sizes per collection, in bytes"""
+    stats = {}
+    for name in names:
+        try:
+            result = await db.command("collStats", name)
+        except OperationFailure:
+            continue
+        stats[name] = {
+            'count': result.get('count', 0),
+            'avg_obj_size': result.get('avgObjSize', 0),
+            'size': result.get('size', 0),
+            'index_size': result.get('totalIndexSize', 0),
+            'indexes': result.get('indexSizes', {})
+        }
+    return stats
+
+
+def print_stats(title: str, stats: dict):
+    print(f"\n📏 {title}")
+    print(f"   {'coleção':<16} {'docs':>10} {'média':>8} {'dados MB':>10} {'índices MB':>11}")
+    for name, entry in stats.items():
+        print(f"   {name:<16} {entry['count']:>10} {entry['avg_obj_size']:>8.0f} "
+              f"{entry['size'] / MB:>10.2f} {entry['index_size'] / MB:>11.2f}")
+        for index, size in entry['indexes'].items():
+            print(f"      {index:<28} {size / MB:>10.2f} MB")
+    data = sum(entry['size'] for entry in stats.values())
+    indexes = sum(entry['index_size'] for entry in stats.values())
+    # Documents and indexes that must stay in cache to serve queries from memory
+    print(f"   Working set estimado: {(data + indexes) / MB:.2f} MB "
+          f"(dados {data / MB:.2f} + índices {indexes / MB:.2f})")
+
+
+def print_delta(before: dict, after: dict):
+    print("\n📉 Diferença")
+    for name in before:
+        if name not in after:
+            continue
+        data = after[name]['size'] - before[name]['size']
+        indexes = after[name]['index_size'] - before[name]['index_size']
+        print(f"   {name:<16} dados {data / MB:>+9.2f} MB   índices {indexes / MB:>+9.2f} MB")
+
+
+async def supports_transactions(client) -> bool:
+    """Transactions need a replica set or a sharded cluster"""
+    hello = await client.admin.command("hello")
+    return bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+
+
+async def migrate_document(collection, object_id, session=None) -> bool:
+    """Rewrite one document keyed by its UUID.
+
+    find_one_and_delete returns the latest version, so updates made up to
+    that point are kept; within a transaction no reader sees the gap.
+    """
+    current = await collection.find_one_and_delete({"_id": object_id}, session=session)
+    if current is None or not current.get('id'):
+        return False
+    try:
+        await collection.insert_one(binary_document(current), session=session)
+    except Exception:
+        if session is None:
+            # No transaction to roll back: put the original back
+            await collection.insert_one(current)
+        raise
+    return True
+
+
+async def migrate_collection(client, collection, batch_size: int, transactions: bool) -> int:
+    migrated = 0
+    started = time.perf_counter()
+    while True:
+        # String ids live on documents whose _id is still an ObjectId
+        batch = await collection.find(
+            {"id": {"$type": "string"}}, {"_id": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        for doc in batch:
+            if transactions:
+                async with await client.start_session() as session:
+                    async with session.start_transaction():
+                        migrated += await migrate_document(collection, doc['_id'], session)
+            else:
+                migrated += await migrate_document(collection, doc['_id'])
+        elapsed = time.perf_counter() - started
+        print(f"   {collection.name}: {migrated} documentos ({migrated / elapsed:,.0f}/s)", end='\r')
+    print(f"   {collection.name}: {migrated} documentos migrados" + " " * 20)
+    return migrated
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migra ids em texto para _id binário")
+    parser.add_argument('collections', nargs='*', default=list(ID_COLLECTIONS))
+    parser.add_argument('--stats', action='store_true', help="apenas mede tamanhos, sem migrar")
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    unknown = [name for name in args.collections if name not in ID_COLLECTIONS]
+    if unknown:
+        print(f"❌ Coleções sem id: {', '.join(unknown)}")
+        return 1
+
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[os.environ.get('DB_NAME', 'chat_db')]
+
+    try:
+        before = await collection_stats(db, args.collections)
+        print_stats("Antes" if not args.stats else "Tamanho atual", before)
+        if args.stats:
+            return 0
+
+        if ID_STORAGE == "string":
+            print("\n❌ Defina ID_STORAGE=migrating (no backend e aqui) antes de migrar;")
+            print("   com ID_STORAGE=string o backend não encontra documentos migrados.")
+            return 1
+
+        transactions = await supports_transactions(client)
+        if not transactions:
+            print("\n⚠️  Sem replica set: cada documento fica ausente por um instante durante a regravação")
+
+        print("\n⏳ Migrando...")
+        for name in args.collections:
+            await migrate_collection(client, db[name], args.batch_size, transactions)
+
+        after = await collection_stats(db, args.collections)
+        print_stats("Depois", after)
+        print_delta(before, after)
+        freed = sum(entry['indexes'].get('id_1', 0) for entry in after.values())
+        print("\n✓ Migração concluída. Reinicie o backend com ID_STORAGE=binary para remover")
+        print(f"   os índices de id ({freed / MB:.2f} MB).")
+        return 0
+
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
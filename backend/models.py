@@ -25,6 +25,8 @@ class AgentCreate(BaseModel):
     email: EmailStr
     password: str = Field(..., min_length=6)
     is_active: bool = True
+    team_id: Optional[str] = None
+    max_conversations: Optional[int] = Field(None, ge=1, le=50)  # Atendimentos simultâneos
 
 class AgentUpdate(BaseModel):
     name: Optional[str] = Field(None, min_length=2, max_length=100)
@@ -32,6 +34,8 @@ class AgentUpdate(BaseModel):
     email: Optional[EmailStr] = None
     password: Optional[str] = Field(None, min_length=6)
     is_active: Optional[bool] = None
+    team_id: Optional[str] = None
+    max_conversations: Optional[int] = Field(None, ge=1, le=50)
 
 class AgentResponse(BaseModel):
     id: str
@@ -39,11 +43,14 @@ class AgentResponse(BaseModel):
     username: str
     email: str
     is_active: bool
+    team_id: Optional[str] = None
+    max_conversations: Optional[int] = None
     created_at: datetime
 
 class AgentListResponse(BaseModel):
     agents: List[AgentResponse]
     total: int
+    total_is_estimate: bool = False
     page: int
     per_page: int
 
@@ -73,6 +80,7 @@ class AdminResponse(BaseModel):
 class AdminListResponse(BaseModel):
     admins: List[AdminResponse]
     total: int
+    total_is_estimate: bool = False
     page: int
     per_page: int
 
@@ -101,6 +109,7 @@ class ChannelResponse(BaseModel):
 class ChannelListResponse(BaseModel):
     channels: List[ChannelResponse]
     total: int
+    total_is_estimate: bool = False
     page: int
     per_page: int
 
@@ -124,18 +133,70 @@ class FlowResponse(BaseModel):
     edges: Optional[List[dict]] = None
     created_at: datetime
     updated_at: datetime
+    revision: int = 0
 
 class FlowListResponse(BaseModel):
     flows: List[FlowResponse]
     total: int
+    total_is_estimate: bool = False
     page: int
     per_page: int
 
+class FlowPatchOperation(BaseModel):
+    op: str = Field(..., pattern="^(add_node|remove_node|move_node|connect|disconnect)$")
+    id: Optional[str] = None  # remove_node, move_node, disconnect
+    node: Optional[dict] = None  # add_node
+    position: Optional[dict] = None  # move_node
+    edge: Optional[dict] = None  # connect, disconnect sem id
+
+class FlowPatch(BaseModel):
+    revision: int = Field(..., ge=0)
+    operations: List[FlowPatchOperation] = Field(..., min_length=1, max_length=1000)
+
+class FlowPatchResponse(BaseModel):
+    id: str
+    revision: int
+    updated_at: datetime
+    nodes_added: List[dict]
+    nodes_removed: List[str]
+    nodes_moved: List[dict]
+    edges_added: List[dict]
+    edges_removed: List[dict]
+
 class FlowImport(BaseModel):
     name: str = Field(..., min_length=2, max_length=100)
     nodes: Optional[List[dict]] = None
     edges: Optional[List[dict]] = None
 
+class FlowRevisionResponse(BaseModel):
+    number: int
+    name: str
+    root: str
+    node_count: int
+    edge_count: int
+    created_at: datetime
+
+class FlowRevisionListResponse(BaseModel):
+    revisions: List[FlowRevisionResponse]
+    total: int
+    total_is_estimate: bool = False
+    page: int
+    per_page: int
+
+class FlowElementDiff(BaseModel):
+    added: List[dict]
+    removed: List[dict]
+    modified: List[dict]  # {id, before, after}
+
+class FlowRevisionDiffResponse(BaseModel):
+    from_number: int
+    to_number: int
+    identical: bool
+    name_before: str
+    name_after: str
+    nodes: FlowElementDiff
+    edges: FlowElementDiff
+
 
 # Team Models
 class TeamCreate(BaseModel):
@@ -163,5 +224,168 @@ class TeamResponse(BaseModel):
 class TeamListResponse(BaseModel):
     teams: List[TeamResponse]
     total: int
+    total_is_estimate: bool = False
+    page: int
+    per_page: int
+
+
+# Canned Reply Models
+class CannedReplyCreate(BaseModel):
+    team_id: Optional[str] = None  # Sem equipe: visível para todas as equipes
+    shortcut: str = Field(..., max_length=33, pattern="^/?[A-Za-z0-9][A-Za-z0-9_-]*$")
+    title: str = Field(..., min_length=1, max_length=100)
+    content: str = Field(..., min_length=1, max_length=4096)
+
+class CannedReplyUpdate(BaseModel):
+    team_id: Optional[str] = None
+    shortcut: Optional[str] = Field(None, max_length=33, pattern="^/?[A-Za-z0-9][A-Za-z0-9_-]*$")
+    title: Optional[str] = Field(None, min_length=1, max_length=100)
+    content: Optional[str] = Field(None, min_length=1, max_length=4096)
+
+class CannedReplyResponse(BaseModel):
+    id: str
+    team_id: Optional[str] = None
+    shortcut: str
+    title: str
+    content: str
+    created_at: datetime
+    updated_at: datetime
+
+class CannedReplyListResponse(BaseModel):
+    canned_replies: List[CannedReplyResponse]
+    total: int
+    total_is_estimate: bool = False
     page: int
     per_page: int
+
+class CannedReplyMatch(BaseModel):
+    id: str
+    team_id: Optional[str] = None
+    shortcut: str
+    title: str
+    content: str
+
+class CannedReplySearchResponse(BaseModel):
+    items: List[CannedReplyMatch]
+
+
+# Dashboard Models
+class ChannelSummary(BaseModel):
+    active: int
+    inactive: int
+
+class FlowSummary(BaseModel):
+    in_use: int
+    unused: int
+
+class DashboardSummaryResponse(BaseModel):
+    agents: int
+    admins: int
+    channels: ChannelSummary
+    flows: FlowSummary
+    teams: int
+    generated_at: datetime
+
+
+# Report Models
+class ReportCounters(BaseModel):
+    created: int
+    assigned: int
+    closed: int
+    handled: int
+    abandoned: int
+    avg_wait_seconds: Optional[float] = None
+    avg_handle_seconds: Optional[float] = None
+
+class ReportPoint(ReportCounters):
+    bucket: datetime
+
+class ReportSeries(BaseModel):
+    key: str
+    points: List[ReportPoint]
+    totals: ReportCounters
+
+class ConversationReportResponse(BaseModel):
+    dimension: str
+    granularity: str
+    start: datetime
+    end: datetime
+    series: List[ReportSeries]
+
+
+# Conversation Models
+class ConversationCreate(BaseModel):
+    channel_id: str
+    client_name: Optional[str] = Field(None, max_length=100)
+    team_id: Optional[str] = None
+    priority: int = Field(default=0, ge=0, le=10)
+
+class ConversationResponse(BaseModel):
+    id: str
+    channel_id: str
+    team_id: Optional[str] = None
+    client_name: str
+    status: str
+    priority: int
+    assignee_id: Optional[str] = None
+    created_at: datetime
+    assigned_at: Optional[datetime] = None
+    closed_at: Optional[datetime] = None
+    last_message_at: datetime
+    expires_at: Optional[datetime] = None
+    client_read_seq: int = 0
+    agent_read_seq: int = 0
+    notice: Optional[str] = None
+
+class InboxItem(BaseModel):
+    id: str
+    status: str
+    client_name: Optional[str] = None
+    priority: int = 0
+    team_id: Optional[str] = None
+    assignee_id: Optional[str] = None
+    last_message_at: datetime
+    unread: int = 0
+    section: Optional[str] = None
+
+class InboxPage(BaseModel):
+    items: List[InboxItem]
+    next_cursor: Optional[str] = None
+    revision: int
+
+class InboxChanges(BaseModel):
+    items: List[InboxItem]
+    revision: int
+    reset: bool = False
+
+class MessageCreate(BaseModel):
+    text: str = Field(..., min_length=1, max_length=4096)
+
+class ReceiptCreate(BaseModel):
+    seq: int = Field(..., ge=1)
+
+class MessageResponse(BaseModel):
+    id: str
+    conversation_id: str
+    seq: int
+    sender_type: str
+    sender_id: Optional[str] = None
+    text: str
+    created_at: datetime
+
+
+# Media Models
+class MediaResponse(BaseModel):
+    id: str
+    sha256: str
+    size: int
+    content_type: str
+    filename: str
+    url: str
+    deduplicated: bool = False
+    created_at: datetime
+
+
+# Presence Models
+class PresenceHeartbeat(BaseModel):
+    status: str = Field(default="online", pattern="^(online|away|offline)$")
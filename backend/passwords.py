@@ -0,0 +1,88 @@
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+# First scheme hashes new passwords; the others are only verified and
+# upgraded on the next successful login
+PASSWORD_SCHEMES = [
+    scheme.strip() for scheme in os.environ.get('PASSWORD_SCHEMES', 'bcrypt').split(',') if scheme.strip()
+]
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 3))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 65536))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 4))
+
+SUPPORTED_SCHEMES = ("argon2", "bcrypt")
+
+
+def argon2_available() -> bool:
+    """argon2 needs the optional argon2-cffi package"""
+    try:
+        import argon2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def scheme_settings(scheme: str, bcrypt_rounds: int = BCRYPT_ROUNDS, argon2_time_cost: int = ARGON2_TIME_COST,
+                    argon2_memory_cost: int = ARGON2_MEMORY_COST,
+                    argon2_parallelism: int = ARGON2_PARALLELISM) -> dict:
+    """CryptContext keyword arguments for one scheme"""
+    if scheme == "bcrypt":
+        return {"bcrypt__rounds": bcrypt_rounds}
+    if scheme == "argon2":
+        return {
+            "argon2__type": "ID",
+            "argon2__time_cost": argon2_time_cost,
+            "argon2__memory_cost": argon2_memory_cost,
+            "argon2__parallelism": argon2_parallelism,
+        }
+    raise ValueError(f"Esquema de senha não suportado: {scheme}")
+
+
+def build_context(schemes: Optional[List[str]] = None, **settings) -> CryptContext:
+    """Hashing policy: the first usable scheme is the default, older hashes
+    (other schemes, or bcrypt with different rounds) are flagged by
+    needs_update"""
+    requested = schemes or PASSWORD_SCHEMES
+    usable = []
+    for scheme in requested:
+        if scheme not in SUPPORTED_SCHEMES:
+            raise ValueError(f"Esquema de senha não suportado: {scheme}")
+        if scheme == "argon2" and not argon2_available():
+            logger.warning("argon2 requested but argon2-cffi is not installed; using the next scheme")
+            continue
+        usable.append(scheme)
+    # Existing hashes are bcrypt, so it must stay verifiable
+    if "bcrypt" not in usable:
+        usable.append("bcrypt")
+
+    options = {}
+    for scheme in usable:
+        options.update(scheme_settings(scheme, **settings))
+    return CryptContext(schemes=usable, default=usable[0], deprecated="auto", **options)
+
+
+pwd_context = build_context()
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """Check a password; on success also return a new hash when the stored
+    one uses a deprecated scheme or different cost settings"""
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+def hash_scheme(password_hash: str) -> Optional[str]:
+    """Scheme that produced a stored hash"""
+    try:
+        return pwd_context.identify(password_hash)
+    except ValueError:
+        return None
@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from bus import message_bus
+from timers import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+ONLINE = "online"
+AWAY = "away"
+OFFLINE = "offline"
+STATUSES = (ONLINE, AWAY, OFFLINE)
+
+HEARTBEAT_INTERVAL = int(os.environ.get('PRESENCE_HEARTBEAT_INTERVAL', 10))
+# An agent that misses three heartbeats is considered offline
+PRESENCE_TIMEOUT = HEARTBEAT_INTERVAL * 3
+PRESENCE_FLUSH_INTERVAL = int(os.environ.get('PRESENCE_FLUSH_INTERVAL', 5))
+# Unchanged heartbeats only refresh last_seen in MongoDB this often
+PRESENCE_PERSIST_STALENESS = 60
+# Heartbeats reach the other workers through the message bus
+PRESENCE_TOPIC = "presence"
+
+
+class _Presence:
+    __slots__ = ("user_id", "team_id", "status", "last_seen", "persisted_at")
+
+    def __init__(self, user_id: str, team_id: Optional[str]):
+        self.user_id = user_id
+        self.team_id = team_id
+        self.status = OFFLINE
+        self.last_seen = 0.0
+        self.persisted_at = 0.0
+
+
+class PresenceService:
+    """In-memory agent presence fed by heartbeats.
+
+    Each team keeps one set of user ids per status, so team counts are O(1)
+    and a heartbeat is a couple of dict operations. Expiry of silent agents
+    goes through a timer wheel, and changes reach the `presence` collection
+    in coalesced bulk writes instead of one write per heartbeat.
+
+    Presence gates routing on every worker, while a heartbeat reaches just
+    one of them. With the mongo bus backend, status changes are published
+    right away and unchanged heartbeats in one digest per flush interval;
+    the other workers apply both. The worker that received a heartbeat is
+    the one that persists it.
+    """
+
+    def __init__(self, timeout: float = PRESENCE_TIMEOUT, flush_interval: float = PRESENCE_FLUSH_INTERVAL):
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self._entries: Dict[str, _Presence] = {}
+        self._teams: Dict[Optional[str], Dict[str, Set[str]]] = {}
+        self._dirty: Set[str] = set()
+        # Unchanged heartbeats received here since the last digest
+        self._seen: Dict[str, Tuple[Optional[str], str, float]] = {}
+        self._wheel = TimerWheel(now=time.time())
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    def _team(self, team_id: Optional[str]) -> Dict[str, Set[str]]:
+        team = self._teams.get(team_id)
+        if team is None:
+            team = self._teams[team_id] = {status: set() for status in STATUSES}
+        return team
+
+    def _set_status(self, entry: _Presence, status: str, team_id: Optional[str]) -> bool:
+        """Move an entry between team/status sets; returns True if it changed"""
+        if entry.status == status and entry.team_id == team_id:
+            return False
+        self._team(entry.team_id)[entry.status].discard(entry.user_id)
+        entry.status = status
+        entry.team_id = team_id
+        self._team(team_id)[status].add(entry.user_id)
+        return True
+
+    def _apply(self, user_id: str, team_id: Optional[str], status: str, now: float) -> Tuple[_Presence, bool]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            entry = self._entries[user_id] = _Presence(user_id, team_id)
+            self._team(team_id)[OFFLINE].add(user_id)
+
+        entry.last_seen = now
+        changed = self._set_status(entry, status, team_id)
+        if status == OFFLINE:
+            self._wheel.cancel(user_id)
+        else:
+            self._wheel.schedule(user_id, now + self.timeout)
+        if changed:
+            self._on_change(entry)
+        return entry, changed
+
+    def heartbeat(self, user_id: str, team_id: Optional[str] = None, status: str = ONLINE,
+                  now: Optional[float] = None) -> bool:
+        """Record a heartbeat; returns True when the agent's status changed"""
+        now = now or time.time()
+        entry, changed = self._apply(user_id, team_id, status, now)
+        if changed or now - entry.persisted_at >= PRESENCE_PERSIST_STALENESS:
+            self._dirty.add(user_id)
+        if changed:
+            self._seen.pop(user_id, None)
+            self._share("change", [(user_id, team_id, status, now)])
+        else:
+            self._seen[user_id] = (team_id, status, now)
+        return changed
+
+    def _share(self, event_type: str, heartbeats: List[tuple]):
+        if message_bus.backend != "mongo" or not heartbeats:
+            return
+        message_bus.publish(PRESENCE_TOPIC, event_type, {
+            'worker': message_bus.worker_id,
+            'heartbeats': [list(heartbeat) for heartbeat in heartbeats]
+        })
+
+    def share_seen(self):
+        """Publish the unchanged heartbeats received since the last digest"""
+        seen, self._seen = self._seen, {}
+        self._share("digest", [(user_id, *heartbeat) for user_id, heartbeat in seen.items()])
+
+    def receive(self, data: dict) -> List[Optional[str]]:
+        """Apply heartbeats shared by another worker; returns the teams that
+        gained an online agent"""
+        teams = []
+        for user_id, team_id, status, sent_at in data['heartbeats']:
+            entry = self._entries.get(user_id)
+            # A digest can arrive after a newer change sent by another worker
+            if entry and sent_at < entry.last_seen:
+                continue
+            _, changed = self._apply(user_id, team_id, status, sent_at)
+            if changed and status == ONLINE:
+                teams.append(team_id)
+        return teams
+
+    def forget(self, user_id: str):
+        """Drop an agent (deleted user)"""
+        entry = self._entries.pop(user_id, None)
+        if entry:
+            self._team(entry.team_id)[entry.status].discard(user_id)
+            self._wheel.cancel(user_id)
+            self._dirty.discard(user_id)
+            self._seen.pop(user_id, None)
+
+    def set_team(self, user_id: str, team_id: Optional[str]):
+        """Follow an agent moving to another team"""
+        entry = self._entries.get(user_id)
+        if entry and self._set_status(entry, entry.status, team_id):
+            self._dirty.add(user_id)
+
+    def status(self, user_id: str) -> str:
+        entry = self._entries.get(user_id)
+        return entry.status if entry else OFFLINE
+
+    def is_online(self, user_id: str) -> bool:
+        return self.status(user_id) == ONLINE
+
+    def team_counts(self, team_id: Optional[str]) -> Dict[str, int]:
+        """Number of tracked agents per status in a team, in O(1)"""
+        team = self._teams.get(team_id)
+        if team is None:
+            return {status: 0 for status in STATUSES}
+        return {status: len(members) for status, members in team.items()}
+
+    def team_members(self, team_id: Optional[str]) -> Dict[str, Set[str]]:
+        """User ids per status in a team"""
+        team = self._teams.get(team_id)
+        if team is None:
+            return {status: set() for status in STATUSES}
+        return {status: set(members) for status, members in team.items()}
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Mark agents whose heartbeats stopped as offline"""
+        expired = 0
+        for user_id in self._wheel.advance(now or time.time()):
+            entry = self._entries.get(user_id)
+            if entry and self._set_status(entry, OFFLINE, entry.team_id):
+                self._dirty.add(user_id)
+                self._on_change(entry)
+                expired += 1
+        return expired
+
+    def _on_change(self, entry: _Presence):
+        """Keep routing availability in line with presence"""
+        from routing import routing_engine
+        routing_engine.set_available(entry.user_id, entry.status == ONLINE)
+
+    def drain_dirty(self, now: Optional[float] = None) -> list:
+        """Collect pending changes for persistence"""
+        now = now or time.time()
+        changes = []
+        for user_id in self._dirty:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                continue
+            entry.persisted_at = now
+            changes.append({
+                'user_id': entry.user_id,
+                'team_id': entry.team_id,
+                'status': entry.status,
+                'last_seen': datetime.fromtimestamp(entry.last_seen, timezone.utc)
+            })
+        self._dirty.clear()
+        return changes
+
+    async def load(self):
+        """Restore last known presence, expiring entries that went stale"""
+        from database import get_presence
+
+        now = time.time()
+        for record in await get_presence():
+            last_seen = record['last_seen']
+            if last_seen.tzinfo is None:
+                last_seen = last_seen.replace(tzinfo=timezone.utc)
+            last_seen = last_seen.timestamp()
+            status = record['status'] if now - last_seen < self.timeout else OFFLINE
+            entry = self._entries[record['user_id']] = _Presence(record['user_id'], record.get('team_id'))
+            entry.last_seen = last_seen
+            entry.persisted_at = last_seen
+            entry.status = status
+            self._team(entry.team_id)[status].add(entry.user_id)
+            if status != OFFLINE:
+                self._wheel.schedule(entry.user_id, last_seen + self.timeout)
+
+    async def flush(self):
+        """Persist coalesced changes in one bulk write"""
+        from database import save_presence
+
+        changes = self.drain_dirty()
+        if not changes:
+            return
+        try:
+            await save_presence(changes)
+        except Exception as e:
+            logger.error(f"Error persisting presence, will retry: {e}")
+            self._dirty.update(change['user_id'] for change in changes)
+
+    async def start(self):
+        await self.load()
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        if message_bus.backend == "mongo":
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._task:
+            # Not cancelled, so a flush in progress doesn't drop its changes
+            self._stop.set()
+            await self._task
+            self._task = None
+        self.share_seen()
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.flush_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            self.expire()
+            self.share_seen()
+            await self.flush()
+
+    async def _listen(self):
+        """Apply heartbeats received by the other workers"""
+        from routing import dispatch_team
+
+        subscription = message_bus.subscribe([PRESENCE_TOPIC])
+        try:
+            while True:
+                event = await subscription.get()
+                if event['data'].get('worker') == message_bus.worker_id:
+                    continue
+                try:
+                    for team_id in set(self.receive(event['data'])):
+                        await dispatch_team(team_id)
+                except Exception as e:
+                    logger.error(f"Error applying shared presence: {e}")
+        finally:
+            subscription.close()
+
+
+presence_service = PresenceService()
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from bus import message_bus
+
+logger = logging.getLogger(__name__)
+
+# Per client IP: bursts of LOGIN_IP_BURST attempts, refilled at LOGIN_IP_RATE/s
+LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST', 20))
+LOGIN_IP_RATE = float(os.environ.get('LOGIN_IP_RATE', 0.5))
+# Per account (email or username as typed)
+LOGIN_USER_BURST = int(os.environ.get('LOGIN_USER_BURST', 5))
+LOGIN_USER_RATE = float(os.environ.get('LOGIN_USER_RATE', 0.1))
+# Consecutive failures before backoff starts, doubling from the base delay.
+# IPs get a higher threshold since many users may share one (NAT, proxies)
+LOGIN_BACKOFF_AFTER = int(os.environ.get('LOGIN_BACKOFF_AFTER', 3))
+LOGIN_IP_BACKOFF_AFTER = int(os.environ.get('LOGIN_IP_BACKOFF_AFTER', 20))
+LOGIN_BACKOFF_BASE = float(os.environ.get('LOGIN_BACKOFF_BASE', 1))
+LOGIN_BACKOFF_MAX = float(os.environ.get('LOGIN_BACKOFF_MAX', 900))
+# Failures older than this no longer count
+LOGIN_FAILURE_WINDOW = float(os.environ.get('LOGIN_FAILURE_WINDOW', 900))
+# Share failure backoff between workers through MongoDB
+LOGIN_LIMIT_SHARED = os.environ.get('LOGIN_LIMIT_SHARED', 'false').lower() == 'true'
+# Lockout changes reach the other workers through the message bus; a key
+# read from MongoDB is trusted locally for this long
+LOGIN_TOPIC = "login"
+LOGIN_SHARED_CACHE_SECONDS = float(os.environ.get('LOGIN_SHARED_CACHE_SECONDS', 60))
+# Take the client IP from X-Forwarded-For (only behind a trusted proxy)
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', 'false').lower() == 'true'
+# Upper bound on tracked keys per table; least recently used are dropped
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100_000))
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class TokenBucketLimiter:
+    """Token buckets keyed by string, kept in a bounded LRU table"""
+
+    def __init__(self, capacity: int, rate: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """Take a token; returns 0 when allowed, else seconds until one is available"""
+        now = now or time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.capacity, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class _Failures:
+    __slots__ = ("count", "last", "blocked_until")
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.blocked_until = 0.0
+
+
+def backoff_delay(failures: int, after: int = LOGIN_BACKOFF_AFTER) -> float:
+    """Lockout after the given number of consecutive failures"""
+    if failures < after:
+        return 0.0
+    return min(LOGIN_BACKOFF_MAX, LOGIN_BACKOFF_BASE * 2 ** min(failures - after, 32))
+
+
+def client_ip(request) -> str:
+    """Address used for per-IP limits"""
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get('x-forwarded-for')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else 'unknown'
+
+
+class LoginGuard:
+    """Throttles login attempts before any password hashing happens.
+
+    Token buckets cap the attempt rate per IP and per login; consecutive
+    failures add an exponential lockout on both. Checks are a few dict
+    operations. With LOGIN_LIMIT_SHARED, lockouts are also written to the
+    `login_attempts` collection so every worker enforces them; buckets stay
+    per worker.
+
+    With the mongo bus backend, lockouts and clears are also published as
+    they happen and applied by the other workers, so a check only reads
+    MongoDB for a key this worker hasn't seen within
+    LOGIN_SHARED_CACHE_SECONDS. Without it, every check reads MongoDB.
+    """
+
+    def __init__(self, shared: bool = LOGIN_LIMIT_SHARED, cache_seconds: float = LOGIN_SHARED_CACHE_SECONDS):
+        self.shared = shared
+        self.cache_seconds = cache_seconds
+        self.by_ip = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_RATE)
+        self.by_login = TokenBucketLimiter(LOGIN_USER_BURST, LOGIN_USER_RATE)
+        self._failures: "OrderedDict[str, _Failures]" = OrderedDict()
+        # When each key's shared state was last read or received
+        self._synced: "OrderedDict[str, float]" = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def keys(ip: str, login: str):
+        return f"ip:{ip}", f"login:{login.strip().lower()}"
+
+    @staticmethod
+    def _threshold(key: str) -> int:
+        return LOGIN_IP_BACKOFF_AFTER if key.startswith("ip:") else LOGIN_BACKOFF_AFTER
+
+    def _blocked_for(self, key: str, now: float) -> float:
+        entry = self._failures.get(key)
+        if entry is None:
+            return 0.0
+        return max(0.0, entry.blocked_until - now)
+
+    def check_local(self, ip: str, login: str, now: Optional[float] = None) -> float:
+        """Seconds the caller must wait, 0 when the attempt may proceed"""
+        now = now or time.time()
+        ip_key, login_key = self.keys(ip, login)
+        wait = max(self._blocked_for(ip_key, now), self._blocked_for(login_key, now))
+        if wait:
+            return wait
+        monotonic = time.monotonic()
+        return max(self.by_ip.acquire(ip_key, monotonic), self.by_login.acquire(login_key, monotonic))
+
+    def _is_synced(self, key: str, now: float) -> bool:
+        if message_bus.backend != "mongo":
+            return False
+        synced = self._synced.get(key)
+        return synced is not None and now - synced < self.cache_seconds
+
+    def _mark_synced(self, key: str, now: float):
+        self._synced[key] = now
+        self._synced.move_to_end(key)
+        if len(self._synced) > RATE_LIMIT_MAX_KEYS:
+            self._synced.popitem(last=False)
+
+    def _entry(self, key: str) -> _Failures:
+        entry = self._failures.get(key)
+        if entry is None:
+            entry = self._failures[key] = _Failures()
+            if len(self._failures) > RATE_LIMIT_MAX_KEYS:
+                self._failures.popitem(last=False)
+        else:
+            self._failures.move_to_end(key)
+        return entry
+
+    async def check(self, ip: str, login: str) -> float:
+        wait = self.check_local(ip, login)
+        if wait or not self.shared:
+            return wait
+
+        now = time.time()
+        keys = [key for key in self.keys(ip, login) if not self._is_synced(key, now)]
+        if not keys:
+            return 0.0
+
+        from database import get_login_lockouts
+
+        try:
+            lockouts = await get_login_lockouts(keys)
+        except Exception as e:
+            logger.error(f"Error reading shared login lockout: {e}")
+            return 0.0
+        for key in keys:
+            self._mark_synced(key, now)
+        for key, blocked_until in lockouts.items():
+            if blocked_until.tzinfo is None:
+                blocked_until = blocked_until.replace(tzinfo=timezone.utc)
+            entry = self._entry(key)
+            entry.blocked_until = max(entry.blocked_until, blocked_until.timestamp())
+            wait = max(wait, entry.blocked_until - now)
+        return wait
+
+    def _record(self, key: str, now: float) -> _Failures:
+        entry = self._entry(key)
+        if now - entry.last > LOGIN_FAILURE_WINDOW:
+            entry.count = 0
+        entry.count += 1
+        entry.last = now
+        entry.blocked_until = now + backoff_delay(entry.count, self._threshold(key))
+        return entry
+
+    def _share(self, event_type: str, data: dict):
+        if message_bus.backend != "mongo":
+            return
+        message_bus.publish(LOGIN_TOPIC, event_type, {'worker': message_bus.worker_id, **data})
+
+    async def failure(self, ip: str, login: str):
+        now = time.time()
+        keys = self.keys(ip, login)
+        for key in keys:
+            self._record(key, now)
+        if not self.shared:
+            return
+
+        from database import record_login_failure, set_login_lockout
+
+        try:
+            for key in keys:
+                count = await record_login_failure(key, LOGIN_FAILURE_WINDOW)
+                entry = self._failures.get(key)
+                if entry is None:
+                    continue
+                # Other workers may have seen failures this one did not
+                entry.count = max(entry.count, count)
+                entry.blocked_until = max(entry.blocked_until, now + backoff_delay(entry.count, self._threshold(key)))
+                self._mark_synced(key, now)
+                if entry.blocked_until > now:
+                    await set_login_lockout(key, datetime.fromtimestamp(entry.blocked_until, timezone.utc))
+                    self._share("lockout", {'key': key, 'count': entry.count, 'blocked_until': entry.blocked_until})
+        except Exception as e:
+            logger.error(f"Error sharing login failure: {e}")
+
+    async def success(self, ip: str, login: str):
+        """A correct password clears the account's failures (not the IP's)"""
+        _, login_key = self.keys(ip, login)
+        self._failures.pop(login_key, None)
+        if not self.shared:
+            return
+
+        from database import clear_login_failures
+
+        try:
+            await clear_login_failures(login_key)
+            self._mark_synced(login_key, time.time())
+            self._share("clear", {'key': login_key})
+        except Exception as e:
+            logger.error(f"Error clearing shared login failures: {e}")
+
+    def receive(self, event: dict):
+        """Apply a lockout or clear shared by another worker"""
+        data = event['data']
+        now = time.time()
+        if event['type'] == "lockout":
+            entry = self._entry(data['key'])
+            entry.count = max(entry.count, data['count'])
+            entry.last = max(entry.last, now)
+            entry.blocked_until = max(entry.blocked_until, data['blocked_until'])
+        elif event['type'] == "clear":
+            self._failures.pop(data['key'], None)
+        self._mark_synced(data['key'], now)
+
+    async def start(self):
+        if self.shared and message_bus.backend == "mongo":
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        """Apply lockouts set by the other workers"""
+        subscription = message_bus.subscribe([LOGIN_TOPIC])
+        try:
+            while True:
+                event = await subscription.get()
+                if event['data'].get('worker') == message_bus.worker_id:
+                    continue
+                try:
+                    self.receive(event)
+                except Exception as e:
+                    logger.error(f"Error applying shared login lockout: {e}")
+        finally:
+            subscription.close()
+
+
+login_guard = LoginGuard()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from timers import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', 500))
+REAPER_RETRY_SECONDS = 5
+# Closes older than this whose finish message is still pending are retried
+REAPER_RECOVERY_SECONDS = int(os.environ.get('REAPER_RECOVERY_SECONDS', 60))
+
+
+def _timestamp(value: datetime) -> float:
+    """Unix timestamp of a datetime stored by MongoDB (naive UTC)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class SessionReaper:
+    """Closes idle conversations when their session timeout elapses.
+
+    Deadlines live in a per-worker timer wheel rebuilt from the
+    `conversations.expires_at` index on startup; the database remains the
+    source of truth, so closing is conditional on the stored deadline.
+    """
+
+    def __init__(self, batch_size: int = REAPER_BATCH_SIZE, interval: float = 1.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.wheel = TimerWheel(tick=interval, now=time.time())
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, conversation_id: str, expires_at: Optional[datetime]):
+        """Schedule (or push back) a conversation's expiry"""
+        if expires_at is None:
+            self.wheel.cancel(conversation_id)
+            return
+        self.wheel.schedule(conversation_id, _timestamp(expires_at))
+
+    def cancel(self, conversation_id: str):
+        """Stop tracking a conversation that was closed by other means"""
+        self.wheel.cancel(conversation_id)
+
+    async def rebuild(self):
+        """Schedule every open conversation from the database"""
+        from database import get_expiring_conversations
+
+        self.wheel = TimerWheel(tick=self.interval, now=time.time())
+        conversations = await get_expiring_conversations()
+        for conversation in conversations:
+            self.touch(conversation['id'], conversation['expires_at'])
+        logger.info(f"Session reaper tracking {len(conversations)} conversations")
+
+    async def start(self):
+        await self.rebuild()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        recover_at = 0.0
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.time()
+            expired = self.wheel.advance(now)
+            for i in range(0, len(expired), self.batch_size):
+                await self._fire(expired[i:i + self.batch_size])
+            if now >= recover_at:
+                recover_at = now + REAPER_RECOVERY_SECONDS
+                await self._recover()
+
+    async def _recover(self):
+        """Finish conversations a failed or interrupted batch left closed
+        without their finish message"""
+        from database import finish_expired_conversations
+
+        before = datetime.now(timezone.utc) - timedelta(seconds=REAPER_RECOVERY_SECONDS)
+        try:
+            closed = await finish_expired_conversations(before)
+        except Exception as e:
+            logger.error(f"Error recovering expired conversations: {e}")
+            return
+        await self._closed(closed)
+        if closed:
+            logger.info(f"Session reaper finished {len(closed)} conversations closed by an earlier batch")
+
+    async def _fire(self, conversation_ids: List[str]):
+        from database import expire_conversations
+
+        try:
+            closed = await expire_conversations(conversation_ids)
+        except Exception as e:
+            logger.error(f"Error expiring {len(conversation_ids)} conversations, retrying: {e}")
+            retry_at = time.time() + REAPER_RETRY_SECONDS
+            for conversation_id in conversation_ids:
+                if conversation_id not in self.wheel:
+                    self.wheel.schedule(conversation_id, retry_at)
+            return
+
+        await self._closed(closed)
+        if closed:
+            logger.info(f"Session reaper closed {len(closed)} idle conversations")
+
+    async def _closed(self, closed: List[dict]):
+        """Announce closed conversations and free their agents"""
+        from routing import cancel_conversation, release_agent, dispatch_team
+        from bus import message_bus, conversation_topic
+
+        teams = set()
+        for conversation in closed:
+            message_bus.publish(conversation_topic(conversation['id']), "status", {"status": "closed"})
+            if conversation['status'] == 'waiting':
+                cancel_conversation(conversation['id'])
+            elif conversation['assignee_id']:
+                release_agent(conversation['assignee_id'])
+                teams.add(conversation['team_id'])
+
+        for team_id in teams:
+            await dispatch_team(team_id)
+
+
+session_reaper = SessionReaper()
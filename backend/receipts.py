@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from bus import message_bus, conversation_topic
+
+logger = logging.getLogger(__name__)
+
+# A participant's typing event goes out at most once per this many seconds;
+# clients show the indicator for a little longer than that
+TYPING_DEBOUNCE = float(os.environ.get('TYPING_DEBOUNCE', 2))
+# Read watermarks reach MongoDB this often
+RECEIPTS_FLUSH_INTERVAL = float(os.environ.get('RECEIPTS_FLUSH_INTERVAL', 2))
+# Conversations whose watermarks are remembered per worker
+RECEIPTS_MAX = int(os.environ.get('RECEIPTS_MAX', 100_000))
+# An open conversation's last sequence is reused for this long; a receipt
+# beyond it reads the conversation again
+RECEIPTS_LIMIT_TTL = float(os.environ.get('RECEIPTS_LIMIT_TTL', 2))
+
+ReceiptKey = Tuple[str, str]
+
+
+class ReceiptTracker:
+    """Typing, delivered and read events of conversations.
+
+    None of these are stored per event. Typing is throttled per
+    conversation and participant; delivered and read receipts are only
+    published when they advance that participant's watermark. The highest
+    read sequence is written with $max every RECEIPTS_FLUSH_INTERVAL, so a
+    burst of receipts costs one update per conversation at most.
+
+    Receipts are only accepted for open conversations and capped at their
+    last sequence. That lookup is cached for RECEIPTS_LIMIT_TTL, so a
+    conversation costs one read per window rather than one per request.
+    """
+
+    def __init__(self, debounce: float = TYPING_DEBOUNCE, flush_interval: float = RECEIPTS_FLUSH_INTERVAL,
+                 max_entries: int = RECEIPTS_MAX, limit_ttl: float = RECEIPTS_LIMIT_TTL):
+        self.debounce = debounce
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.limit_ttl = limit_ttl
+        self._typing: Dict[ReceiptKey, float] = {}
+        # conversation -> (last message sequence, when it was read)
+        self._limits: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        # (conversation, participant) -> [delivered watermark, read watermark]
+        self._watermarks: "OrderedDict[ReceiptKey, list]" = OrderedDict()
+        self._dirty: Dict[ReceiptKey, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self.received = {"typing": 0, "delivered": 0, "read": 0}
+        self.published = {"typing": 0, "delivered": 0, "read": 0}
+        self.persisted = 0
+        self.lookups = 0
+
+    async def limit(self, conversation_id: str, seq: int = 0, now: Optional[float] = None) -> Optional[int]:
+        """Last sequence of an open conversation, None if it isn't open.
+
+        A cached value is used while it is fresh and covers `seq`, so a
+        receipt for a message newer than the cache reads it again.
+        """
+        from database import get_open_message_seq
+
+        now = now or time.time()
+        cached = self._limits.get(conversation_id)
+        if cached is not None and now - cached[1] < self.limit_ttl and seq <= cached[0]:
+            return cached[0]
+        self.lookups += 1
+        message_seq = await get_open_message_seq(conversation_id)
+        if message_seq is None:
+            self._limits.pop(conversation_id, None)
+            return None
+        self._limits[conversation_id] = (message_seq, now)
+        self._limits.move_to_end(conversation_id)
+        if len(self._limits) > self.max_entries:
+            self._limits.popitem(last=False)
+        return message_seq
+
+    def claim_typing(self, conversation_id: str, participant: str, now: Optional[float] = None) -> bool:
+        """Take the typing slot unless an event went out within the debounce window.
+
+        Claimed before the conversation is looked up, so debounced
+        keystrokes cost nothing but this check.
+        """
+        now = now or time.time()
+        key = (conversation_id, participant)
+        self.received["typing"] += 1
+        if now - self._typing.get(key, 0.0) < self.debounce:
+            return False
+        self._typing[key] = now
+        return True
+
+    def typing(self, conversation_id: str, participant: str, now: Optional[float] = None) -> bool:
+        """Publish a typing event unless one went out within the debounce window"""
+        if not self.claim_typing(conversation_id, participant, now):
+            return False
+        self.publish_typing(conversation_id, participant)
+        return True
+
+    def publish_typing(self, conversation_id: str, participant: str):
+        self._publish(conversation_id, "typing", {"participant": participant})
+
+    def _watermark(self, key: ReceiptKey) -> list:
+        watermark = self._watermarks.get(key)
+        if watermark is None:
+            watermark = self._watermarks[key] = [0, 0]
+            if len(self._watermarks) > self.max_entries:
+                self._watermarks.popitem(last=False)
+        else:
+            self._watermarks.move_to_end(key)
+        return watermark
+
+    def delivered(self, conversation_id: str, participant: str, seq: int) -> bool:
+        """Publish a delivered receipt if it advances the watermark"""
+        self.received["delivered"] += 1
+        watermark = self._watermark((conversation_id, participant))
+        if seq <= watermark[0]:
+            return False
+        watermark[0] = seq
+        self._publish(conversation_id, "delivered", {"participant": participant, "seq": seq})
+        return True
+
+    def read(self, conversation_id: str, participant: str, seq: int) -> bool:
+        """Publish a read receipt if it advances the watermark; reading implies delivery"""
+        self.received["read"] += 1
+        key = (conversation_id, participant)
+        watermark = self._watermark(key)
+        if seq <= watermark[1]:
+            return False
+        watermark[0] = max(watermark[0], seq)
+        watermark[1] = seq
+        self._dirty[key] = seq
+        self._publish(conversation_id, "read", {"participant": participant, "seq": seq})
+        return True
+
+    def _publish(self, conversation_id: str, event_type: str, data: dict):
+        self.published[event_type] += 1
+        message_bus.publish(conversation_topic(conversation_id), event_type, data)
+
+    async def flush(self):
+        from database import save_read_watermarks
+
+        dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        try:
+            await save_read_watermarks(dirty)
+            self.persisted += len(dirty)
+        except Exception as e:
+            logger.error(f"Error persisting read receipts, will retry: {e}")
+            for key, seq in dirty.items():
+                self._dirty[key] = max(seq, self._dirty.get(key, 0))
+
+    def _prune(self, now: float):
+        stale = [key for key, sent_at in self._typing.items() if now - sent_at >= self.debounce]
+        for key in stale:
+            del self._typing[key]
+        while self._limits:
+            conversation_id, (_, read_at) = next(iter(self._limits.items()))
+            if now - read_at < self.limit_ttl:
+                break
+            del self._limits[conversation_id]
+
+    async def start(self):
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            # Not cancelled: a flush in progress has already taken the
+            # pending entries and would drop them
+            self._stop.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.flush_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            self._prune(time.time())
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'received': dict(self.received),
+            'published': dict(self.published),
+            'tracked': len(self._watermarks),
+            'dirty': len(self._dirty),
+            'persisted': self.persisted,
+            'lookups': self.lookups
+        }
+
+
+receipts = ReceiptTracker()
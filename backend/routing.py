@@ -0,0 +1,474 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from bus import message_bus
+from presence import presence_service
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN = "round_robin"
+LEAST_LOADED = "least_loaded"
+
+DEFAULT_AGENT_CAPACITY = int(os.environ.get('AGENT_MAX_CONVERSATIONS', 5))
+DEFAULT_ROUTING_POLICY = os.environ.get('ROUTING_POLICY', LEAST_LOADED)
+# Queue and load changes reach the other workers through the message bus
+ROUTING_TOPIC = "routing"
+# Every worker reloads queues and loads from MongoDB this often, so changes
+# missed while it was starting up don't linger
+ROUTING_RESYNC_INTERVAL = int(os.environ.get('ROUTING_RESYNC_INTERVAL', 300))
+
+
+class _AgentState:
+    """Capacity counter for a single agent"""
+    __slots__ = ("agent_id", "team_id", "capacity", "load", "available", "version")
+
+    def __init__(self, agent_id: str, team_id: Optional[str], capacity: int, load: int = 0):
+        self.agent_id = agent_id
+        self.team_id = team_id
+        self.capacity = capacity
+        self.load = load
+        self.available = True
+        self.version = 0
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.available and self.load < self.capacity
+
+
+class _TeamQueue:
+    """Waiting conversations and agent pool of a single team.
+
+    Both the waiting heap and the agent structures use lazy deletion: stale
+    entries are skipped when they reach the top instead of being searched for.
+    """
+
+    def __init__(self):
+        self.waiting: List[Tuple[int, int, str]] = []
+        self.waiting_ids: Dict[str, Tuple[int, int]] = {}
+        self.load_heap: List[Tuple[int, int, str, int]] = []
+        self.rotation: deque = deque()
+        self.in_rotation: set = set()
+
+    def __len__(self):
+        return len(self.waiting_ids)
+
+
+class RoutingEngine:
+    """In-memory assignment of waiting conversations to agents.
+
+    Keeps one priority queue of waiting conversations per team and one
+    capacity counter per agent. Assignment is O(log n) for the least-loaded
+    policy and amortized O(1) for round-robin.
+    """
+
+    def __init__(self, policy: str = DEFAULT_ROUTING_POLICY, default_capacity: int = DEFAULT_AGENT_CAPACITY):
+        if policy not in (ROUND_ROBIN, LEAST_LOADED):
+            raise ValueError(f"Política de roteamento inválida: {policy}")
+        self.policy = policy
+        self.default_capacity = default_capacity
+        self._teams: Dict[Optional[str], _TeamQueue] = {}
+        self._agents: Dict[str, _AgentState] = {}
+        self._conversation_team: Dict[str, Optional[str]] = {}
+        self._full: Dict[Optional[str], set] = {}
+        self._seq = itertools.count()
+
+    def _team(self, team_id: Optional[str]) -> _TeamQueue:
+        queue = self._teams.get(team_id)
+        if queue is None:
+            queue = self._teams[team_id] = _TeamQueue()
+        return queue
+
+    def clear(self):
+        """Drop all queues and agents (used before a rebuild)"""
+        self._teams.clear()
+        self._agents.clear()
+        self._conversation_team.clear()
+        self._full.clear()
+
+    # Agents
+    def _track_capacity(self, agent: _AgentState):
+        """Keep the per-team set of agents at capacity current"""
+        full = self._full.setdefault(agent.team_id, set())
+        if agent.load >= agent.capacity and agent.agent_id in self._agents:
+            full.add(agent.agent_id)
+        else:
+            full.discard(agent.agent_id)
+
+    def _offer(self, agent: _AgentState):
+        """Make an agent visible to its team's policy structure"""
+        if not agent.has_capacity:
+            return
+        team = self._team(agent.team_id)
+        if self.policy == LEAST_LOADED:
+            agent.version = next(self._seq)
+            heapq.heappush(team.load_heap, (agent.load, agent.version, agent.agent_id, agent.version))
+        elif agent.agent_id not in team.in_rotation:
+            team.rotation.append(agent.agent_id)
+            team.in_rotation.add(agent.agent_id)
+
+    def add_agent(self, agent_id: str, team_id: Optional[str] = None,
+                  capacity: Optional[int] = None, load: int = 0, available: bool = True):
+        """Register (or re-register) an agent with its current load"""
+        self.remove_agent(agent_id)
+        agent = _AgentState(agent_id, team_id, capacity or self.default_capacity, load)
+        agent.available = available
+        self._agents[agent_id] = agent
+        self._track_capacity(agent)
+        self._offer(agent)
+
+    def remove_agent(self, agent_id: str):
+        """Forget an agent; its stale queue entries are skipped lazily"""
+        agent = self._agents.pop(agent_id, None)
+        if agent:
+            agent.available = False
+            self._track_capacity(agent)
+
+    def set_available(self, agent_id: str, available: bool):
+        """Toggle whether an agent may receive new conversations"""
+        agent = self._agents.get(agent_id)
+        if not agent or agent.available == available:
+            return
+        agent.available = available
+        self._offer(agent)
+
+    def release(self, agent_id: str):
+        """Free one unit of capacity after a conversation ends"""
+        agent = self._agents.get(agent_id)
+        if not agent:
+            return
+        agent.load = max(0, agent.load - 1)
+        self._track_capacity(agent)
+        self._offer(agent)
+
+    def agent_load(self, agent_id: str) -> Optional[Tuple[int, int]]:
+        """Return (load, capacity) for an agent"""
+        agent = self._agents.get(agent_id)
+        return (agent.load, agent.capacity) if agent else None
+
+    def agent_team(self, agent_id: str) -> Optional[str]:
+        """Team an agent routes for"""
+        agent = self._agents.get(agent_id)
+        return agent.team_id if agent else None
+
+    def is_registered(self, agent_id: str) -> bool:
+        return agent_id in self._agents
+
+    # Conversations
+    def enqueue(self, conversation_id: str, team_id: Optional[str] = None, priority: int = 0):
+        """Put a conversation in its team's waiting queue"""
+        if conversation_id in self._conversation_team:
+            return
+        team = self._team(team_id)
+        key = (-priority, next(self._seq))
+        heapq.heappush(team.waiting, (key[0], key[1], conversation_id))
+        team.waiting_ids[conversation_id] = key
+        self._conversation_team[conversation_id] = team_id
+
+    def cancel(self, conversation_id: str) -> bool:
+        """Remove a conversation from its queue (e.g. visitor left)"""
+        if conversation_id not in self._conversation_team:
+            return False
+        team_id = self._conversation_team.pop(conversation_id)
+        self._teams[team_id].waiting_ids.pop(conversation_id, None)
+        return True
+
+    def _peek_conversation(self, team: _TeamQueue) -> Optional[str]:
+        while team.waiting:
+            neg_priority, seq, conversation_id = team.waiting[0]
+            if team.waiting_ids.get(conversation_id) == (neg_priority, seq):
+                return conversation_id
+            heapq.heappop(team.waiting)
+        return None
+
+    def _pick_agent(self, team_id: Optional[str], team: _TeamQueue) -> Optional[_AgentState]:
+        if self.policy == LEAST_LOADED:
+            while team.load_heap:
+                _, _, agent_id, version = heapq.heappop(team.load_heap)
+                agent = self._agents.get(agent_id)
+                if agent and agent.version == version and agent.team_id == team_id and agent.has_capacity:
+                    return agent
+            return None
+
+        while team.rotation:
+            agent_id = team.rotation.popleft()
+            team.in_rotation.discard(agent_id)
+            agent = self._agents.get(agent_id)
+            if agent and agent.team_id == team_id and agent.has_capacity:
+                return agent
+        return None
+
+    def assign_next(self, team_id: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """Pop the next waiting conversation of a team and pick an agent for it.
+
+        Returns (conversation_id, agent_id) or None when either the queue is
+        empty or every agent of the team is at capacity.
+        """
+        team = self._teams.get(team_id)
+        if team is None:
+            return None
+        conversation_id = self._peek_conversation(team)
+        if conversation_id is None:
+            return None
+        agent = self._pick_agent(team_id, team)
+        if agent is None:
+            return None
+
+        heapq.heappop(team.waiting)
+        del team.waiting_ids[conversation_id]
+        del self._conversation_team[conversation_id]
+
+        agent.load += 1
+        self._track_capacity(agent)
+        self._offer(agent)
+        return conversation_id, agent.agent_id
+
+    def assigned(self, conversation_id: str, agent_id: str):
+        """Apply an assignment made by another worker"""
+        self.cancel(conversation_id)
+        agent = self._agents.get(agent_id)
+        if not agent:
+            return
+        agent.load += 1
+        self._track_capacity(agent)
+        self._offer(agent)
+
+    def at_capacity(self, team_id: Optional[str] = None) -> set:
+        """Agents of a team that cannot take more conversations"""
+        return self._full.get(team_id, set())
+
+    def queue_length(self, team_id: Optional[str] = None) -> int:
+        """Number of conversations waiting for a team"""
+        team = self._teams.get(team_id)
+        return len(team) if team else 0
+
+    def has_available_agent(self, team_id: Optional[str] = None) -> bool:
+        """Whether any agent of the team can take a conversation right now"""
+        return any(
+            agent.has_capacity for agent in self._agents.values() if agent.team_id == team_id
+        )
+
+    def stats(self) -> dict:
+        """Snapshot of queue sizes and agent loads"""
+        teams = {}
+        for team_id, team in self._teams.items():
+            teams[team_id or ''] = {'waiting': len(team)}
+        for agent in self._agents.values():
+            entry = teams.setdefault(agent.team_id or '', {'waiting': 0})
+            entry['agents'] = entry.get('agents', 0) + 1
+            entry['load'] = entry.get('load', 0) + agent.load
+            entry['capacity'] = entry.get('capacity', 0) + (agent.capacity if agent.available else 0)
+        return {
+            'policy': self.policy,
+            'agents': len(self._agents),
+            'waiting': len(self._conversation_team),
+            'teams': teams
+        }
+
+
+routing_engine = RoutingEngine()
+
+
+def _share(event_type: str, data: dict):
+    if message_bus.backend != "mongo":
+        return
+    message_bus.publish(ROUTING_TOPIC, event_type, {'worker': message_bus.worker_id, **data})
+
+
+def _apply_agent(agent: dict):
+    if not agent.get('is_active', True):
+        routing_engine.remove_agent(agent['id'])
+        presence_service.forget(agent['id'])
+        return
+    current = routing_engine.agent_load(agent['id'])
+    routing_engine.add_agent(
+        agent['id'],
+        team_id=agent.get('team_id'),
+        capacity=agent.get('max_conversations'),
+        load=current[0] if current else 0,
+        available=presence_service.is_online(agent['id'])
+    )
+    presence_service.set_team(agent['id'], agent.get('team_id'))
+
+
+def sync_agent(agent: dict):
+    """Mirror an agent create/update into the engine, keeping its current load"""
+    _apply_agent(agent)
+    _share("agent", {'agent': {
+        'id': agent['id'],
+        'team_id': agent.get('team_id'),
+        'max_conversations': agent.get('max_conversations'),
+        'is_active': agent.get('is_active', True)
+    }})
+
+
+def remove_agent(agent_id: str):
+    """Stop routing to a deleted agent"""
+    routing_engine.remove_agent(agent_id)
+    presence_service.forget(agent_id)
+    _share("remove_agent", {'agent_id': agent_id})
+
+
+def enqueue_conversation(conversation_id: str, team_id: Optional[str] = None, priority: int = 0):
+    """Queue a new conversation on every worker"""
+    routing_engine.enqueue(conversation_id, team_id=team_id, priority=priority)
+    _share("enqueue", {'conversation_id': conversation_id, 'team_id': team_id, 'priority': priority})
+
+
+def cancel_conversation(conversation_id: str):
+    """Drop a conversation that stopped waiting from every worker's queue"""
+    routing_engine.cancel(conversation_id)
+    _share("cancel", {'conversation_id': conversation_id})
+
+
+def release_agent(agent_id: str):
+    """Free one unit of an agent's capacity on every worker"""
+    routing_engine.release(agent_id)
+    _share("release", {'agent_id': agent_id})
+
+
+def receive(event: dict):
+    """Apply a routing change shared by another worker"""
+    data = event['data']
+    if event['type'] == "enqueue":
+        routing_engine.enqueue(data['conversation_id'], team_id=data['team_id'], priority=data['priority'])
+    elif event['type'] == "cancel":
+        routing_engine.cancel(data['conversation_id'])
+    elif event['type'] == "assign":
+        routing_engine.assigned(data['conversation_id'], data['agent_id'])
+    elif event['type'] == "release":
+        routing_engine.release(data['agent_id'])
+    elif event['type'] == "agent":
+        _apply_agent(data['agent'])
+    elif event['type'] == "remove_agent":
+        routing_engine.remove_agent(data['agent_id'])
+        presence_service.forget(data['agent_id'])
+
+
+async def rebuild_routing():
+    """Rebuild queues and agent counters from MongoDB (worker startup)"""
+    from database import get_routing_snapshot
+
+    snapshot = await get_routing_snapshot()
+    routing_engine.clear()
+
+    for agent in snapshot['agents']:
+        routing_engine.add_agent(
+            agent['id'],
+            team_id=agent.get('team_id'),
+            capacity=agent.get('max_conversations'),
+            load=snapshot['loads'].get(agent['id'], 0),
+            available=presence_service.is_online(agent['id'])
+        )
+
+    for conversation in snapshot['waiting']:
+        routing_engine.enqueue(
+            conversation['id'],
+            team_id=conversation.get('team_id'),
+            priority=conversation.get('priority', 0)
+        )
+
+    logger.info(
+        f"Routing rebuilt: {len(snapshot['agents'])} agents, {len(snapshot['waiting'])} waiting conversations"
+    )
+
+    for team_id in {c.get('team_id') for c in snapshot['waiting']}:
+        await dispatch_team(team_id)
+
+
+async def dispatch_team(team_id: Optional[str]) -> List[Tuple[str, str]]:
+    """Assign as many waiting conversations of a team as capacity allows.
+
+    The database write is conditional on the conversation still waiting, so
+    two workers racing for the same conversation cannot both assign it.
+    """
+    from database import assign_conversation
+    from bus import conversation_topic
+
+    assigned = []
+    while True:
+        pair = routing_engine.assign_next(team_id)
+        if pair is None:
+            break
+        conversation_id, agent_id = pair
+        if await assign_conversation(conversation_id, agent_id):
+            assigned.append(pair)
+            _share("assign", {'conversation_id': conversation_id, 'agent_id': agent_id})
+            message_bus.publish(conversation_topic(conversation_id), "status",
+                                {"status": "active", "assignee_id": agent_id})
+        else:
+            routing_engine.release(agent_id)
+    return assigned
+
+
+class RoutingSync:
+    """Keeps the per-worker routing engine in step with the other workers.
+
+    Each worker assigns from its own engine. With the mongo bus backend,
+    queue and load changes are published as they happen and applied by
+    the other workers, and every worker reloads from MongoDB once per
+    resync interval. Assignment stays conditional in the database, so a
+    worker acting on a change it hasn't seen yet loses the race instead
+    of double-assigning.
+    """
+
+    def __init__(self, resync_interval: float = ROUTING_RESYNC_INTERVAL):
+        self.resync_interval = resync_interval
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if message_bus.backend == "mongo":
+            # Subscribed before the rebuild, so no change falls in between
+            subscription = message_bus.subscribe([ROUTING_TOPIC])
+            self._listener = asyncio.create_task(self._listen(subscription))
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        await rebuild_routing()
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._task:
+            self._stop.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.resync_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await rebuild_routing()
+            except Exception as e:
+                logger.error(f"Error resyncing routing: {e}")
+
+    async def _listen(self, subscription):
+        """Apply routing changes made by the other workers"""
+        try:
+            while True:
+                event = await subscription.get()
+                if event['data'].get('worker') == message_bus.worker_id:
+                    continue
+                try:
+                    receive(event)
+                except Exception as e:
+                    logger.error(f"Error applying shared routing change: {e}")
+        finally:
+            subscription.close()
+
+
+routing_sync = RoutingSync()
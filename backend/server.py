@@ -1,30 +1,72 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
 import logging
+import math
 from pathlib import Path
 from typing import List, Optional
+from pydantic import ValidationError
 
 from database import (
-    connect_to_mongodb, close_mongodb_connection, get_user_by_login, 
-    verify_password, get_agents, create_agent, update_agent, 
+    connect_to_mongodb, close_mongodb_connection, init_database,
+    get_agents, create_agent, update_agent, 
     delete_agent, delete_agents_bulk,
     get_admins, create_admin, update_admin, delete_admin, delete_admins_bulk,
     get_channels, get_channel_by_id, create_channel, update_channel, delete_channel, delete_channels_bulk,
-    get_flows, get_flow_by_id, create_flow, update_flow, delete_flow, delete_flows_bulk,
-    duplicate_flow, export_flow, import_flow,
-    get_teams, get_team_by_id, create_team, update_team, delete_team, delete_teams_bulk
+    get_flows, get_flow_by_id, create_flow, update_flow, patch_flow, delete_flow, delete_flows_bulk,
+    RevisionConflictError, get_flow_revisions, restore_flow_revision, diff_flow_revisions,
+    duplicate_flow, export_flow, import_flow, iter_flow_exports, import_flows_bulk,
+    get_teams, get_team_by_id, create_team, update_team, delete_team, delete_teams_bulk,
+    get_canned_replies, get_canned_reply_by_id, create_canned_reply, update_canned_reply,
+    delete_canned_reply, delete_canned_replies_bulk,
+    get_dashboard_summary, get_metric_rollups, iter_conversation_batches, get_user_names,
+    get_inbox, get_inbox_changes,
+    create_conversation, get_conversation_by_id, close_conversation,
+    add_message, get_messages,
+    get_media_by_id, save_media
 )
-from auth import create_access_token, verify_token
+from routing import (
+    routing_engine, routing_sync, dispatch_team, sync_agent, remove_agent,
+    enqueue_conversation, cancel_conversation, release_agent
+)
+from reaper import session_reaper
+from presence import presence_service, HEARTBEAT_INTERVAL
+from flow_archive import write_archive, read_archive
+from ratelimit import login_guard, client_ip
+from login_shield import login_shield
+from user_cache import user_profiles
+from channel_cache import channel_flows
+from count_cache import list_counts
+from metrics import conversation_metrics, bucket_start, choose_granularity, summarize, GRANULARITIES
+from exports import (
+    EXPORT_COLUMNS, EXPORT_FORMATS, parquet_available, conversation_frames, agent_frames, write_export
+)
+from bus import message_bus, conversation_topic, sse_stream
+from write_buffer import message_writes
+from receipts import receipts
+from canned_replies import canned_replies, CANNED_REPLY_SEARCH_LIMIT
+from media import media_store, receive_upload, media_response, MediaTooLarge
+from startup import startup
+from auth import create_access_token, verify_token, verify_token_optional
 from models import (
     LoginRequest, LoginResponse, UserResponse, 
     AgentCreate, AgentUpdate, AgentResponse, AgentListResponse,
     AdminCreate, AdminUpdate, AdminResponse, AdminListResponse,
     ChannelCreate, ChannelUpdate, ChannelResponse, ChannelListResponse,
     FlowCreate, FlowUpdate, FlowResponse, FlowListResponse, FlowImport,
-    TeamCreate, TeamUpdate, TeamResponse, TeamListResponse
+    FlowRevisionListResponse, FlowRevisionDiffResponse,
+    FlowPatch, FlowPatchResponse,
+    TeamCreate, TeamUpdate, TeamResponse, TeamListResponse,
+    CannedReplyCreate, CannedReplyUpdate, CannedReplyResponse, CannedReplyListResponse,
+    CannedReplyMatch, CannedReplySearchResponse,
+    DashboardSummaryResponse, ConversationReportResponse,
+    ConversationCreate, ConversationResponse, MessageCreate, MessageResponse, ReceiptCreate,
+    InboxPage, InboxChanges, MediaResponse,
+    PresenceHeartbeat
 )
 
 ROOT_DIR = Path(__file__).parent
@@ -37,7 +79,19 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def require_admin(token_data: dict = Depends(verify_token)):
+NO_AGENT_MESSAGE = "No momento não há agentes disponíveis. Por favor, aguarde."
+
+async def require_user(token_data: dict = Depends(verify_token)):
+    """Dependency that requires the token's user to still exist and be active.
+    
+    Role and profile come from the (cached) user record, not the token claims.
+    """
+    profile = await user_profiles.get(token_data.get("sub"))
+    if not profile or not profile['is_active']:
+        raise HTTPException(status_code=401, detail="Usuário desativado ou removido")
+    return {**token_data, "role": profile['role'], "profile": profile}
+
+def require_admin(token_data: dict = Depends(require_user)):
     """Dependency that requires admin role"""
     if token_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Acesso negado. Apenas administradores.")
@@ -46,10 +100,31 @@ def require_admin(token_data: dict = Depends(verify_token)):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan - connect/disconnect MongoDB"""
-    # Startup
+    # Startup: only connect here; the rest runs in the background and
+    # /api/health/ready reports when it is done
     await connect_to_mongodb()
+    startup.add("database", init_database)
+    startup.add("login", login_shield.start)
+    startup.add("login_guard", login_guard.start)
+    startup.add("presence", presence_service.start)
+    startup.add("routing", routing_sync.start)
+    startup.add("reaper", session_reaper.start)
+    startup.add("metrics", conversation_metrics.start)
+    startup.add("bus", message_bus.start)
+    startup.add("messages", message_writes.start)
+    startup.add("receipts", receipts.start)
+    startup.start()
     yield
     # Shutdown
+    await startup.stop()
+    await login_guard.stop()
+    await session_reaper.stop()
+    await routing_sync.stop()
+    await presence_service.stop()
+    await conversation_metrics.stop()
+    await message_writes.stop()
+    await receipts.stop()
+    await message_bus.stop()
     await close_mongodb_connection()
 
 # Create the main app with lifespan
@@ -58,14 +133,43 @@ app = FastAPI(lifespan=lifespan)
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+@api_router.get("/health/live")
+async def liveness():
+    """The worker is up and its event loop responds"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness():
+    """The worker finished startup and can serve traffic"""
+    status = startup.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
 @api_router.post("/auth/login", response_model=LoginResponse)
-async def login(credentials: LoginRequest):
+async def login(credentials: LoginRequest, request: Request):
     """Login endpoint - accepts email or username"""
-    user = await get_user_by_login(credentials.login)
+    ip = client_ip(request)
     
-    if not user or not verify_password(credentials.password, user['password_hash']):
+    # Throttle before any database or bcrypt work
+    retry_after = await login_guard.check(ip, credentials.login)
+    if retry_after:
+        seconds = math.ceil(retry_after)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Muitas tentativas de login. Tente novamente em {seconds} segundo(s).",
+            headers={"Retry-After": str(seconds)}
+        )
+    
+    # Same response time whether or not the login exists
+    user = await login_shield.authenticate(credentials.login, credentials.password)
+    
+    if not user:
+        await login_guard.failure(ip, credentials.login)
         raise HTTPException(status_code=401, detail="Credenciais inválidas")
     
+    await login_guard.success(ip, credentials.login)
+    
     # Check if user is active
     if not user.get('is_active', True):
         raise HTTPException(status_code=401, detail="Usuário desativado")
@@ -90,13 +194,15 @@ async def login(credentials: LoginRequest):
     }
 
 @api_router.get("/auth/me")
-async def get_current_user(token_data: dict = Depends(verify_token)):
-    """Get current user from token"""
+async def get_current_user(token_data: dict = Depends(require_user)):
+    """Get the current user's profile"""
+    profile = token_data["profile"]
     return {
-        "id": token_data.get("sub"),
-        "username": token_data.get("username"),
-        "email": token_data.get("email"),
-        "role": token_data.get("role")
+        "id": profile["id"],
+        "name": profile["name"],
+        "username": profile["username"],
+        "email": profile["email"],
+        "role": profile["role"]
     }
 
 # Agent endpoints
@@ -123,6 +229,8 @@ async def create_new_agent(
     """Create a new agent (admin only)"""
     try:
         result = await create_agent(agent.model_dump())
+        sync_agent(result)
+        await dispatch_team(result.get('team_id'))
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -139,6 +247,8 @@ async def update_existing_agent(
     """Update an agent (admin only)"""
     try:
         result = await update_agent(agent_id, agent.model_dump(exclude_unset=True))
+        sync_agent(result)
+        await dispatch_team(result.get('team_id'))
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -156,6 +266,7 @@ async def delete_existing_agent(
         success = await delete_agent(agent_id)
         if not success:
             raise HTTPException(status_code=404, detail="Agente não encontrado")
+        remove_agent(agent_id)
         return {"message": "Agente excluído com sucesso"}
     except HTTPException:
         raise
@@ -171,6 +282,8 @@ async def delete_agents_in_bulk(
     """Delete multiple agents (admin only)"""
     try:
         deleted_count = await delete_agents_bulk(agent_ids)
+        for agent_id in agent_ids:
+            remove_agent(agent_id)
         return {"message": f"{deleted_count} agente(s) excluído(s) com sucesso", "deleted_count": deleted_count}
     except Exception as e:
         logger.error(f"Error deleting agents in bulk: {e}")
@@ -391,6 +504,49 @@ async def list_flows(
         logger.error(f"Error listing flows: {e}")
         raise HTTPException(status_code=500, detail="Erro ao listar fluxos")
 
+@api_router.get("/flows/archive")
+async def export_flows_archive(
+    ids: Optional[List[str]] = Query(None),
+    _: dict = Depends(require_admin)
+):
+    """Stream flows as a gzip-compressed NDJSON archive (admin only)"""
+    filename = f"fluxos-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.ndjson.gz"
+    return StreamingResponse(
+        write_archive(iter_flow_exports(ids)),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.post("/flows/archive")
+async def import_flows_archive(
+    request: Request,
+    _: dict = Depends(require_admin)
+):
+    """Import flows from an NDJSON archive, gzip or plain, read as it is uploaded (admin only)"""
+    async def flows():
+        async for line_number, record in read_archive(request.stream()):
+            if not isinstance(record, Exception):
+                try:
+                    record = FlowImport(**record).model_dump()
+                except ValidationError as e:
+                    error = e.errors()[0]
+                    field = ".".join(str(part) for part in error['loc'])
+                    record = ValueError(f"Campo '{field}': {error['msg']}")
+            yield line_number, record
+    
+    try:
+        result = await import_flows_bulk(flows())
+        message = f"{result['imported']} fluxo(s) importado(s) com sucesso"
+        if result['aborted']:
+            message = (f"Importação interrompida na linha {result['aborted']['line']}: "
+                       f"{result['aborted']['error']}. {result['imported']} fluxo(s) anteriores foram importados")
+        return {"message": message, **result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importing flows archive: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao importar fluxos")
+
 @api_router.get("/flows/{flow_id}", response_model=FlowResponse)
 async def get_single_flow(
     flow_id: str,
@@ -433,12 +589,33 @@ async def update_existing_flow(
     try:
         result = await update_flow(flow_id, flow.model_dump(exclude_unset=True))
         return result
+    except RevisionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error updating flow: {e}")
         raise HTTPException(status_code=500, detail="Erro ao atualizar fluxo")
 
+@api_router.patch("/flows/{flow_id}", response_model=FlowPatchResponse)
+async def patch_existing_flow(
+    flow_id: str,
+    patch: FlowPatch,
+    _: dict = Depends(require_admin)
+):
+    """Apply incremental node/edge operations to a flow (admin only)"""
+    try:
+        operations = [operation.model_dump(exclude_none=True) for operation in patch.operations]
+        result = await patch_flow(flow_id, patch.revision, operations)
+        return result
+    except RevisionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error patching flow: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao atualizar fluxo")
+
 @api_router.delete("/flows/{flow_id}")
 async def delete_existing_flow(
     flow_id: str,
@@ -505,6 +682,51 @@ async def export_existing_flow(
         logger.error(f"Error exporting flow: {e}")
         raise HTTPException(status_code=500, detail="Erro ao exportar fluxo")
 
+@api_router.get("/flows/{flow_id}/revisions", response_model=FlowRevisionListResponse)
+async def list_flow_revisions(
+    flow_id: str,
+    page: int = Query(1, ge=1),
+    per_page: int = Query(10, ge=1, le=100),
+    _: dict = Depends(require_admin)
+):
+    """List the revision history of a flow (admin only)"""
+    try:
+        return await get_flow_revisions(flow_id, page=page, per_page=per_page)
+    except Exception as e:
+        logger.error(f"Error listing flow revisions: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao listar revisões")
+
+@api_router.get("/flows/{flow_id}/revisions/diff", response_model=FlowRevisionDiffResponse)
+async def diff_revisions(
+    flow_id: str,
+    from_number: int = Query(..., alias="from", ge=0),
+    to_number: int = Query(..., alias="to", ge=0),
+    _: dict = Depends(require_admin)
+):
+    """Compare two revisions of a flow (admin only)"""
+    try:
+        return await diff_flow_revisions(flow_id, from_number, to_number)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error diffing flow revisions: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao comparar revisões")
+
+@api_router.post("/flows/{flow_id}/revisions/{number}/restore", response_model=FlowResponse)
+async def restore_revision(
+    flow_id: str,
+    number: int,
+    _: dict = Depends(require_admin)
+):
+    """Restore a previous revision of a flow (admin only)"""
+    try:
+        return await restore_flow_revision(flow_id, number)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error restoring flow revision: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao restaurar revisão")
+
 @api_router.post("/flows/import", response_model=FlowResponse)
 async def import_new_flow(
     flow: FlowImport,
@@ -621,6 +843,555 @@ async def delete_teams_in_bulk(
         logger.error(f"Error deleting teams in bulk: {e}")
         raise HTTPException(status_code=500, detail="Erro ao excluir equipes")
 
+
+# Canned reply endpoints
+def _canned_reply_team(token_data: dict, team_id: Optional[str]) -> Optional[str]:
+    """Agents see their team's replies; admins pick a team"""
+    if token_data.get("role") == "agent":
+        return token_data["profile"].get("team_id")
+    return team_id
+
+@api_router.get("/canned-replies", response_model=CannedReplyListResponse)
+async def list_canned_replies(
+    page: int = Query(1, ge=1),
+    per_page: int = Query(10, ge=1, le=100),
+    search: Optional[str] = None,
+    team_id: Optional[str] = None,
+    global_only: bool = False,
+    _: dict = Depends(require_admin)
+):
+    """List canned replies, of every team or of one scope (admin only)"""
+    try:
+        result = await get_canned_replies(page=page, per_page=per_page, search=search,
+                                          team_id=team_id, global_only=global_only)
+        return result
+    except Exception as e:
+        logger.error(f"Error listing canned replies: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao listar mensagens predefinidas")
+
+@api_router.get("/canned-replies/search", response_model=CannedReplySearchResponse)
+async def search_canned_replies(
+    q: str = "",
+    limit: int = Query(CANNED_REPLY_SEARCH_LIMIT, ge=1, le=100),
+    team_id: Optional[str] = None,
+    token_data: dict = Depends(require_user)
+):
+    """Replies of the team and global ones by prefix; `/prefix` searches shortcuts only"""
+    try:
+        items = await canned_replies.search(_canned_reply_team(token_data, team_id), q, limit)
+        return {"items": items}
+    except Exception as e:
+        logger.error(f"Error searching canned replies: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao buscar mensagens predefinidas")
+
+@api_router.get("/canned-replies/expand", response_model=CannedReplyMatch)
+async def expand_canned_reply(
+    shortcut: str = Query(..., min_length=1),
+    team_id: Optional[str] = None,
+    token_data: dict = Depends(require_user)
+):
+    """Reply a `/shortcut` stands for; the team's reply wins over a global one"""
+    try:
+        reply = await canned_replies.expand(_canned_reply_team(token_data, team_id), shortcut)
+    except Exception as e:
+        logger.error(f"Error expanding canned reply: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao buscar mensagem predefinida")
+    if not reply:
+        raise HTTPException(status_code=404, detail="Atalho não encontrado")
+    return reply
+
+@api_router.get("/canned-replies/{reply_id}", response_model=CannedReplyResponse)
+async def get_single_canned_reply(
+    reply_id: str,
+    _: dict = Depends(require_admin)
+):
+    """Get a single canned reply by ID (admin only)"""
+    try:
+        result = await get_canned_reply_by_id(reply_id)
+        if not result:
+            raise HTTPException(status_code=404, detail="Mensagem predefinida não encontrada")
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting canned reply: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao obter mensagem predefinida")
+
+@api_router.post("/canned-replies", response_model=CannedReplyResponse)
+async def create_new_canned_reply(
+    reply: CannedReplyCreate,
+    _: dict = Depends(require_admin)
+):
+    """Create a canned reply for a team, or a global one without team_id (admin only)"""
+    try:
+        result = await create_canned_reply(reply.model_dump())
+        return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error creating canned reply: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao criar mensagem predefinida")
+
+@api_router.put("/canned-replies/{reply_id}", response_model=CannedReplyResponse)
+async def update_existing_canned_reply(
+    reply_id: str,
+    reply: CannedReplyUpdate,
+    _: dict = Depends(require_admin)
+):
+    """Update a canned reply; team_id null makes it global (admin only)"""
+    try:
+        result = await update_canned_reply(reply_id, reply.model_dump(exclude_unset=True))
+        return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error updating canned reply: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao atualizar mensagem predefinida")
+
+@api_router.delete("/canned-replies/{reply_id}")
+async def delete_existing_canned_reply(
+    reply_id: str,
+    _: dict = Depends(require_admin)
+):
+    """Delete a canned reply (admin only)"""
+    try:
+        success = await delete_canned_reply(reply_id)
+        if not success:
+            raise HTTPException(status_code=404, detail="Mensagem predefinida não encontrada")
+        return {"message": "Mensagem predefinida excluída com sucesso"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting canned reply: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao excluir mensagem predefinida")
+
+@api_router.post("/canned-replies/bulk-delete")
+async def delete_canned_replies_in_bulk(
+    reply_ids: List[str],
+    _: dict = Depends(require_admin)
+):
+    """Delete multiple canned replies (admin only)"""
+    try:
+        result = await delete_canned_replies_bulk(reply_ids)
+        return {
+            "message": f"{result['deleted_count']} mensagem(ns) predefinida(s) excluída(s) com sucesso",
+            "deleted_count": result['deleted_count']
+        }
+    except Exception as e:
+        logger.error(f"Error deleting canned replies in bulk: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao excluir mensagens predefinidas")
+
+
+# Dashboard endpoints
+@api_router.get("/dashboard/summary", response_model=DashboardSummaryResponse)
+async def dashboard_summary(_: dict = Depends(require_admin)):
+    """Entity counts for the dashboard in one request (admin only)"""
+    try:
+        return await get_dashboard_summary()
+    except Exception as e:
+        logger.error(f"Error getting dashboard summary: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao carregar o resumo")
+
+# Report endpoints
+REPORT_MAX_BUCKETS = 2000
+
+@api_router.get("/reports/conversations", response_model=ConversationReportResponse)
+async def conversation_report(
+    start: datetime,
+    end: Optional[datetime] = None,
+    dimension: str = Query("all", pattern="^(all|channel|team|agent)$"),
+    granularity: Optional[str] = Query(None, pattern="^(minute|hour|day)$"),
+    key: Optional[str] = None,
+    _: dict = Depends(require_admin)
+):
+    """Conversation volume, wait and handle times per bucket, read from rollups (admin only)"""
+    start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    end = end or datetime.now(timezone.utc)
+    end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="O fim do período deve ser posterior ao início")
+    granularity = granularity or choose_granularity(start, end)
+    if (end - start).total_seconds() / GRANULARITIES[granularity] > REPORT_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="Período muito longo para a granularidade escolhida")
+    try:
+        start = bucket_start(start, granularity)
+        rows = await get_metric_rollups(granularity, dimension, start, end, key=key)
+        return {
+            "dimension": dimension,
+            "granularity": granularity,
+            "start": start,
+            "end": end,
+            "series": summarize(rows)
+        }
+    except Exception as e:
+        logger.error(f"Error building conversation report: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao gerar relatório")
+
+@api_router.get("/exports/{kind}")
+async def export_report(
+    kind: str,
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    team_id: Optional[str] = None,
+    channel_id: Optional[str] = None,
+    _: dict = Depends(require_admin)
+):
+    """Stream conversations or per-agent performance as CSV or Parquet (admin only)"""
+    if kind not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail="Exportação não encontrada")
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=400, detail="Exportação em Parquet indisponível neste servidor")
+    batches = iter_conversation_batches(start, end, team_id=team_id, channel_id=channel_id)
+    if kind == "agents":
+        frames = agent_frames(batches, get_user_names)
+    else:
+        frames = conversation_frames(batches)
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"{'atendimentos' if kind == 'conversations' else 'agentes'}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{extension}"
+    return StreamingResponse(
+        write_export(frames, EXPORT_COLUMNS[kind], format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Conversation endpoints
+@api_router.post("/conversations", response_model=ConversationResponse)
+async def start_conversation(
+    conversation: ConversationCreate,
+    token_data: Optional[dict] = Depends(verify_token_optional)
+):
+    """Start a conversation and queue it for an agent (public for chat access)"""
+    try:
+        data = conversation.model_dump()
+        if not token_data:
+            # Visitors can't pick a team's queue or move themselves up in it;
+            # only staff opening a conversation on someone's behalf can
+            data['team_id'] = None
+            data['priority'] = 0
+        result = await create_conversation(data)
+        session_reaper.touch(result['id'], result['expires_at'])
+        enqueue_conversation(result['id'], team_id=result['team_id'], priority=result['priority'])
+        await dispatch_team(result['team_id'])
+        
+        result = await get_conversation_by_id(result['id'])
+        if result['status'] == 'waiting':
+            team = await get_team_by_id(result['team_id']) if result['team_id'] else None
+            result['notice'] = team['no_agent_message'] if team else NO_AGENT_MESSAGE
+        return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error starting conversation: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao iniciar atendimento")
+
+@api_router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
+async def get_single_conversation(conversation_id: str):
+    """Get a single conversation by ID (public for chat access)"""
+    try:
+        result = await get_conversation_by_id(conversation_id)
+        if not result:
+            raise HTTPException(status_code=404, detail="Atendimento não encontrado")
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting conversation: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao obter atendimento")
+
+@api_router.post("/conversations/{conversation_id}/close", response_model=ConversationResponse)
+async def close_existing_conversation(
+    conversation_id: str,
+    _: dict = Depends(require_user)
+):
+    """Close a conversation and free the agent's capacity"""
+    try:
+        previous = await close_conversation(conversation_id)
+        if not previous:
+            raise HTTPException(status_code=404, detail="Atendimento não encontrado ou já encerrado")
+        
+        session_reaper.cancel(conversation_id)
+        message_bus.publish(conversation_topic(conversation_id), "status", {"status": "closed"})
+        if previous['status'] == 'waiting':
+            cancel_conversation(conversation_id)
+        elif previous['assignee_id']:
+            release_agent(previous['assignee_id'])
+            await dispatch_team(previous['team_id'])
+        
+        return await get_conversation_by_id(conversation_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error closing conversation: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao encerrar atendimento")
+
+@api_router.post("/conversations/{conversation_id}/messages", response_model=MessageResponse)
+async def send_message(
+    conversation_id: str,
+    message: MessageCreate,
+    token_data: Optional[dict] = Depends(verify_token_optional)
+):
+    """Send a message as the visitor, or as the agent when authenticated"""
+    try:
+        result = await add_message(conversation_id, {
+            "text": message.text,
+            "sender_type": "agent" if token_data else "client",
+            "sender_id": token_data.get("sub") if token_data else None
+        })
+        session_reaper.touch(conversation_id, result['conversation']['expires_at'])
+        message_bus.publish(
+            conversation_topic(conversation_id), "message",
+            MessageResponse(**result['message']).model_dump(mode="json")
+        )
+        # Senders have read everything up to their own message
+        receipts.read(conversation_id, result['message']['sender_type'], result['message']['seq'])
+        return result['message']
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error sending message: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao enviar mensagem")
+
+@api_router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
+async def list_messages(
+    conversation_id: str,
+    after_seq: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200)
+):
+    """List messages after a sequence number (public for chat access)"""
+    try:
+        return await get_messages(conversation_id, after_seq=after_seq, limit=limit)
+    except Exception as e:
+        logger.error(f"Error listing messages: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao listar mensagens")
+
+async def _receipt_limit(conversation_id: str, seq: int = 0) -> int:
+    """Highest sequence a receipt may carry; 404 unless the conversation is open.
+
+    Checked before the tracker sees anything, so receipts for unknown
+    conversations don't take up watermark slots and a seq from the future
+    can't be persisted with $max.
+    """
+    message_seq = await receipts.limit(conversation_id, seq)
+    if message_seq is None:
+        raise HTTPException(status_code=404, detail="Atendimento não encontrado ou já encerrado")
+    return message_seq
+
+@api_router.post("/conversations/{conversation_id}/typing")
+async def send_typing(
+    conversation_id: str,
+    token_data: Optional[dict] = Depends(verify_token_optional)
+):
+    """Tell the other side someone is typing; throttled, never stored"""
+    try:
+        participant = "agent" if token_data else "client"
+        if not receipts.claim_typing(conversation_id, participant):
+            return {"sent": False}
+        await _receipt_limit(conversation_id)
+        receipts.publish_typing(conversation_id, participant)
+        return {"sent": True}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error sending typing event: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao enviar evento")
+
+@api_router.post("/conversations/{conversation_id}/delivered")
+async def send_delivered(
+    conversation_id: str,
+    receipt: ReceiptCreate,
+    token_data: Optional[dict] = Depends(verify_token_optional)
+):
+    """Acknowledge messages up to a sequence number as delivered; never stored"""
+    try:
+        seq = min(receipt.seq, await _receipt_limit(conversation_id, receipt.seq))
+        sent = receipts.delivered(conversation_id, "agent" if token_data else "client", seq)
+        return {"sent": sent}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error sending delivered receipt: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao enviar confirmação")
+
+@api_router.post("/conversations/{conversation_id}/read")
+async def send_read(
+    conversation_id: str,
+    receipt: ReceiptCreate,
+    token_data: Optional[dict] = Depends(verify_token_optional)
+):
+    """Mark messages up to a sequence number as read; the watermark is stored periodically"""
+    try:
+        seq = min(receipt.seq, await _receipt_limit(conversation_id, receipt.seq))
+        sent = receipts.read(conversation_id, "agent" if token_data else "client", seq)
+        return {"sent": sent}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error sending read receipt: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao enviar confirmação")
+
+@api_router.get("/conversations/{conversation_id}/events")
+async def stream_conversation_events(conversation_id: str, request: Request):
+    """Stream messages, status changes, typing and receipts as server-sent events (public for chat access)"""
+    conversation = await get_conversation_by_id(conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Atendimento não encontrado")
+    after = message_bus.parse_event_id(request.headers.get("last-event-id"))
+    if after is None:
+        # Nothing published from here until the stream starts is lost
+        after = message_bus.offset
+    return StreamingResponse(
+        sse_stream(message_bus, [conversation_topic(conversation_id)], after, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/routing/stats")
+async def get_routing_stats(_: dict = Depends(require_admin)):
+    """Queue sizes and agent loads of this worker (admin only)"""
+    return routing_engine.stats()
+
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(_: dict = Depends(require_admin)):
+    """Hit rates of this worker's in-memory caches (admin only)"""
+    return {
+        "user_profiles": user_profiles.stats(),
+        "channel_flows": channel_flows.stats(),
+        "list_counts": list_counts.stats(),
+        "metrics": conversation_metrics.stats(),
+        "bus": message_bus.stats(),
+        "message_writes": message_writes.stats(),
+        "receipts": receipts.stats(),
+        "canned_replies": canned_replies.stats()
+    }
+
+
+# Inbox endpoints
+def _inbox_scope(token_data: dict, agent_id: Optional[str], team_id: Optional[str]):
+    """Agents see their own inbox; admins pick an agent and team"""
+    if token_data.get("role") == "agent":
+        return token_data.get("sub"), token_data["profile"].get("team_id")
+    return agent_id, team_id
+
+@api_router.get("/inbox", response_model=InboxPage)
+async def list_inbox(
+    section: str = Query("active", pattern="^(active|waiting)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(30, ge=1, le=100),
+    agent_id: Optional[str] = None,
+    team_id: Optional[str] = None,
+    token_data: dict = Depends(require_user)
+):
+    """Active conversations of the agent or waiting ones of their team, newest activity first"""
+    agent_id, team_id = _inbox_scope(token_data, agent_id, team_id)
+    try:
+        return await get_inbox(section, agent_id=agent_id, team_id=team_id, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listing inbox: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao listar atendimentos")
+
+@api_router.get("/inbox/changes", response_model=InboxChanges)
+async def list_inbox_changes(
+    since: int = Query(..., ge=0),
+    agent_id: Optional[str] = None,
+    team_id: Optional[str] = None,
+    token_data: dict = Depends(require_user)
+):
+    """Inbox conversations changed since a revision; with reset, reload the lists instead"""
+    agent_id, team_id = _inbox_scope(token_data, agent_id, team_id)
+    try:
+        return await get_inbox_changes(since, agent_id=agent_id, team_id=team_id)
+    except Exception as e:
+        logger.error(f"Error listing inbox changes: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao listar atendimentos")
+
+
+# Media endpoints
+@api_router.post("/media", response_model=MediaResponse)
+async def upload_media(
+    request: Request,
+    conversation_id: Optional[str] = None,
+    token_data: Optional[dict] = Depends(verify_token_optional)
+):
+    """Upload the multipart `file` field, streamed to storage as it arrives.
+
+    Visitors can only upload into an open conversation. A file whose
+    content is already stored gets its own record pointing at the stored
+    bytes, and the new copy is discarded.
+    """
+    if not token_data:
+        conversation = await get_conversation_by_id(conversation_id) if conversation_id else None
+        if not conversation or conversation['status'] not in ("waiting", "active"):
+            raise HTTPException(status_code=403, detail="Envio de arquivos disponível apenas em atendimentos abertos")
+    try:
+        upload = await receive_upload(request, media_store)
+        if upload is None:
+            raise HTTPException(status_code=400, detail="Nenhum arquivo enviado no campo 'file'")
+        media, created = await save_media(upload, media_store.name,
+                                          uploaded_by=token_data.get("sub") if token_data else None)
+        if not created:
+            await media_store.discard(upload['storage_key'])
+        return {**media, "url": f"/api/media/{media['id']}", "deduplicated": not created}
+    except HTTPException:
+        raise
+    except MediaTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error uploading media: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao enviar arquivo")
+
+@api_router.api_route("/media/{media_id}", methods=["GET", "HEAD"])
+async def download_media(media_id: str, request: Request):
+    """Download a stored file, whole or by byte range (public, like chat messages)"""
+    try:
+        media = await get_media_by_id(media_id)
+        response = await media_response(media, request) if media else None
+    except Exception as e:
+        logger.error(f"Error downloading media: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao baixar arquivo")
+    if response is None:
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    return response
+
+
+# Presence endpoints
+@api_router.post("/presence/heartbeat")
+async def presence_heartbeat(
+    heartbeat: PresenceHeartbeat,
+    token_data: dict = Depends(require_user)
+):
+    """Report agent availability; answered from memory, no database write"""
+    if token_data.get("role") != "agent":
+        raise HTTPException(status_code=403, detail="Apenas agentes informam presença")
+    
+    agent_id = token_data.get("sub")
+    team_id = routing_engine.agent_team(agent_id)
+    changed = presence_service.heartbeat(agent_id, team_id=team_id, status=heartbeat.status)
+    if changed and heartbeat.status == "online":
+        await dispatch_team(team_id)
+    
+    return {"status": heartbeat.status, "interval": HEARTBEAT_INTERVAL}
+
+@api_router.get("/presence")
+async def get_team_presence(
+    team_id: Optional[str] = None,
+    _: dict = Depends(require_admin)
+):
+    """Agent presence of a team (admin only)"""
+    members = presence_service.team_members(team_id)
+    return {
+        "team_id": team_id,
+        "counts": presence_service.team_counts(team_id),
+        "at_capacity": len(routing_engine.at_capacity(team_id)),
+        "waiting": routing_engine.queue_length(team_id),
+        "agents": {status: sorted(ids) for status, ids in members.items()}
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STARTUP_RETRY_MAX = 30
+
+
+class Startup:
+    """Runs initialization steps in the background after the worker starts.
+
+    Steps run in order; a failing step is retried with exponential backoff
+    instead of crashing the worker. Until every step has completed the
+    worker is alive but not ready.
+    """
+
+    def __init__(self):
+        self._steps: List[Tuple[str, Callable[[], Awaitable]]] = []
+        self.completed: List[str] = []
+        self.error: Optional[str] = None
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, step: Callable[[], Awaitable]):
+        self._steps.append((name, step))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        for name, step in self._steps:
+            delay = 1
+            while True:
+                try:
+                    await step()
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.error = f"{name}: {e}"
+                    logger.error(f"Startup step '{name}' failed, retrying in {delay}s: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, STARTUP_RETRY_MAX)
+            self.completed.append(name)
+        self.error = None
+        self.ready = True
+        logger.info("Startup complete, worker ready")
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "completed": list(self.completed),
+            "pending": [name for name, _ in self._steps if name not in self.completed],
+            "error": self.error
+        }
+
+
+startup = Startup()
@@ -0,0 +1,123 @@
+import math
+from typing import Dict, Hashable, List, Optional, Tuple
+
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 3
+
+
+class TimerWheel:
+    """Hierarchical timing wheel.
+
+    Three levels of 64 slots; with the default one-second tick the wheel
+    covers 64^3 seconds (about three days) before falling back to an
+    overflow bucket. Scheduling and cancelling are O(1); advancing the
+    clock touches only the slots that come due, cascading timers from the
+    coarser levels into finer ones as their window approaches.
+    """
+
+    def __init__(self, tick: float = 1.0, now: float = 0.0):
+        self.tick = tick
+        self._current = self._elapsed_ticks(now)
+        self._levels: List[List[Dict[Hashable, int]]] = [
+            [{} for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)
+        ]
+        self._overflow: Dict[Hashable, int] = {}
+        self._due: Dict[Hashable, int] = {}
+        self._where: Dict[Hashable, Tuple[int, int]] = {}
+
+    def _to_tick(self, timestamp: float) -> int:
+        """First tick at or after a deadline, so timers never fire early"""
+        return math.ceil(timestamp / self.tick)
+
+    def _elapsed_ticks(self, now: float) -> int:
+        """Last tick at or before now; rounding up would expire deadlines
+        later in the current tick before they are due"""
+        return math.floor(now / self.tick)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key: Hashable):
+        return key in self._where
+
+    def _place(self, key: Hashable, deadline: int):
+        current = self._current
+        if deadline <= current:
+            bucket, where = self._due, (-1, 0)
+        elif deadline >> WHEEL_BITS == current >> WHEEL_BITS:
+            slot = deadline & WHEEL_MASK
+            bucket, where = self._levels[0][slot], (0, slot)
+        elif deadline >> (2 * WHEEL_BITS) == current >> (2 * WHEEL_BITS):
+            slot = (deadline >> WHEEL_BITS) & WHEEL_MASK
+            bucket, where = self._levels[1][slot], (1, slot)
+        elif deadline >> (3 * WHEEL_BITS) == current >> (3 * WHEEL_BITS):
+            slot = (deadline >> (2 * WHEEL_BITS)) & WHEEL_MASK
+            bucket, where = self._levels[2][slot], (2, slot)
+        else:
+            bucket, where = self._overflow, (WHEEL_LEVELS, 0)
+        bucket[key] = deadline
+        self._where[key] = where
+
+    def _bucket(self, where: Tuple[int, int]) -> Dict[Hashable, int]:
+        level, slot = where
+        if level == -1:
+            return self._due
+        if level == WHEEL_LEVELS:
+            return self._overflow
+        return self._levels[level][slot]
+
+    def schedule(self, key: Hashable, timestamp: float):
+        """Schedule (or reschedule) a key to expire at a unix timestamp"""
+        self.cancel(key)
+        self._place(key, self._to_tick(timestamp))
+
+    def cancel(self, key: Hashable) -> bool:
+        """Remove a pending timer"""
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        self._bucket(where).pop(key, None)
+        return True
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        """Scheduled expiry of a key as a unix timestamp"""
+        where = self._where.get(key)
+        if where is None:
+            return None
+        return self._bucket(where)[key] * self.tick
+
+    def _cascade(self, bucket: Dict[Hashable, int]):
+        entries = list(bucket.items())
+        bucket.clear()
+        for key, deadline in entries:
+            self._place(key, deadline)
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Move the clock forward and return every key that expired"""
+        expired = list(self._due)
+        self._due.clear()
+        for key in expired:
+            del self._where[key]
+
+        target = self._elapsed_ticks(now)
+        while self._current < target:
+            self._current += 1
+            current = self._current
+            if current & WHEEL_MASK == 0:
+                if (current >> WHEEL_BITS) & WHEEL_MASK == 0:
+                    if (current >> (2 * WHEEL_BITS)) & WHEEL_MASK == 0:
+                        self._cascade(self._overflow)
+                    self._cascade(self._levels[2][(current >> (2 * WHEEL_BITS)) & WHEEL_MASK])
+                self._cascade(self._levels[1][(current >> WHEEL_BITS) & WHEEL_MASK])
+
+            # Cascading may have moved timers straight into the due bucket
+            bucket = self._levels[0][current & WHEEL_MASK]
+            for source in (self._due, bucket):
+                for key in source:
+                    del self._where[key]
+                    expired.append(key)
+                source.clear()
+
+        return expired
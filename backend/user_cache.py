@@ -0,0 +1,83 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+# Bounds how long a change made on another worker can go unnoticed
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+USER_CACHE_MAX = int(os.environ.get('USER_CACHE_MAX', 10_000))
+
+# Cached for users that don't exist, so deleted accounts stay cheap to reject
+_MISSING = object()
+
+
+class UserProfileCache:
+    """Per-worker LRU of user profiles keyed by user id.
+
+    User writes on this worker invalidate their entries; the TTL covers
+    writes made by other workers.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_entries: int = USER_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Bumped on every invalidation so in-flight loads don't store stale data
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, user_id: str, now: float):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        profile, loaded_at = entry
+        if now - loaded_at > self.ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return profile
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        """Current profile of a user, or None when the user no longer exists"""
+        now = time.monotonic()
+        profile = self._lookup(user_id, now)
+        if profile is not None:
+            self.hits += 1
+            return None if profile is _MISSING else profile
+
+        from database import get_user_profile
+
+        self.misses += 1
+        generation = self._generation
+        profile = await get_user_profile(user_id)
+        if generation == self._generation:
+            self._entries[user_id] = (profile if profile is not None else _MISSING, now)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return profile
+
+    def invalidate(self, user_id: str):
+        self._generation += 1
+        self._entries.pop(user_id, None)
+
+    def invalidate_many(self, user_ids: Iterable[str]):
+        self._generation += 1
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+user_profiles = UserProfileCache()
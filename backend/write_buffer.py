@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, List, Optional, Tuple
+
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# A batch is written once it has this many documents...
+MESSAGE_BATCH_SIZE = int(os.environ.get('MESSAGE_BATCH_SIZE', 200))
+# ...or this long after its first document arrived
+MESSAGE_FLUSH_MS = float(os.environ.get('MESSAGE_FLUSH_MS', 5))
+# Durability a batch must reach before its senders are answered
+MESSAGE_WRITE_W = os.environ.get('MESSAGE_WRITE_W', '1')
+MESSAGE_WRITE_J = os.environ.get('MESSAGE_WRITE_J', 'true').lower() in ('1', 'true', 'yes')
+
+# Flush latencies kept for the percentiles in stats()
+LATENCY_SAMPLES = 1_000
+# A batch write fails within the driver's server selection timeout (30 s by
+# default); a sequence still missing after that was never written
+MESSAGE_GAP_GRACE = timedelta(seconds=float(os.environ.get('MESSAGE_GAP_GRACE', 30)))
+
+
+def contiguous(messages: List[dict], after_seq: int, now: datetime,
+               grace: timedelta = MESSAGE_GAP_GRACE) -> List[dict]:
+    """Messages in seq order up to the first gap that may still be filled.
+
+    Sequence numbers are taken before the message is written, so a reader
+    can see N+2 while N+1 is still in a batch. Stopping at the gap keeps
+    a client reading from its last seq from skipping N+1 for good. Once
+    the message after a gap is older than `grace`, the missing one was
+    lost (its batch failed) and the gap is passed over.
+    """
+    settled_before = now - grace
+    visible = []
+    expected = after_seq + 1
+    for message in messages:
+        if message['seq'] != expected:
+            created_at = message['created_at']
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            if created_at > settled_before:
+                break
+        visible.append(message)
+        expected = message['seq'] + 1
+    return visible
+
+
+def write_concern(w: str = MESSAGE_WRITE_W, j: bool = MESSAGE_WRITE_J) -> WriteConcern:
+    return WriteConcern(w=int(w) if w.isdigit() else w, j=j)
+
+
+class WriteBehindBuffer:
+    """Coalesces inserts into one collection into insert_many batches.
+
+    write() queues a document and returns once the batch holding it has
+    been written with the configured write concern, so callers still only
+    answer after the document is durable; many concurrent writers share
+    one round trip and one journal commit. Until start() is called (and
+    after stop()), writes go straight to insert_one.
+    """
+
+    def __init__(self, collection: str, batch_size: int = MESSAGE_BATCH_SIZE,
+                 flush_ms: float = MESSAGE_FLUSH_MS, concern: Optional[WriteConcern] = None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.concern = concern or write_concern()
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.max_batch = 0
+
+    def _collection(self):
+        from database import db
+        return db[self.collection].with_options(write_concern=self.concern)
+
+    async def write(self, document: dict):
+        """Insert a document; raises if its batch could not be written"""
+        if self._task is None:
+            await self._collection().insert_one(document)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((document, future))
+        if len(self._pending) == 1:
+            self._wake.set()
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        await future
+
+    async def flush(self):
+        pending, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+        if not pending:
+            return
+        started = time.perf_counter()
+        errors = {}
+        try:
+            await self._collection().insert_many([document for document, _ in pending], ordered=False)
+        except BulkWriteError as e:
+            # Unordered: every document without an error was written
+            errors = {error['index']: e for error in e.details.get('writeErrors', [])}
+            if not errors:
+                errors = {index: e for index in range(len(pending))}
+        except Exception as e:
+            errors = {index: e for index in range(len(pending))}
+        except asyncio.CancelledError:
+            # Whether or not the batch reached the server, its senders must
+            # not wait forever
+            error = RuntimeError(f"Write to {self.collection} interrupted")
+            for _, future in pending:
+                if not future.done():
+                    self.failed += 1
+                    future.set_exception(error)
+            raise
+        self._latencies.append(time.perf_counter() - started)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(pending))
+        if errors:
+            logger.error(f"Error writing {len(errors)} of {len(pending)} {self.collection}: "
+                         f"{next(iter(errors.values()))}")
+        for index, (_, future) in enumerate(pending):
+            if future.done():
+                continue
+            if index in errors:
+                self.failed += 1
+                future.set_exception(errors[index])
+            else:
+                self.written += 1
+                future.set_result(None)
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything queued so far, then fall back to direct inserts"""
+        if self._task:
+            # Not cancelled: the loop finishes the batch it is writing and exits
+            self._stopping = True
+            self._wake.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        while self._pending:
+            await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wake.wait()
+            if len(self._pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            await self.flush()
+            if self._pending:
+                # Writes that arrived during the flush start the next batch
+                if len(self._pending) >= self.batch_size:
+                    self._full.set()
+            else:
+                self._wake.clear()
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 2)
+
+        return {
+            'pending': len(self._pending),
+            'batches': self.batches,
+            'written': self.written,
+            'failed': self.failed,
+            'avg_batch': round((self.written + self.failed) / self.batches, 1) if self.batches else 0.0,
+            'max_batch': self.max_batch,
+            'flush_ms_p50': percentile(0.5),
+            'flush_ms_p99': percentile(0.99),
+            'write_concern': self.concern.document
+        }
+
+
+message_writes = WriteBehindBuffer("messages")
@@ -1,23 +1,36 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
+import axios from 'axios';
 import { HelpCircle, Search, MessageSquare } from 'lucide-react';
+import { useAuth } from '../../contexts/AuthContext';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
 const ClientInfoPanel = ({ conversation }) => {
+  const { token } = useAuth();
   const [activeTab, setActiveTab] = useState('galeria');
   const [searchTerm, setSearchTerm] = useState('');
+  const [predefinedMessages, setPredefinedMessages] = useState([]);
 
-  // Mensagens predefinidas mockadas
-  const predefinedMessages = [
-    { id: 1, label: '15dias', message: 'Entraremos em contato nos próximos 15 dias.' },
-    { id: 2, label: '50mega', message: 'Nosso plano de 50 mega está disponível.' },
-    { id: 3, label: 'Acontecendo', message: 'O que está acontecendo?' },
-    { id: 4, label: 'Aguarde', message: 'Por favor, aguarde um momento.' },
-    { id: 5, label: 'Obrigado', message: 'Obrigado pelo contato!' },
-  ];
-
-  const filteredMessages = predefinedMessages.filter(m => 
-    m.label.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    m.message.toLowerCase().includes(searchTerm.toLowerCase())
-  );
+  // Mensagens predefinidas da equipe e globais; a busca é por prefixo
+  // do atalho (/saudacao) ou de palavras do título, resolvida no servidor
+  useEffect(() => {
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${BACKEND_URL}/api/canned-replies/search`, {
+          params: { q: searchTerm },
+          headers: { Authorization: `Bearer ${token}` }
+        });
+        if (!cancelled) setPredefinedMessages(response.data.items);
+      } catch (err) {
+        console.error('Error searching predefined messages:', err);
+      }
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [searchTerm, token]);
 
   const handleSelectMessage = (msg) => {
     console.log('Selected predefined message:', msg);
@@ -130,13 +143,14 @@ const ClientInfoPanel = ({ conversation }) => {
 
         {/* Lista de Mensagens Predefinidas */}
         <div className="flex-1 overflow-y-auto px-2">
-          {filteredMessages.map((msg) => (
+          {predefinedMessages.map((msg) => (
             <button
               key={msg.id}
               onClick={() => handleSelectMessage(msg)}
+              title={msg.content}
               className="w-full flex items-center justify-between px-3 py-2 hover:bg-gray-100 rounded-lg transition-colors group"
             >
-              <span className="text-sm text-gray-600">{msg.label}</span>
+              <span className="text-sm text-gray-600 truncate">/{msg.shortcut} · {msg.title}</span>
               <MessageSquare size={14} className="text-gray-300 group-hover:text-blue-500" />
             </button>
           ))}
@@ -1,8 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
+import axios from 'axios';
 import { useAuth } from '../contexts/AuthContext';
 import AgentLayout from '../components/agent/AgentLayout';
 
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const HEARTBEAT_INTERVAL_MS = 10000;
+
 // Dados mockados para demonstrar o layout visual
 const mockConversations = [
   {
@@ -103,7 +107,7 @@ const mockConversations = [
 ];
 
 const AgentDashboard = () => {
-  const { user, loading } = useAuth();
+  const { user, loading, token } = useAuth();
   const navigate = useNavigate();
   const [conversations, setConversations] = useState(mockConversations);
   const [selectedConversation, setSelectedConversation] = useState(mockConversations[0]);
@@ -121,6 +125,25 @@ const AgentDashboard = () => {
     }
   }, [user, loading, navigate]);
 
+  // Informa presença do agente (heartbeat) enquanto o painel estiver aberto
+  useEffect(() => {
+    if (loading || !user || !token || user.role !== 'agent') return;
+
+    const sendHeartbeat = (status) => axios.post(
+      `${BACKEND_URL}/api/presence/heartbeat`,
+      { status },
+      { headers: { Authorization: `Bearer ${token}` } }
+    ).catch((err) => console.error('Heartbeat error:', err));
+
+    sendHeartbeat('online');
+    const interval = setInterval(() => sendHeartbeat('online'), HEARTBEAT_INTERVAL_MS);
+
+    return () => {
+      clearInterval(interval);
+      sendHeartbeat('offline');
+    };
+  }, [user, loading, token]);
+
   const handleSelectConversation = (conversation) => {
     setSelectedConversation(conversation);
   };
@@ -64,7 +64,7 @@ const AdminsPage = () => {
       });
       
       setAdmins(response.data.admins);
-      setPagination(prev => ({ ...prev, total: response.data.total }));
+      setPagination(prev => ({ ...prev, total: response.data.total, totalIsEstimate: response.data.total_is_estimate }));
     } catch (err) {
       console.error('Error fetching admins:', err);
     } finally {
@@ -400,7 +400,7 @@ const AdminsPage = () => {
           <div className="flex items-center justify-between px-4 py-3 border-t border-gray-100">
             <span className="text-sm text-gray-600">
               {pagination.total > 0
-                ? `${startItem} - ${endItem} de ${pagination.total} itens`
+                ? `${startItem} - ${endItem} de ${pagination.totalIsEstimate ? 'aprox. ' : ''}${pagination.total} itens`
                 : '0 itens'}
             </span>
             
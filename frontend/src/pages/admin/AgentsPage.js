@@ -60,7 +60,7 @@ const AgentsPage = () => {
       });
       
       setAgents(response.data.agents);
-      setPagination(prev => ({ ...prev, total: response.data.total }));
+      setPagination(prev => ({ ...prev, total: response.data.total, totalIsEstimate: response.data.total_is_estimate }));
     } catch (err) {
       console.error('Error fetching agents:', err);
     } finally {
@@ -356,7 +356,7 @@ const AgentsPage = () => {
           <div className="flex items-center justify-between px-4 py-3 border-t border-gray-100">
             <span className="text-sm text-gray-600">
               {pagination.total > 0
-                ? `${startItem} - ${endItem} de ${pagination.total} itens`
+                ? `${startItem} - ${endItem} de ${pagination.totalIsEstimate ? 'aprox. ' : ''}${pagination.total} itens`
                 : '0 itens'}
             </span>
             
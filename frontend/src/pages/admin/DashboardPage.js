@@ -1,8 +1,60 @@
-import React from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
+import axios from 'axios';
+import { useAuth } from '../../contexts/AuthContext';
 import AdminLayout from '../../components/admin/AdminLayout';
-import { BarChart3, Users, MessageCircle, TrendingUp } from 'lucide-react';
+import { BarChart3, Users, MessageCircle, TrendingUp, Shield, Radio, GitBranch, UsersRound } from 'lucide-react';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
 const DashboardPage = () => {
+  const { getAuthHeader } = useAuth();
+  const [summary, setSummary] = useState(null);
+
+  const fetchSummary = useCallback(async () => {
+    try {
+      // One request for every count on the page
+      const response = await axios.get(`${BACKEND_URL}/api/dashboard/summary`, {
+        headers: getAuthHeader()
+      });
+      setSummary(response.data);
+    } catch (err) {
+      console.error('Error fetching dashboard summary:', err);
+    }
+  }, [getAuthHeader]);
+
+  useEffect(() => {
+    fetchSummary();
+  }, [fetchSummary]);
+
+  const entityCards = [
+    {
+      label: 'Administradores',
+      value: summary?.admins,
+      icon: Shield,
+      color: '#1A3F56'
+    },
+    {
+      label: 'Canais',
+      value: summary && summary.channels.active + summary.channels.inactive,
+      detail: summary && `${summary.channels.active} ativos · ${summary.channels.inactive} inativos`,
+      icon: Radio,
+      color: '#0066cc'
+    },
+    {
+      label: 'Fluxos',
+      value: summary && summary.flows.in_use + summary.flows.unused,
+      detail: summary && `${summary.flows.in_use} em uso · ${summary.flows.unused} sem uso`,
+      icon: GitBranch,
+      color: '#20C997'
+    },
+    {
+      label: 'Equipes',
+      value: summary?.teams,
+      icon: UsersRound,
+      color: '#ff9900'
+    }
+  ];
+
   return (
     <AdminLayout>
       <div data-testid="dashboard-page">
@@ -18,7 +70,9 @@ const DashboardPage = () => {
             <div className="flex items-center justify-between">
               <div>
                 <p className="text-gray-500 text-sm">Total de Agentes</p>
-                <p className="text-3xl font-bold text-[#1A3F56] mt-1">-</p>
+                <p className="text-3xl font-bold text-[#1A3F56] mt-1" data-testid="dashboard-agents">
+                  {summary ? summary.agents : '-'}
+                </p>
               </div>
               <div className="w-12 h-12 bg-[#20C997]/10 rounded-lg flex items-center justify-center">
                 <Users size={24} className="text-[#20C997]" />
@@ -63,6 +117,27 @@ const DashboardPage = () => {
           </div>
         </div>
 
+        {/* Entity Cards */}
+        <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-4 gap-6 mb-8">
+          {entityCards.map(({ label, value, detail, icon: Icon, color }) => (
+            <div key={label} className="bg-white rounded-lg shadow p-6">
+              <div className="flex items-center justify-between">
+                <div>
+                  <p className="text-gray-500 text-sm">{label}</p>
+                  <p className="text-3xl font-bold text-[#1A3F56] mt-1">{value ?? '-'}</p>
+                  {detail && <p className="text-gray-400 text-xs mt-1">{detail}</p>}
+                </div>
+                <div
+                  className="w-12 h-12 rounded-lg flex items-center justify-center"
+                  style={{ backgroundColor: `${color}1A` }}
+                >
+                  <Icon size={24} style={{ color }} />
+                </div>
+              </div>
+            </div>
+          ))}
+        </div>
+
         {/* Placeholder Content */}
         <div className="bg-white rounded-lg shadow p-12 text-center">
           <div className="w-20 h-20 bg-[#1A3F56]/10 rounded-full flex items-center justify-center mx-auto mb-6">
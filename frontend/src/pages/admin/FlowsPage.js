@@ -60,7 +60,7 @@ const FlowsPage = () => {
       });
       
       setFlows(response.data.flows);
-      setPagination(prev => ({ ...prev, total: response.data.total }));
+      setPagination(prev => ({ ...prev, total: response.data.total, totalIsEstimate: response.data.total_is_estimate }));
     } catch (err) {
       console.error('Error fetching flows:', err);
     } finally {
@@ -500,7 +500,7 @@ const FlowsPage = () => {
           <div className="flex items-center justify-between px-4 py-3 border-t border-gray-100">
             <span className="text-sm text-gray-600">
               {pagination.total > 0
-                ? `${startItem} - ${endItem} de ${pagination.total} itens`
+                ? `${startItem} - ${endItem} de ${pagination.totalIsEstimate ? 'aprox. ' : ''}${pagination.total} itens`
                 : '0 itens'}
             </span>
             
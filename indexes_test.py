@@ -0,0 +1,193 @@
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel
+from pymongo.errors import DuplicateKeyError
+
+from ids import binary_document, new_id
+from indexes import INDEX_MANIFEST, QUERY_SHAPES, id_indexes, reconcile_indexes
+
+
+def _stages(plan):
+    """Yield every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+class IndexPlanTester:
+    """Checks that every query shape in database.py is served by an index.
+
+    Runs against a throwaway database on MONGO_URL: applies the index
+    manifest, then explains each shape in indexes.QUERY_SHAPES and fails on
+    any COLLSCAN.
+    """
+
+    def __init__(self, mongo_url=None):
+        self.mongo_url = mongo_url or os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+        self.db_name = f"index_plan_test_{uuid.uuid4().hex[:8]}"
+        self.client = None
+        self.db = None
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.failed_tests = []
+
+    async def setup(self):
+        self.client = AsyncIOMotorClient(self.mongo_url)
+        self.db = self.client[self.db_name]
+        # A document per collection so the planner has something to plan against
+        now = datetime.now(timezone.utc)
+        for collection in INDEX_MANIFEST:
+            await self.db[collection].insert_one({"id": "seed", "created_at": now})
+
+    async def teardown(self):
+        if self.client:
+            await self.client.drop_database(self.db_name)
+            self.client.close()
+
+    def record(self, name, success, error=None):
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name}")
+        else:
+            print(f"❌ {name} - {error}")
+            self.failed_tests.append({'test': name, 'error': error})
+
+    async def test_manifest_applies(self):
+        """First reconciliation creates the indexes"""
+        print("\n🔍 Applying index manifest...")
+        changes = await reconcile_indexes(self.db)
+        self.record(
+            "Manifest applied",
+            changes is not None and not changes['dropped'],
+            f"unexpected result {changes}"
+        )
+
+    async def test_manifest_idempotent(self):
+        """Second reconciliation has nothing to do"""
+        changes = await reconcile_indexes(self.db)
+        self.record("Manifest idempotent", changes is None, f"changes applied again: {changes}")
+
+    async def explain(self, shape):
+        collection = shape['collection']
+        op = shape['op']
+        if op == 'find':
+            command = {"find": collection, "filter": shape['filter']}
+            if shape.get('sort'):
+                command["sort"] = shape['sort']
+            if shape.get('projection'):
+                command["projection"] = shape['projection']
+        elif op == 'count':
+            command = {"count": collection, "query": shape['filter']}
+        elif op == 'update':
+            command = {"update": collection, "updates": [
+                {"q": shape['filter'], "u": {"$set": {"_plan_test": 1}}, "multi": shape.get('multi', False)}
+            ]}
+        elif op == 'delete':
+            command = {"delete": collection, "deletes": [{"q": shape['filter'], "limit": 0}]}
+        elif op == 'aggregate':
+            command = {"aggregate": collection, "pipeline": shape['pipeline'], "cursor": {}}
+        else:
+            raise ValueError(f"unknown op {op}")
+        return await self.db.command("explain", command, verbosity="queryPlanner")
+
+    async def test_query_shapes(self):
+        """No query shape may scan a whole collection; covered ones may not fetch documents"""
+        print(f"\n🔍 Explaining {len(QUERY_SHAPES)} query shapes...")
+        for shape in QUERY_SHAPES:
+            name = f"{shape['name']} ({shape['collection']}.{shape['op']})"
+            try:
+                plan = await self.explain(shape)
+                stages = set(_stages(plan))
+                if 'COLLSCAN' in stages:
+                    self.record(name, False, f"COLLSCAN in plan: {sorted(stages)}")
+                elif shape.get('covered') and 'FETCH' in stages:
+                    # Covered shapes must be answered from the index alone
+                    self.record(name, False, f"FETCH in covered plan: {sorted(stages)}")
+                else:
+                    self.record(name, True)
+            except Exception as e:
+                self.record(name, False, str(e))
+
+    async def test_migrating_ids(self):
+        """While migrating, binary-keyed documents (no `id`) coexist under the id index"""
+        print("\n🔍 Id index in migrating mode...")
+        collection = self.db["ids_migrating"]
+        await collection.create_indexes([
+            IndexModel(spec["keys"], unique=spec.get("unique", False), sparse=spec.get("sparse", False))
+            for spec in id_indexes(True)
+        ])
+        try:
+            await collection.insert_one({"id": new_id(), "name": "string"})
+            for name in ("binary 1", "binary 2"):
+                await collection.insert_one(binary_document({"id": new_id(), "name": name}))
+            self.record("Two binary-keyed documents inserted", True)
+        except DuplicateKeyError as e:
+            self.record("Two binary-keyed documents inserted", False, str(e))
+
+        duplicate = new_id()
+        await collection.insert_one({"id": duplicate})
+        try:
+            await collection.insert_one({"id": duplicate})
+            self.record("String ids still unique", False, "duplicate string id accepted")
+        except DuplicateKeyError:
+            self.record("String ids still unique", True)
+
+
+async def run():
+    print("🚀 Starting Index Plan Tests")
+    print("=" * 50)
+
+    tester = IndexPlanTester()
+    tests = [
+        tester.test_manifest_applies,
+        tester.test_manifest_idempotent,
+        tester.test_query_shapes,
+        tester.test_migrating_ids,
+    ]
+
+    try:
+        await tester.setup()
+        for test in tests:
+            try:
+                await test()
+            except Exception as e:
+                print(f"❌ Test {test.__name__} crashed: {e}")
+                tester.failed_tests.append({
+                    'test': test.__name__,
+                    'error': f"Test crashed: {e}"
+                })
+    finally:
+        await tester.teardown()
+
+    # Print results
+    print("\n" + "=" * 50)
+    print(f"📊 Test Results: {tester.tests_passed}/{tester.tests_run} passed")
+
+    if tester.failed_tests:
+        print("\n❌ Failed Tests:")
+        for failure in tester.failed_tests:
+            print(f"   - {failure.get('test', 'Unknown')}: {failure.get('error', 'Unknown error')}")
+
+    return 0 if not tester.failed_tests and tester.tests_passed == tester.tests_run else 1
+
+
+def main():
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+
+from write_buffer import contiguous
+
+NOW = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+GRACE = timedelta(seconds=30)
+
+
+def message(seq, age_seconds=0.0, naive=False):
+    created_at = NOW - timedelta(seconds=age_seconds)
+    if naive:
+        # MongoDB returns naive UTC datetimes
+        created_at = created_at.replace(tzinfo=None)
+    return {'seq': seq, 'created_at': created_at}
+
+
+def seqs(messages):
+    return [m['seq'] for m in messages]
+
+
+class MessageGapTester:
+    """Checks that readers never skip a message that is still being written"""
+
+    def __init__(self):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.failed_tests = []
+
+    def record(self, name, success, error=None):
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name}")
+        else:
+            print(f"❌ {name} - {error}")
+            self.failed_tests.append({'test': name, 'error': error})
+
+    def test_no_gap(self):
+        """A contiguous run is returned whole"""
+        print("\n🔍 No gap...")
+        visible = contiguous([message(4), message(5), message(6)], 3, NOW, GRACE)
+        self.record("Every message returned", seqs(visible) == [4, 5, 6], f"got {seqs(visible)}")
+
+    def test_gap_in_flight(self):
+        """N+2 visible while N+1 is still in a batch: stop before the gap"""
+        print("\n🔍 Gap still in flight...")
+        visible = contiguous([message(4), message(6, 1), message(7)], 3, NOW, GRACE)
+        self.record("Stopped before the missing seq", seqs(visible) == [4], f"got {seqs(visible)}")
+
+        visible = contiguous([message(5, 1), message(6)], 3, NOW, GRACE)
+        self.record("Nothing returned past a missing first seq", visible == [], f"got {seqs(visible)}")
+
+    def test_gap_lost(self):
+        """A seq missing for longer than the grace period was never written"""
+        print("\n🔍 Lost message...")
+        visible = contiguous([message(4, 60), message(6, 45), message(7, 1)], 3, NOW, GRACE)
+        self.record("Old gap passed over", seqs(visible) == [4, 6, 7], f"got {seqs(visible)}")
+
+        visible = contiguous([message(5, 60), message(7, 1)], 3, NOW, GRACE)
+        self.record("Stopped at a newer gap after an old one", seqs(visible) == [5], f"got {seqs(visible)}")
+
+    def test_naive_timestamps(self):
+        """Timestamps read back from MongoDB are naive UTC"""
+        print("\n🔍 Naive timestamps...")
+        visible = contiguous([message(5, 1, naive=True)], 3, NOW, GRACE)
+        self.record("Fresh naive gap holds", visible == [], f"got {seqs(visible)}")
+        visible = contiguous([message(5, 60, naive=True)], 3, NOW, GRACE)
+        self.record("Old naive gap passed over", seqs(visible) == [5], f"got {seqs(visible)}")
+
+
+def main():
+    tester = MessageGapTester()
+    tests = [
+        tester.test_no_gap,
+        tester.test_gap_in_flight,
+        tester.test_gap_lost,
+        tester.test_naive_timestamps,
+    ]
+
+    for test in tests:
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ Test {test.__name__} crashed: {e}")
+            tester.failed_tests.append({
+                'test': test.__name__,
+                'error': f"Test crashed: {e}"
+            })
+
+    # Print results
+    print("\n" + "=" * 50)
+    print(f"📊 Test Results: {tester.tests_passed}/{tester.tests_run} passed")
+
+    if tester.failed_tests:
+        print("\n❌ Failed Tests:")
+        for failure in tester.failed_tests:
+            print(f"   - {failure.get('test', 'Unknown')}: {failure.get('error', 'Unknown error')}")
+
+    return 0 if not tester.failed_tests and tester.tests_passed == tester.tests_run else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+
+from timers import WHEEL_SIZE, TimerWheel
+
+
+class TimerWheelTester:
+    """Checks that the timer wheel fires each key once, never before its deadline"""
+
+    def __init__(self):
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.failed_tests = []
+
+    def record(self, name, success, error=None):
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {name}")
+        else:
+            print(f"❌ {name} - {error}")
+            self.failed_tests.append({'test': name, 'error': error})
+
+    def test_fractional_deadline(self):
+        """A deadline inside a tick fires at the first tick after it"""
+        print("\n🔍 Fractional deadline...")
+        wheel = TimerWheel(now=100.0)
+        wheel.schedule("conv", 100.5)
+
+        fired = wheel.advance(100.2)
+        self.record("Not fired before the deadline", fired == [], f"fired {fired} at 100.2")
+        fired = wheel.advance(100.9)
+        self.record("Not fired later in the same tick", fired == [], f"fired {fired} at 100.9")
+        fired = wheel.advance(101.0)
+        self.record("Fired at the next tick", fired == ["conv"], f"fired {fired} at 101.0")
+
+    def test_fractional_start(self):
+        """A wheel created mid-tick doesn't treat the rest of the tick as elapsed"""
+        print("\n🔍 Fractional start...")
+        wheel = TimerWheel(now=100.3)
+        wheel.schedule("conv", 100.6)
+
+        fired = wheel.advance(100.5)
+        self.record("Not fired before the deadline", fired == [], f"fired {fired} at 100.5")
+        fired = wheel.advance(101.0)
+        self.record("Fired at the next tick", fired == ["conv"], f"fired {fired} at 101.0")
+
+    def test_past_deadline(self):
+        """A deadline already passed fires on the next advance"""
+        print("\n🔍 Past deadline...")
+        wheel = TimerWheel(now=100.0)
+        wheel.schedule("conv", 99.5)
+        fired = wheel.advance(100.0)
+        self.record("Fired immediately", fired == ["conv"], f"fired {fired}")
+
+    def test_cascade(self):
+        """Timers on the coarser levels fire on time, not early"""
+        print("\n🔍 Cascading levels...")
+        wheel = TimerWheel(now=0.0)
+        deadlines = {f"conv-{i}": i * 37.25 for i in range(1, 3 * WHEEL_SIZE)}
+        for key, deadline in deadlines.items():
+            wheel.schedule(key, deadline)
+
+        early = []
+        fired = set()
+        now = 0.0
+        while now < max(deadlines.values()) + 1:
+            now += 0.5
+            for key in wheel.advance(now):
+                if deadlines[key] > now:
+                    early.append((key, deadlines[key], now))
+                fired.add(key)
+
+        self.record("No timer fired early", not early, f"early: {early[:3]}")
+        self.record("Every timer fired", fired == set(deadlines), f"{len(deadlines) - len(fired)} never fired")
+        self.record("Wheel drained", len(wheel) == 0, f"{len(wheel)} timers left")
+
+    def test_cancel_and_reschedule(self):
+        """Cancelled keys never fire; rescheduling replaces the deadline"""
+        print("\n🔍 Cancel and reschedule...")
+        wheel = TimerWheel(now=0.0)
+        wheel.schedule("cancelled", 10.0)
+        wheel.schedule("moved", 10.0)
+        wheel.cancel("cancelled")
+        wheel.schedule("moved", 20.0)
+
+        fired = wheel.advance(15.0)
+        self.record("Nothing fired before the new deadline", fired == [], f"fired {fired}")
+        fired = wheel.advance(20.0)
+        self.record("Rescheduled key fired once", fired == ["moved"], f"fired {fired}")
+
+
+def main():
+    tester = TimerWheelTester()
+    tests = [
+        tester.test_fractional_deadline,
+        tester.test_fractional_start,
+        tester.test_past_deadline,
+        tester.test_cascade,
+        tester.test_cancel_and_reschedule,
+    ]
+
+    for test in tests:
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ Test {test.__name__} crashed: {e}")
+            tester.failed_tests.append({
+                'test': test.__name__,
+                'error': f"Test crashed: {e}"
+            })
+
+    # Print results
+    print("\n" + "=" * 50)
+    print(f"📊 Test Results: {tester.tests_passed}/{tester.tests_run} passed")
+
+    if tester.failed_tests:
+        print("\n❌ Failed Tests:")
+        for failure in tester.failed_tests:
+            print(f"   - {failure.get('test', 'Unknown')}: {failure.get('error', 'Unknown error')}")
+
+    return 0 if not tester.failed_tests and tester.tests_passed == tester.tests_run else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())